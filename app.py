@@ -1,15 +1,27 @@
 import os
 from datetime import datetime
-from flask import Flask, request, redirect, url_for, session, render_template_string, Response
+from flask import Flask, request, redirect, url_for, session, render_template_string, Response, g
 from flask_sqlalchemy import SQLAlchemy
 import csv, io
+import threading
+import atexit
+from collections import namedtuple, OrderedDict
 from flask import Response
 from flask import send_from_directory
 from werkzeug.utils import secure_filename
-from datetime import datetime, timedelta
+from urllib.parse import quote
+from datetime import datetime, timedelta, date
 from sqlalchemy import text  # en haut du fichier si pas déjà importé
 import smtplib
+import time
 from email.message import EmailMessage
+from concurrent.futures import ThreadPoolExecutor
+
+# Pillow (optionnel) : sans lui, pas de déclinaisons de plan, l'original reste servi
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
 
 
 
@@ -34,8 +46,8 @@ if DATABASE_URL.startswith("postgres://"):
 elif DATABASE_URL.startswith("postgresql://"):
     DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+psycopg://", 1)
 
-# Forcer SSL sur Render si manquant
-if DATABASE_URL and "sslmode=" not in DATABASE_URL:
+# Forcer SSL sur Render si manquant (Postgres uniquement : une URL sqlite:// reste telle quelle)
+if DATABASE_URL.startswith("postgresql") and "sslmode=" not in DATABASE_URL:
     sep = "&" if "?" in DATABASE_URL else "?"
     DATABASE_URL = f"{DATABASE_URL}{sep}sslmode=require"
 
@@ -48,13 +60,6 @@ app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 # --- DB ---
 db = SQLAlchemy(app)
 
-# (optionnel) créer les tables si absentes; n'efface rien si elles existent
-with app.app_context():
-    try:
-        db.create_all()
-    except Exception as e:
-        app.logger.error(f"DB init error: {e}")
-
 
 
 
@@ -75,14 +80,17 @@ if db:
         status = db.Column(db.String(20), default='open')  # open | closed
         created_at = db.Column(db.DateTime, default=datetime.utcnow)
         closes_at = db.Column(db.DateTime, nullable=True)
-        plan_data = db.Column(db.LargeBinary)      # contenu binaire (image/PDF)
+        season = db.Column(db.String(40), index=True)  # ex. "2025" (classement général)
+        # Plan : seules les métadonnées sont sur la manche, les octets sont dans plan_blob
+        plan_hash = db.Column(db.String(64), index=True)  # sha256 du contenu (clé de PlanBlob)
+        plan_size = db.Column(db.Integer)          # taille en octets
         plan_mime = db.Column(db.String(120))      # ex: image/png, application/pdf
         plan_name = db.Column(db.String(255))      # nom de fichier d'origine
 
 
     class TimeEntry(db.Model):
         id = db.Column(db.Integer, primary_key=True)
-        user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+        user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
         round_id = db.Column(db.Integer, db.ForeignKey('round.id'), nullable=False)
 
         # temps brut en millisecondes (on convertira le format saisi ensuite)
@@ -166,21 +174,624 @@ class LoginEvent(db.Model):
     ua_type = db.Column(db.String(16))  # 'mobile' ou 'desktop'
 
 
+class ActivityDay(db.Model):
+    """Agrégat quotidien de login_event (jours clos uniquement, voir compact_activity)."""
+    __tablename__ = "activity_day"
+    day = db.Column(db.Date, primary_key=True)
+    logins = db.Column(db.Integer, nullable=False, default=0)
+    logins_mobile = db.Column(db.Integer, nullable=False, default=0)
+    logins_desktop = db.Column(db.Integer, nullable=False, default=0)
+    users = db.Column(db.Integer, nullable=False, default=0)  # utilisateurs distincts du jour
+
+
+class ActivitySketch(db.Model):
+    """Utilisateurs distincts d'une heure ou d'un jour clos (DistinctSketch sérialisé)."""
+    __tablename__ = "activity_sketch"
+    kind = db.Column(db.String(4), primary_key=True)   # 'hour' | 'day'
+    start = db.Column(db.DateTime, primary_key=True)   # début du créneau (UTC)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+
+class RoundStanding(db.Model):
+    """Classement matérialisé d'une manche (une ligne par chrono validé).
+
+    Tenu à jour par les endpoints qui changent l'ensemble des chronos validés
+    (validation, rejet, suppressions) : la page publique ne fait plus qu'une
+    lecture indexée par (round_id, rank).
+    """
+    __tablename__ = "round_standing"
+    id = db.Column(db.Integer, primary_key=True)
+    round_id = db.Column(db.Integer, db.ForeignKey("round.id"), nullable=False)
+    time_entry_id = db.Column(db.Integer, db.ForeignKey("time_entry.id"), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), index=True, nullable=False)
+
+    rank = db.Column(db.Integer, nullable=False, default=0)
+    final_ms = db.Column(db.Integer, nullable=False)
+    pct = db.Column(db.Float, nullable=False, default=0.0)  # % du meilleur
+
+    # copie du chrono + "photo" du pilote au moment du classement
+    raw_time_ms = db.Column(db.Integer, nullable=False)
+    penalties = db.Column(db.Integer, default=0)
+    bike = db.Column(db.String(120))
+    youtube_link = db.Column(db.String(500))
+    pilot_name = db.Column(db.String(255))
+    nationality = db.Column(db.String(100))
+
+    # version "round:<id>" à laquelle la ligne a changé pour la dernière fois (diffs de l'API)
+    changed_version = db.Column(db.Integer)
+
+    __table_args__ = (
+        db.Index("ix_round_standing_round_rank", "round_id", "rank"),
+    )
+
+
+# Règlement par défaut d'une nouvelle saison (modifiable ensuite dans /admin/seasons)
+SEASON_DEFAULT_POINTS = os.getenv("SEASON_POINTS", "25,20,16,13,11,10,9,8,7,6,5,4,3,2,1")
+SEASON_DEFAULT_MODE = os.getenv("SEASON_MODE", "points")    # points | pct
+SEASON_DEFAULT_BEST_N = int(os.getenv("SEASON_BEST_N", "0"))  # 0 = toutes les manches comptent
+
+
+class Season(db.Model):
+    """Règlement du classement général d'une saison."""
+    __tablename__ = "season"
+    key = db.Column(db.String(40), primary_key=True)
+    mode = db.Column(db.String(10), nullable=False, default=SEASON_DEFAULT_MODE)
+    points = db.Column(db.String(255), nullable=False, default=SEASON_DEFAULT_POINTS)  # barème par rang
+    best_n = db.Column(db.Integer, nullable=False, default=SEASON_DEFAULT_BEST_N)       # meilleures manches retenues
+
+
+class SeasonStanding(db.Model):
+    """Classement général matérialisé (une ligne par pilote et par saison).
+
+    Recalculé depuis round_standing (jamais depuis les chronos bruts) au commit de
+    toute transaction qui a touché le classement d'une manche de la saison.
+    """
+    __tablename__ = "season_standing"
+    id = db.Column(db.Integer, primary_key=True)
+    season = db.Column(db.String(40), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    rank = db.Column(db.Integer, nullable=False)
+    total = db.Column(db.Float, nullable=False)
+    rounds_played = db.Column(db.Integer, nullable=False)
+    rounds_counted = db.Column(db.Integer, nullable=False)
+    detail = db.Column(db.Text, nullable=False)  # JSON {round_id: [score, retenue]}
+    pilot_name = db.Column(db.String(255))
+    nationality = db.Column(db.String(100))
+
+    __table_args__ = (
+        db.UniqueConstraint("season", "user_id", name="uniq_season_user"),
+        db.Index("ix_season_standing_rank", "season", "rank"),
+    )
+
+
+class StandingRemoval(db.Model):
+    """Trace des lignes retirées d'un classement, pour les diffs ?since=<version> de l'API."""
+    __tablename__ = "standing_removal"
+    id = db.Column(db.Integer, primary_key=True)
+    round_id = db.Column(db.Integer, nullable=False)
+    time_entry_id = db.Column(db.Integer, nullable=False)
+    version = db.Column(db.Integer)  # posée par rerank_round dans la même transaction
+
+    __table_args__ = (
+        db.Index("ix_standing_removal_round_version", "round_id", "version"),
+    )
+
+
+class CacheVersion(db.Model):
+    """
+    Compteurs de version partagés par tous les workers ("round:<id>", "rounds", ...).
+    Incrémentés dans la même transaction que l'écriture qui change la page :
+    un cache clé+version n'a jamais besoin d'être purgé, il suffit de relire le compteur.
+    """
+    __tablename__ = "cache_version"
+    key = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class PlanBlob(db.Model):
+    """Stockage adressé par contenu des plans de manche (clé = sha256 des octets)."""
+    __tablename__ = "plan_blob"
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    mime = db.Column(db.String(120))
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class PlanVariant(db.Model):
+    """Déclinaison redimensionnée (WebP) d'un plan, stockée elle aussi dans plan_blob."""
+    __tablename__ = "plan_variant"
+    id = db.Column(db.Integer, primary_key=True)
+    source_sha = db.Column(db.String(64), index=True, nullable=False)  # plan d'origine
+    variant = db.Column(db.String(16), nullable=False)                 # thumb | mobile | full
+    blob_sha = db.Column(db.String(64), nullable=False)                # octets dans plan_blob
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    mime = db.Column(db.String(120), nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint("source_sha", "variant", name="uniq_plan_variant"),
+    )
+
+
+class OutboxEmail(db.Model):
+    """E-mail en attente d'envoi (livré par le Mailer en arrière-plan, jamais dans la requête)."""
+    __tablename__ = "email_outbox"
+    id = db.Column(db.Integer, primary_key=True)
+    to_email = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default="pending")  # pending | sending | sent | dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # ou fin du bail si "sending"
+    claim = db.Column(db.String(32))                                     # lot qui détient la ligne
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index("ix_outbox_due", "status", "next_attempt_at"),
+    )
+
+
+def ensure_columns(conn, table: str, columns: dict) -> set:
+    """Ajoute les colonnes manquantes {nom: type SQL} d'une table existante. Renvoie les colonnes présentes avant."""
+    from sqlalchemy import inspect
+    cols = {c["name"] for c in inspect(conn).get_columns(table)}
+    for name, ddl in columns.items():
+        if name not in cols:
+            conn.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN {name} {ddl}')
+    return cols
+
+
+def migrate_plan_storage():
+    """
+    Ajoute plan_hash/plan_size sur "round" si besoin, puis déplace les anciens
+    round.plan_data vers plan_blob (la colonne historique est vidée, pas supprimée).
+    Idempotent : peut tourner à chaque démarrage.
+    """
+    import hashlib
+    with db.engine.begin() as conn:
+        cols = ensure_columns(conn, "round", {"plan_hash": "VARCHAR(64)", "plan_size": "INTEGER"})
+        if "plan_data" not in cols:
+            return
+        legacy = conn.execute(text(
+            'SELECT id, plan_data, plan_mime FROM "round" '
+            'WHERE plan_data IS NOT NULL AND plan_hash IS NULL'
+        )).all()
+        for rid, data, mime in legacy:
+            data = bytes(data)
+            sha = hashlib.sha256(data).hexdigest()
+            exists = conn.execute(
+                text("SELECT 1 FROM plan_blob WHERE sha256 = :h"), {"h": sha}
+            ).first()
+            if not exists:
+                conn.execute(
+                    PlanBlob.__table__.insert(),
+                    {"sha256": sha, "size": len(data), "mime": mime,
+                     "data": data, "created_at": datetime.utcnow()},
+                )
+            conn.execute(
+                text('UPDATE "round" SET plan_hash = :h, plan_size = :n, plan_data = NULL WHERE id = :id'),
+                {"h": sha, "n": len(data), "id": rid},
+            )
+
+
+# (optionnel) créer les tables si absentes; n'efface rien si elles existent
+# (après la déclaration des modèles, sinon create_all ne voit aucune table)
+with app.app_context():
+    try:
+        db.create_all()
+        migrate_plan_storage()
+        with db.engine.begin() as conn:
+            ensure_columns(conn, "round_standing", {"changed_version": "INTEGER"})
+            # bases créées avant l'index (compteurs par pilote de /admin/users)
+            conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_time_entry_user_id ON time_entry (user_id)")
+            if "season" not in ensure_columns(conn, "round", {"season": "VARCHAR(40)"}):
+                # manches existantes : saison = année de création
+                for rid, created in conn.execute(text('SELECT id, created_at FROM "round"')).all():
+                    if created and not isinstance(created, datetime):
+                        created = datetime.fromisoformat(str(created))
+                    year = str((created or datetime.utcnow()).year)
+                    conn.execute(text('UPDATE "round" SET season = :s WHERE id = :id'), {"s": year, "id": rid})
+            if conn.dialect.name == "postgresql":
+                # bases où season_standing.nationality a été créée en VARCHAR(80) : alignée sur
+                # user / round_standing, une seule fois (l'ALTER réécrit la table)
+                width = conn.execute(text(
+                    "SELECT character_maximum_length FROM information_schema.columns "
+                    "WHERE table_name = 'season_standing' AND column_name = 'nationality'"
+                )).scalar()
+                if width is not None and width < 100:
+                    conn.exec_driver_sql("ALTER TABLE season_standing ALTER COLUMN nationality TYPE VARCHAR(100)")
+    except Exception as e:
+        app.logger.error(f"DB init error: {e}")
+
+
 def _ua_type(ua: str) -> str:
     ua = (ua or "").lower()
     return "mobile" if ("mobi" in ua or "android" in ua or "iphone" in ua) else "desktop"
 
 
+# --- Événements analytiques : écriture différée par lots ---
+EVENT_FLUSH_SIZE = int(os.getenv("EVENT_FLUSH_SIZE", "100"))         # lignes → flush immédiat
+EVENT_FLUSH_INTERVAL = float(os.getenv("EVENT_FLUSH_INTERVAL", "2"))  # s max. en mémoire
+EVENT_QUEUE_MAX = int(os.getenv("EVENT_QUEUE_MAX", "10000"))         # au-delà : on jette
+
+
+class EventRecorder:
+    """
+    Tampon d'écriture pour une table d'événements en ajout seul (connexions, etc.) :
+    record() ne touche pas la base ; un thread vide le tampon en UN INSERT multi-lignes
+    dès EVENT_FLUSH_SIZE lignes ou toutes les EVENT_FLUSH_INTERVAL secondes, et à la
+    sortie du worker. File bornée : sous la charge, les événements en trop sont
+    comptés dans `dropped` plutôt que de ralentir les requêtes.
+    """
+
+    def __init__(self, table, flush_size=EVENT_FLUSH_SIZE, flush_interval=EVENT_FLUSH_INTERVAL,
+                 max_pending=EVENT_QUEUE_MAX):
+        self.table = table
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._buf = []
+        self._lock = threading.Lock()
+        self._kick = threading.Event()
+        self._thread = None
+        EVENT_RECORDERS.append(self)
+
+    def record(self, **row) -> bool:
+        """Ajoute une ligne (toutes les lignes d'un recorder ont les mêmes colonnes)."""
+        with self._lock:
+            if len(self._buf) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._buf.append(row)
+            full = len(self._buf) >= self.flush_size
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=f"events-{self.table.name}", daemon=True
+                )
+                self._thread.start()
+        if full:
+            self._kick.set()
+        return True
+
+    def _run(self):
+        while True:
+            self._kick.wait(self.flush_interval)
+            self._kick.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                app.logger.error(f"EventRecorder({self.table.name}) error: {e}")
+
+    def flush(self) -> int:
+        """Écrit le tampon maintenant. Renvoie le nombre de lignes insérées."""
+        from sqlalchemy.exc import IntegrityError
+        with self._lock:
+            rows, self._buf = self._buf, []
+        if not rows:
+            return 0
+        with app.app_context():
+            try:
+                with db.engine.begin() as conn:
+                    for k in range(0, len(rows), 500):
+                        conn.execute(self.table.insert().values(rows[k:k + 500]))
+                return len(rows)
+            except IntegrityError:
+                # une ligne invalide (ex. compte supprimé entre-temps) : on sauve les autres
+                saved = 0
+                with db.engine.connect() as conn:
+                    for row in rows:
+                        try:
+                            with conn.begin():
+                                conn.execute(self.table.insert().values(row))
+                            saved += 1
+                        except IntegrityError:
+                            pass
+                return saved
+            except Exception:
+                # base indisponible : on remet les lignes en tête, dans la limite de la file
+                with self._lock:
+                    room = max(self.max_pending - len(self._buf), 0)
+                    self.dropped += max(len(rows) - room, 0)
+                    self._buf[:0] = rows[max(len(rows) - room, 0):] if room else []
+                raise
+
+
+EVENT_RECORDERS = []
+
+
+def flush_event_recorders():
+    """Vide tous les tampons (sortie du worker : atexit / hook gunicorn worker_exit)."""
+    for rec in EVENT_RECORDERS:
+        try:
+            rec.flush()
+        except Exception as e:
+            app.logger.error(f"EventRecorder({rec.table.name}) flush error: {e}")
+
+
+atexit.register(flush_event_recorders)
+
+login_events = EventRecorder(LoginEvent.__table__)
+
+
+# --- Comptage approximatif d'utilisateurs distincts (HyperLogLog) ---
+HLL_P = 12            # 2^12 = 4096 registres d'un octet (4 Ko par sketch)
+HLL_M = 1 << HLL_P
+HLL_EXACT_MAX = 512   # jusque-là on garde les ids eux-mêmes : compte exact
+
+
+def _hll_hash(uid: int) -> int:
+    import hashlib
+    return int.from_bytes(hashlib.blake2b(str(uid).encode(), digest_size=8).digest(), "little")
+
+
+class DistinctSketch:
+    """
+    Ensemble d'utilisateurs distincts, fusionnable (a |= b), pour compter les actifs sur
+    n'importe quelle fenêtre en combinant des sketches d'heures / de jours.
+      - mode exact : l'ensemble des ids tant qu'il en compte au plus HLL_EXACT_MAX ;
+      - mode HLL   : 4096 registres, erreur type 1,04/√4096 ≈ 1,6 % (≈ 3,3 % à 95 %),
+        avec la correction « linear counting » pour les petits cardinaux.
+    La fusion est sans perte : sketch(A) | sketch(B) == sketch(A ∪ B).
+    """
+
+    __slots__ = ("ids", "regs")
+
+    def __init__(self, ids=()):
+        self.ids = set(ids)
+        self.regs = None
+        if len(self.ids) > HLL_EXACT_MAX:
+            self._promote()
+
+    @property
+    def exact(self) -> bool:
+        return self.regs is None
+
+    def _promote(self):
+        self.regs = bytearray(HLL_M)
+        for uid in self.ids:
+            self._add_hashed(_hll_hash(uid))
+        self.ids = None
+
+    def _add_hashed(self, h: int):
+        idx = h & (HLL_M - 1)
+        w = h >> HLL_P
+        rank = (64 - HLL_P) - w.bit_length() + 1
+        if rank > self.regs[idx]:
+            self.regs[idx] = rank
+
+    def add(self, uid: int):
+        if self.regs is None:
+            self.ids.add(uid)
+            if len(self.ids) > HLL_EXACT_MAX:
+                self._promote()
+        else:
+            self._add_hashed(_hll_hash(uid))
+
+    def __ior__(self, other):
+        if other.regs is None:
+            for uid in other.ids:
+                self.add(uid)
+            return self
+        if self.regs is None:
+            self._promote()
+        self.regs = bytearray(map(max, self.regs, other.regs))
+        return self
+
+    def __len__(self) -> int:
+        import math
+        if self.regs is None:
+            return len(self.ids)
+        alpha = 0.7213 / (1 + 1.079 / HLL_M)
+        est = alpha * HLL_M * HLL_M / sum(2.0 ** -r for r in self.regs)
+        zeros = self.regs.count(0)
+        if est <= 2.5 * HLL_M and zeros:
+            est = HLL_M * math.log(HLL_M / zeros)
+        return int(round(est))
+
+    def to_bytes(self) -> bytes:
+        import struct
+        if self.regs is None:
+            ids = sorted(self.ids)
+            return b"E" + struct.pack(f"<{len(ids)}I", *ids)
+        return b"H" + bytes(self.regs)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "DistinctSketch":
+        import struct
+        data = bytes(data)
+        sk = cls()
+        if data[:1] == b"H":
+            sk.ids = None
+            sk.regs = bytearray(data[1:])
+        else:
+            sk.ids = set(struct.unpack(f"<{(len(data) - 1) // 4}I", data[1:]))
+        return sk
+
+
+def _hour_bucket(col):
+    """Début d'heure d'une colonne datetime, côté SQL (Postgres / SQLite)."""
+    if db.engine.dialect.name == "postgresql":
+        return db.func.date_trunc("hour", col)
+    return db.func.strftime("%Y-%m-%d %H:00:00", col)
+
+
+def _as_datetime(v) -> datetime:
+    return v if isinstance(v, datetime) else datetime.fromisoformat(str(v))
+
+
+# --- Agrégats d'activité (page /admin/stats) ---
+# Un jour n'est compacté qu'une fois clos depuis ACTIVITY_SETTLE (événements encore
+# en tampon dans les workers) ; le jour en cours est lu directement dans login_event.
+ACTIVITY_SETTLE = timedelta(minutes=5)
+LOGIN_EVENT_RETENTION_DAYS = int(os.getenv("LOGIN_EVENT_RETENTION_DAYS", "0"))  # 0 = tout garder
+
+
+def compact_activity(now=None) -> int:
+    """
+    Compacte login_event pour chaque jour clos pas encore traité (une requête agrégée
+    par jour) : ligne activity_day + sketches d'utilisateurs distincts par heure et pour
+    le jour. Idempotent, sûr entre workers. Renvoie le nombre de jours compactés.
+    """
+    from sqlalchemy import func, case
+    from sqlalchemy.exc import IntegrityError
+    now = now or datetime.utcnow()
+    last_closed = (now - ACTIVITY_SETTLE).date() - timedelta(days=1)
+
+    done = db.session.query(func.max(ActivityDay.day)).scalar()
+    if done is None:
+        first = db.session.query(func.min(LoginEvent.created_at)).scalar()
+        if first is None:
+            return 0
+        day = first.date()
+    else:
+        day = done + timedelta(days=1)
+
+    n = 0
+    while day <= last_closed:
+        start = datetime.combine(day, datetime.min.time())
+        end = start + timedelta(days=1)
+        hour = _hour_bucket(LoginEvent.created_at)
+        rows = (
+            db.session.query(
+                LoginEvent.user_id,
+                hour,
+                func.count(LoginEvent.id),
+                func.sum(case((LoginEvent.ua_type == "mobile", 1), else_=0)),
+            )
+            .filter(LoginEvent.created_at >= start, LoginEvent.created_at < end)
+            .group_by(LoginEvent.user_id, hour)
+            .all()
+        )
+        hours = {}
+        for uid, h, _, _ in rows:
+            hours.setdefault(_as_datetime(h), set()).add(uid)
+        day_users = {uid for uid, _, _, _ in rows}
+        try:
+            sketches = [
+                {"kind": "hour", "start": h, "data": DistinctSketch(ids).to_bytes()}
+                for h, ids in sorted(hours.items())
+            ]
+            if day_users:
+                sketches.append({"kind": "day", "start": start, "data": DistinctSketch(day_users).to_bytes()})
+                db.session.execute(ActivitySketch.__table__.insert(), sketches)
+            logins = sum(c for _, _, c, _ in rows)
+            mobile = sum(m or 0 for _, _, _, m in rows)
+            db.session.add(ActivityDay(
+                day=day, logins=logins, logins_mobile=mobile,
+                logins_desktop=logins - mobile, users=len(day_users),
+            ))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # compacté en parallèle par un autre worker
+        day += timedelta(days=1)
+        n += 1
+
+    if n and LOGIN_EVENT_RETENTION_DAYS > 0:
+        cutoff = datetime.combine(last_closed, datetime.min.time()) - timedelta(days=LOGIN_EVENT_RETENTION_DAYS)
+        LoginEvent.query.filter(LoginEvent.created_at < cutoff).delete(synchronize_session=False)
+        db.session.commit()
+    return n
+
+
+ACTIVITY_COMPACT_INTERVAL = float(os.getenv("ACTIVITY_COMPACT_INTERVAL", "3600"))  # s
+
+
+class ActivityCompactor:
+    """
+    Lance compact_activity en arrière-plan, un thread par process : au démarrage puis
+    toutes les ACTIVITY_COMPACT_INTERVAL secondes. Un premier déploiement avec un an
+    d'historique (et la purge de rétention) ne se fait donc jamais pendant une requête ;
+    en attendant, /admin/stats lit les jours non compactés dans login_event.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def wake(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="activity-compactor", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            try:
+                with app.app_context():
+                    compact_activity()
+            except Exception as e:
+                app.logger.error(f"Activity compaction error: {e}")
+            self._wake.wait(ACTIVITY_COMPACT_INTERVAL)
+            self._wake.clear()
+
+
+COMPACTOR = ActivityCompactor()
+COMPACTOR.wake()
+
+
+def distinct_users(start: datetime, end=None):
+    """
+    Utilisateurs distincts actifs dans [start, end) → (nombre, exact ?).
+      - jours compactés entièrement couverts → sketches "day" ;
+      - bords de fenêtre compactés          → sketches "hour" (précision : l'heure) ;
+      - après le dernier jour compacté      → ids lus dans login_event (~1 jour en régime).
+    Une requête pour les sketches + une pour la partie vivante.
+    """
+    from sqlalchemy import or_, and_
+    end = end or datetime.utcnow()
+    done = db.session.query(db.func.max(ActivityDay.day)).scalar()
+    compacted_end = datetime.combine(done + timedelta(days=1), datetime.min.time()) if done else start
+
+    sk = DistinctSketch()
+    c_end = min(end, compacted_end)
+    if start < c_end:
+        h0 = start.replace(minute=0, second=0, microsecond=0)
+        h1 = c_end.replace(minute=0, second=0, microsecond=0)
+        if h1 < c_end:
+            h1 += timedelta(hours=1)
+        d0 = datetime.combine(h0.date(), datetime.min.time())
+        if d0 < h0:
+            d0 += timedelta(days=1)
+        d1 = datetime.combine(h1.date(), datetime.min.time())
+        if d0 < d1:
+            cond = or_(
+                and_(ActivitySketch.kind == "day", ActivitySketch.start >= d0, ActivitySketch.start < d1),
+                and_(ActivitySketch.kind == "hour", ActivitySketch.start >= h0, ActivitySketch.start < d0),
+                and_(ActivitySketch.kind == "hour", ActivitySketch.start >= d1, ActivitySketch.start < h1),
+            )
+        else:
+            cond = and_(ActivitySketch.kind == "hour", ActivitySketch.start >= h0, ActivitySketch.start < h1)
+        for (data,) in db.session.query(ActivitySketch.data).filter(cond):
+            sk |= DistinctSketch.from_bytes(data)
+
+    live_start = max(start, compacted_end)
+    if live_start < end:
+        sk |= DistinctSketch(
+            uid for (uid,) in
+            db.session.query(LoginEvent.user_id)
+            .filter(LoginEvent.created_at >= live_start, LoginEvent.created_at < end)
+            .distinct()
+        )
+    return len(sk), sk.exact
+
+
 def log_login(u):
     if not (db and u):
         return
-    try:
-        ua = request.headers.get("User-Agent", "")
-        ev = LoginEvent(user_id=u.id, ua=(ua or "")[:200], ua_type=_ua_type(ua))
-        db.session.add(ev)
-        db.session.commit()
-    except Exception:
-        db.session.rollback()
+    ua = request.headers.get("User-Agent", "")
+    login_events.record(
+        user_id=u.id,
+        created_at=datetime.utcnow(),
+        ua=(ua or "")[:200],
+        ua_type=_ua_type(ua),
+    )
 
 
 # Emails admin (en minuscules)
@@ -196,33 +807,96 @@ SMTP_HOST = os.getenv("SMTP_HOST", "")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 SMTP_USER = os.getenv("SMTP_USER", "")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"  # 0 pour un relais local de test
 EMAIL_FROM = os.getenv("EMAIL_FROM", SMTP_USER or "no-reply@wp-challenge.local")
 
+# Boîte d'envoi : lots, bail, tentatives et délais de nouvelle tentative (secondes)
+MAIL_BATCH = int(os.getenv("MAIL_BATCH", "20"))
+MAIL_LEASE = 300            # une ligne "sending" abandonnée (worker tué) redevient éligible
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "6"))
+MAIL_BACKOFF_BASE = 30      # 30 s, 1 min, 2 min, 4 min… plafonné
+MAIL_BACKOFF_MAX = 3600
+MAIL_IDLE_POLL = 30         # relecture de la boîte quand personne ne réveille le worker
+
+
+# Instantané d'identité dans la session (cookie signé par SECRET_KEY) :
+# les pages publiques n'ont alors plus besoin de lire la table "user".
+IDENTITY_SNAPSHOT = os.getenv("IDENTITY_SNAPSHOT", "1") == "1"
+
+# Identité légère (id, nom affiché, admin) : ce qu'il faut pour la nav et les droits
+Identity = namedtuple("Identity", "id name is_admin")
+
 
 # --- Helpers utilisateur ---
+def _elevate_if_admin(u):
+    """Pose le flag admin en base si l'email est dans ADMIN_EMAILS (appelé à la connexion)."""
+    email = (u.email or "").strip().lower()
+    if email in ADMIN_EMAILS and not getattr(u, "is_admin", False):
+        u.is_admin = True
+
+
+def _snapshot(u) -> dict:
+    return {"id": u.id, "name": display_name(u), "admin": bool(getattr(u, "is_admin", False))}
+
+
+def start_session(u):
+    """Ouvre la session d'un utilisateur : élévation admin éventuelle + instantané signé."""
+    _elevate_if_admin(u)
+    db.session.commit()
+    session["user_id"] = u.id
+    if IDENTITY_SNAPSHOT:
+        session["ident"] = _snapshot(u)
+    g.pop("_current_user", None)
+    g.pop("_identity", None)
+
+
+def end_session():
+    session.pop("user_id", None)
+    session.pop("ident", None)
+
+
 def current_user():
+    """Utilisateur connecté (objet User), lu au plus une fois par requête."""
     if not db:
         return None
+    if "_current_user" in g:
+        return g._current_user
+    u = None
     uid = session.get("user_id")
-    if not uid:
-        return None
-    u = db.session.get(User, uid)
-    if not u:
-        return None
-    # Auto-élévation : si l’email est dans ADMIN_EMAILS, on pose le flag en base
-    email = (u.email or "").strip().lower()
-    if email in ADMIN_EMAILS and not getattr(u, "is_admin", False):
-        u.is_admin = True
-        db.session.commit()
+    if uid:
+        u = db.session.get(User, uid)
+        if u is None:
+            # compte supprimé : on nettoie la session
+            end_session()
+    g._current_user = u
     return u
 
 
+def current_identity():
+    """
+    Identité de la requête (Identity ou None), résolue une seule fois.
+    Anonyme → aucune requête ; connecté → instantané de session, sans lecture en base.
+    """
+    if "_identity" in g:
+        return g._identity
+    ident = None
+    uid = session.get("user_id")
+    snap = session.get("ident") if IDENTITY_SNAPSHOT else None
+    if uid and snap and snap.get("id") == uid:
+        ident = Identity(uid, snap.get("name") or "—", bool(snap.get("admin")))
+    elif uid:
+        u = current_user()
+        if u is not None:
+            ident = Identity(u.id, display_name(u), bool(u.is_admin))
+            if IDENTITY_SNAPSHOT:
+                session["ident"] = _snapshot(u)  # ancienne session : on pose l'instantané
+    g._identity = ident
+    return ident
+
+
 def is_admin(u):
-    if not u:
-        return False
-    email = (u.email or "").strip().lower()
-    # admin si le flag DB est vrai OU si l’email est dans la liste
-    return bool(getattr(u, "is_admin", False) or email in ADMIN_EMAILS)
+    """u : User ou Identity. Le flag est posé à la connexion (voir start_session)."""
+    return bool(u and getattr(u, "is_admin", False))
 
 def display_name(user):
     return (user.pseudo or user.email) if user else "—"
@@ -237,42 +911,84 @@ def parse_time_to_ms(s: str) -> int:
       - "ss.ms"    ex: "83.456"
       - "ss"       ex: "83"  (secondes entières)
     Retourne le temps en millisecondes (int). Lève ValueError si invalide.
+    Même grammaire que l'import CSV : délègue à parse_times_batch.
     """
-    s = (s or "").strip()
-    if not s:
-        raise ValueError("Temps vide")
-    if ":" in s:
-        # formats avec minutes:secondes(.ms)
-        parts = s.split(":")
-        if len(parts) != 2:
-            raise ValueError("Format temps invalide (attendu mm:ss[.ms])")
-        m_str, rest = parts
-        if "." in rest:
-            sec_str, ms_str = rest.split(".", 1)
-            ms_str = (ms_str + "000")[:3]  # normalise milli en 3 chiffres
-            minutes = int(m_str)
-            seconds = int(sec_str)
-            millis = int(ms_str)
+    ms, codes = parse_times_batch([s])
+    if codes[0]:
+        raise ValueError(TIME_ERRORS[codes[0]])
+    return ms[0]
+
+# Codes d'erreur de parse_times_batch → message affiché
+TIME_ERRORS = {
+    "empty": "Temps vide",
+    "format": "Format temps invalide (attendu mm:ss[.ms])",
+    "seconds": "Minutes/secondes invalides",
+}
+_MS_PAD = ("000", "00", "0", "")
+
+
+def parse_times_batch(values):
+    """
+    Convertit une colonne entière de temps en une passe ; retourne (ms, codes), deux
+    listes alignées sur values. ms[i] vaut None quand codes[i] est un code de TIME_ERRORS.
+
+    Grammaire unique des temps (le formulaire passe aussi par ici via parse_time_to_ms) :
+    [minutes ":"] secondes ["." millièmes], ou ".millièmes" ; au-delà de 3 décimales les
+    suivantes sont ignorées. Tout est calculé en entiers et rien ne lève. Signes, "_",
+    espaces internes et "." seul sont refusés (l'ancien int()/float() les laissait passer).
+    """
+    ms_out, codes = [], []
+    push, code = ms_out.append, codes.append
+    for v in values:
+        try:
+            head, colon, rest = v.strip().partition(":")
+        except AttributeError:
+            push(None)
+            code("empty" if v is None else "format")
+            continue
+        if colon:
+            sec, _, frac = rest.partition(".")
+            if not (sec.isdecimal() and head.isdecimal()):
+                push(None)
+                code("format")
+                continue
+            seconds = int(sec)
+            if seconds >= 60:
+                push(None)
+                code("seconds")
+                continue
+            seconds += int(head) * 60
         else:
-            minutes = int(m_str)
-            seconds = int(rest)
-            millis = 0
-        if seconds >= 60 or minutes < 0 or seconds < 0:
-            raise ValueError("Minutes/secondes invalides")
-        return minutes * 60000 + seconds * 1000 + millis
-    else:
-        # pas de ":" → soit "ss.ms" soit "ss"
-        if "." in s:
-            sec_str, ms_str = s.split(".", 1)
-            ms_str = (ms_str + "000")[:3]
-            seconds = float(f"{sec_str}.{ms_str}")
-            millis = int(round(float(seconds) * 1000))
-            return millis
-        # entier en secondes
-        seconds = int(s)
-        if seconds < 0:
-            raise ValueError("Temps négatif invalide")
-        return seconds * 1000
+            sec, _, frac = head.partition(".")
+            if sec.isdecimal():
+                seconds = int(sec)
+            elif not sec and frac:  # ".456"
+                seconds = 0
+            else:
+                push(None)
+                code("format" if head else "empty")
+                continue
+        if frac:
+            frac = frac[:3]
+            if not frac.isdecimal():
+                push(None)
+                code("format")
+                continue
+            push(seconds * 1000 + int(frac + _MS_PAD[len(frac)]))
+        else:
+            push(seconds * 1000)
+        code(None)
+    return ms_out, codes
+
+
+def parse_times_to_ms(values) -> list:
+    """
+    Version lot de parse_time_to_ms : une entrée → (ms, None) ou (None, message d'erreur).
+    Ne lève pas : une valeur invalide n'interrompt pas le lot.
+    """
+    ms, codes = parse_times_batch(values)
+    return [(v, TIME_ERRORS[c] if c else None) for v, c in zip(ms, codes)]
+
 
 def ms_to_str(ms: int) -> str:
     ms = int(ms)
@@ -281,41 +997,1119 @@ def ms_to_str(ms: int) -> str:
     milli = ms % 1000
     return f"{m}:{s:02d}.{milli:03d}"
 
-def final_time_ms(raw_ms: int, penalties: int) -> int:
-    return int(raw_ms) + max(0, int(penalties or 0)) * 1000
+def final_time_ms(raw_ms: int, penalties: int) -> int:
+    return int(raw_ms) + max(0, int(penalties or 0)) * 1000
+
+# --- Compteurs de version (cohérence des caches entre workers) ---
+def bump_version(*keys):
+    """Incrémente des compteurs dans la transaction courante (le commit reste à l'appelant)."""
+    from sqlalchemy.exc import IntegrityError
+    for key in dict.fromkeys(keys):
+        updated = (
+            CacheVersion.query
+            .filter_by(key=key)
+            .update(
+                {CacheVersion.version: CacheVersion.version + 1,
+                 CacheVersion.updated_at: datetime.utcnow()},
+                synchronize_session=False,
+            )
+        )
+        if not updated:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(CacheVersion(key=key, version=1))
+            except IntegrityError:
+                # créé entre-temps par un autre worker
+                CacheVersion.query.filter_by(key=key).update(
+                    {CacheVersion.version: CacheVersion.version + 1}, synchronize_session=False
+                )
+        _notify_change(key)
+
+
+def advance_version(key: str, value: int):
+    """
+    Porte un compteur à `value` s'il est plus bas (ex. : id du dernier message d'un fil),
+    dans la transaction courante. Les abonnés SSE reçoivent alors directement ce repère.
+    """
+    from sqlalchemy.exc import IntegrityError
+    updated = (
+        CacheVersion.query
+        .filter(CacheVersion.key == key, CacheVersion.version < value)
+        .update({CacheVersion.version: value, CacheVersion.updated_at: datetime.utcnow()},
+                synchronize_session=False)
+    )
+    if not updated and not db.session.query(CacheVersion.key).filter_by(key=key).first():
+        try:
+            with db.session.begin_nested():
+                db.session.add(CacheVersion(key=key, version=value))
+        except IntegrityError:
+            CacheVersion.query.filter(CacheVersion.key == key, CacheVersion.version < value).update(
+                {CacheVersion.version: value}, synchronize_session=False
+            )
+    _notify_change(key)
+
+
+def _notify_change(key: str):
+    if db.engine.dialect.name == "postgresql":
+        # délivré aux écouteurs (ChangeHub) uniquement au commit
+        db.session.execute(text("SELECT pg_notify(:ch, :key)"), {"ch": HUB_CHANNEL, "key": key})
+
+
+def get_version(key: str) -> int:
+    v = db.session.query(CacheVersion.version).filter_by(key=key).scalar()
+    return v or 0
+
+
+# --- Cache de pages complètes, indexé par (clé, variante, version) ---
+PAGE_CACHE_MAX = int(os.getenv("PAGE_CACHE_MAX", "256"))
+_page_cache = OrderedDict()
+_page_cache_lock = threading.Lock()
+
+
+def versioned_page(key: str, variant: str, build):
+    """
+    Sert la page `key` depuis le cache du worker tant que sa version en base n'a pas
+    bougé : un hit coûte une lecture de compteur, ni SQL métier ni génération HTML.
+    Seules les réponses 200 (build() renvoie une str) sont mises en cache.
+    """
+    version = get_version(key)  # lu AVANT de construire : au pire on cache plus frais
+    ck = (key, variant, version)
+    with _page_cache_lock:
+        html = _page_cache.get(ck)
+        if html is not None:
+            _page_cache.move_to_end(ck)
+            return html
+    result = build()
+    if isinstance(result, str):
+        with _page_cache_lock:
+            _page_cache[ck] = result
+            while len(_page_cache) > PAGE_CACHE_MAX:
+                _page_cache.popitem(last=False)
+    return result
+
+
+def round_key(round_id: int) -> str:
+    return f"round:{round_id}"
+
+
+def chat_key(time_entry_id: int) -> str:
+    """Compteur d'un fil de chat : vaut l'id du dernier message posté."""
+    return f"chat:{time_entry_id}"
+
+
+# --- Diffusion temps réel des changements (SSE) ---
+HUB_CHANNEL = "wp_changes"                                   # canal LISTEN/NOTIFY
+HUB_POLL_INTERVAL = float(os.getenv("HUB_POLL_INTERVAL", "1"))  # hors Postgres
+SSE_HEARTBEAT = 15       # s : commentaire ": ping" pour garder la connexion ouverte
+SSE_QUEUE_MAX = 32       # événements en attente par connexion avant "reset"
+
+
+class ChangeHub:
+    """
+    Un seul écouteur de changements par process, partagé par toutes les connexions SSE :
+      - Postgres : LISTEN/NOTIFY (bump_version notifie au commit) ;
+      - sinon    : relecture périodique des compteurs des clés suivies (1 requête par tour).
+    Chaque nouvelle version est transformée UNE fois en événement, puis copiée dans la
+    file de chaque abonné.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs = {}      # clé -> set(queue.Queue)
+        self._seen = {}      # clé -> dernière version diffusée
+        self._builders = {}  # préfixe ("round:") -> build(clé, version_avant, version) -> (event, data)
+        self._thread = None
+
+    def register(self, prefix: str, build):
+        self._builders[prefix] = build
+
+    def subscribe(self, key: str, version: int):
+        """
+        Abonne une file à `key`, `version` étant la version que la requête vient de lire.
+        Renvoie (file, base) : la file recevra tout ce qui suit `base`, version déjà
+        diffusée par le hub (>= version si d'autres abonnés l'ont fait avancer). L'appelant
+        couvre lui-même l'écart jusqu'à `base` dans son événement initial.
+        """
+        import queue
+        q = queue.Queue(maxsize=SSE_QUEUE_MAX)
+        with self._lock:
+            self._subs.setdefault(key, set()).add(q)
+            base = self._seen.setdefault(key, version)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="change-hub", daemon=True)
+                self._thread.start()
+        return q, base
+
+    def unsubscribe(self, key: str, q):
+        with self._lock:
+            subs = self._subs.get(key)
+            if subs is not None:
+                subs.discard(q)
+                if not subs:
+                    self._subs.pop(key, None)
+                    self._seen.pop(key, None)
+
+    def watched(self) -> list:
+        with self._lock:
+            return list(self._subs)
+
+    # --- boucle d'écoute ---
+    def _run(self):
+        delay = 1
+        while True:
+            try:
+                with app.app_context():
+                    dialect = db.engine.dialect.name
+                if dialect == "postgresql":
+                    self._listen_pg()
+                else:
+                    while True:
+                        self._poll()
+                        time.sleep(HUB_POLL_INTERVAL)
+            except Exception as e:
+                app.logger.error(f"ChangeHub error: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    def _listen_pg(self):
+        import psycopg
+        with app.app_context():
+            url = db.engine.url
+        dsn = url.set(drivername="postgresql").render_as_string(hide_password=False)
+        with psycopg.connect(dsn, autocommit=True) as conn:
+            conn.execute(f"LISTEN {HUB_CHANNEL}")
+            self._poll()  # rattrape ce qui a pu être manqué pendant la (re)connexion
+            for n in conn.notifies():
+                if n.payload in self._subs:
+                    self._poll([n.payload])
+
+    def _poll(self, keys=None):
+        keys = keys if keys is not None else self.watched()
+        if not keys:
+            return
+        with app.app_context():
+            rows = (
+                db.session.query(CacheVersion.key, CacheVersion.version)
+                .filter(CacheVersion.key.in_(keys))
+                .all()
+            )
+            for key, version in rows:
+                self._changed(key, version)
+
+    def _changed(self, key: str, version: int):
+        with self._lock:
+            if key not in self._subs:
+                return  # plus d'abonné : rien à diffuser ni à retenir
+            before = self._seen.get(key, version)  # toujours posée par subscribe
+            if version <= before:
+                return
+            self._seen[key] = version
+            subs = list(self._subs[key])
+        build = next((b for p, b in self._builders.items() if key.startswith(p)), None)
+        if build is None:
+            return
+        event = build(key, before, version)
+        for q in subs:
+            self._offer(q, event)
+
+    @staticmethod
+    def _offer(q, event):
+        import queue
+        try:
+            q.put_nowait(event)
+        except queue.Full:
+            # connexion trop lente : on vide et on demande au client de tout recharger
+            while not q.empty():
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    break
+            q.put_nowait(("reset", event[1], "{}"))
+
+
+HUB = ChangeHub()
+
+
+def sse_event(event: str, version: int, data: str) -> str:
+    return f"id: {version}\nevent: {event}\ndata: {data}\n\n"
+
+
+def sse_stream(key: str, q, initial=None):
+    """Générateur SSE d'un abonné (n'utilise pas la base : la session est déjà rendue)."""
+    import queue
+    try:
+        yield "retry: 3000\n\n"
+        if initial:
+            yield initial
+        while True:
+            try:
+                event, version, data = q.get(timeout=SSE_HEARTBEAT)
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            yield sse_event(event, version, data)
+    finally:
+        HUB.unsubscribe(key, q)
+
+
+# --- Classement matérialisé (round_standing) ---
+def _standing_fields(e) -> dict:
+    pilot = getattr(e, "user", None)
+    return dict(
+        round_id=e.round_id,
+        user_id=e.user_id,
+        final_ms=final_time_ms(e.raw_time_ms or 0, e.penalties),
+        raw_time_ms=int(e.raw_time_ms or 0),
+        penalties=int(e.penalties or 0),
+        bike=e.bike,
+        youtube_link=e.youtube_link,
+        pilot_name=display_name(pilot),
+        nationality=(pilot.nationality if pilot else None),
+    )
+
+
+def refresh_pilot_snapshot(u):
+    """
+    Renommage / changement de nationalité : met à jour la "photo" du pilote dans les
+    classements de ses manches, datée de la nouvelle version de chaque manche pour que
+    les diffs (?since=, SSE) renvoient les lignes renommées. Un UPDATE, un bump par manche.
+    Même chose pour ses lignes du classement général (nom seul : pas de recalcul).
+    """
+    from sqlalchemy import cast, literal_column
+    seasons = [s for (s,) in db.session.query(SeasonStanding.season).filter_by(user_id=u.id)]
+    if seasons:
+        (
+            SeasonStanding.query
+            .filter_by(user_id=u.id)
+            .update(
+                {SeasonStanding.pilot_name: display_name(u),
+                 SeasonStanding.nationality: u.nationality},
+                synchronize_session=False,
+            )
+        )
+        bump_version("seasons", *(season_key(s) for s in seasons))
+
+    rids = [rid for (rid,) in db.session.query(RoundStanding.round_id).filter_by(user_id=u.id).distinct()]
+    if not rids:
+        return
+    bump_version(*(round_key(rid) for rid in rids))
+    version = (
+        db.select(CacheVersion.version)
+        .where(CacheVersion.key == literal_column("'round:'").concat(cast(RoundStanding.round_id, db.String)))
+        .scalar_subquery()
+    )
+    (
+        RoundStanding.query
+        .filter_by(user_id=u.id)
+        .update(
+            {RoundStanding.pilot_name: display_name(u),
+             RoundStanding.nationality: u.nationality,
+             RoundStanding.changed_version: version},
+            synchronize_session=False,
+        )
+    )
+
+
+def rerank_round(round_id: int):
+    """
+    Recalcule rang et % du meilleur d'une manche à partir des lignes déjà
+    matérialisées (pas de relecture des chronos). N'écrit que ce qui change.
+    Ordre identique à l'ancien calcul : temps final, puis le plus récent d'abord.
+    """
+    rows = (
+        RoundStanding.query
+        .filter_by(round_id=round_id)
+        .order_by(RoundStanding.final_ms.asc(), RoundStanding.time_entry_id.desc())
+        .all()
+    )
+    key = round_key(round_id)
+    bump_version(key)
+    version = get_version(key)
+
+    best = rows[0].final_ms if rows else 0
+    for i, st in enumerate(rows, start=1):
+        pct = (st.final_ms / best * 100.0) if st.final_ms > 0 and best > 0 else 0.0
+        if st.rank != i or st.pct != pct or st.changed_version is None:
+            st.rank = i
+            st.pct = pct
+            st.changed_version = version
+    # retraits de cette transaction : datés de la même version
+    (
+        StandingRemoval.query
+        .filter(StandingRemoval.round_id == round_id, StandingRemoval.version.is_(None))
+        .update({StandingRemoval.version: version}, synchronize_session=False)
+    )
+    r = db.session.get(Round, round_id)
+    if r is not None:
+        mark_season_dirty(r.season, round_id)
+    return rows
+
+
+def _record_removals(query):
+    """Note (round_id, time_entry_id) des lignes que `query` s'apprête à supprimer (INSERT … SELECT)."""
+    sel = query.with_entities(RoundStanding.round_id, RoundStanding.time_entry_id).statement
+    db.session.execute(
+        StandingRemoval.__table__.insert().from_select(["round_id", "time_entry_id"], sel)
+    )
+
+
+def standings_upsert(e):
+    """Ajoute (ou met à jour) la ligne de classement d'un chrono validé."""
+    fields = _standing_fields(e)
+    st = RoundStanding.query.filter_by(time_entry_id=e.id).first()
+    if st is None:
+        db.session.add(RoundStanding(time_entry_id=e.id, **fields))
+    else:
+        for k, v in fields.items():
+            setattr(st, k, v)
+        st.changed_version = None  # re-daté par rerank_round
+    db.session.flush()
+
+
+def standings_remove(time_entry_ids) -> set:
+    """Retire des chronos du classement. Renvoie les manches à reclasser."""
+    ids = [i for i in time_entry_ids if i is not None]
+    if not ids:
+        return set()
+    round_ids = {
+        rid for (rid,) in
+        db.session.query(RoundStanding.round_id)
+        .filter(RoundStanding.time_entry_id.in_(ids))
+        .distinct()
+    }
+    if round_ids:
+        q = RoundStanding.query.filter(RoundStanding.time_entry_id.in_(ids))
+        _record_removals(q)
+        q.delete(synchronize_session=False)
+    return round_ids
+
+
+def standings_after_approve(e):
+    """Un chrono vient d'être validé : il remplace les autres lignes du pilote dans la manche."""
+    q = RoundStanding.query.filter(
+        RoundStanding.round_id == e.round_id,
+        RoundStanding.user_id == e.user_id,
+        RoundStanding.time_entry_id != e.id,
+    )
+    _record_removals(q)
+    q.delete(synchronize_session=False)
+    standings_upsert(e)
+    rerank_round(e.round_id)
+
+
+def standings_remove_user(user_id: int) -> set:
+    """Retire un pilote de tous les classements. Renvoie les manches à reclasser."""
+    round_ids = {
+        rid for (rid,) in
+        db.session.query(RoundStanding.round_id)
+        .filter(RoundStanding.user_id == user_id)
+        .distinct()
+    }
+    if round_ids:
+        q = RoundStanding.query.filter_by(user_id=user_id)
+        _record_removals(q)
+        q.delete(synchronize_session=False)
+    return round_ids
+
+
+def rebuild_round_standings(round_id: int):
+    """Reconstruit entièrement le classement d'une manche depuis les chronos validés."""
+    from sqlalchemy.orm import joinedload
+    q = RoundStanding.query.filter_by(round_id=round_id)
+    _record_removals(q)
+    q.delete(synchronize_session=False)
+    entries = (
+        TimeEntry.query
+        .options(joinedload(TimeEntry.user))
+        .filter_by(round_id=round_id, status="approved")
+        .all()
+    )
+    for e in entries:
+        db.session.add(RoundStanding(time_entry_id=e.id, **_standing_fields(e)))
+    db.session.flush()
+    rerank_round(round_id)
+
+
+# Remplissage initial (base existante, table de classement encore vide)
+with app.app_context():
+    try:
+        if RoundStanding.query.first() is None:
+            rids = [
+                rid for (rid,) in
+                db.session.query(TimeEntry.round_id).filter_by(status="approved").distinct()
+            ]
+            for rid in rids:
+                rebuild_round_standings(rid)
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Standings backfill error: {e}")
+
+
+# --- Classement général (saisons) ---
+def season_key(season: str) -> str:
+    return f"season:{season}"
+
+
+def season_config(season: str) -> Season:
+    cfg = db.session.get(Season, season)
+    if cfg is None:
+        cfg = Season(key=season, mode=SEASON_DEFAULT_MODE, points=SEASON_DEFAULT_POINTS,
+                     best_n=SEASON_DEFAULT_BEST_N)
+        db.session.add(cfg)
+    return cfg
+
+
+def round_score(cfg: Season, rank: int, pct: float) -> float:
+    """
+    Score d'un pilote sur une manche :
+      - points : barème selon le rang (0 au-delà du barème) ;
+      - pct    : 100 × meilleur / temps (100 pour le vainqueur, moins pour les suivants).
+    """
+    if cfg.mode == "pct":
+        return round(10000.0 / pct, 2) if pct and pct > 0 else 0.0
+    scale = []
+    for x in (cfg.points or "").split(","):
+        try:
+            scale.append(int(x))
+        except ValueError:
+            pass  # valeur invalide en base : ignorée plutôt que de casser le reclassement
+    return float(scale[rank - 1]) if 0 < rank <= len(scale) else 0.0
+
+
+def mark_season_dirty(season, round_id=None):
+    """
+    Le classement général de `season` sera mis à jour une fois, au commit :
+    round_id donné → seuls les pilotes de cette manche sont recalculés ;
+    sinon (règlement modifié…) → recalcul complet de la saison.
+    """
+    if not season:
+        return
+    dirty = db.session.info.setdefault("dirty_seasons", {})
+    if round_id is None:
+        dirty[season] = None
+    elif dirty.get(season, ()) is not None:
+        dirty.setdefault(season, set()).add(round_id)
+
+
+def _season_pilots(season: str, user_ids=None) -> dict:
+    """Points de chaque pilote dans les manches de la saison : uid -> {scores, name, nat}."""
+    cfg = season_config(season)
+    q = (
+        db.session.query(
+            RoundStanding.round_id, RoundStanding.user_id, RoundStanding.rank, RoundStanding.pct,
+            RoundStanding.pilot_name, RoundStanding.nationality,
+        )
+        .join(Round, Round.id == RoundStanding.round_id)
+        .filter(Round.season == season)
+    )
+    if user_ids is not None:
+        q = q.filter(RoundStanding.user_id.in_(list(user_ids)))
+    per_user = {}
+    for rid, uid, rank, pct, name, nat in q.order_by(Round.created_at.asc(), Round.id.asc()):
+        p = per_user.setdefault(uid, {"scores": [], "name": name, "nat": nat})
+        p["scores"].append((rid, round_score(cfg, rank, pct)))
+        p["name"], p["nat"] = name, nat  # manche la plus récente
+    return per_user
+
+
+def _season_sort_key(total: float, detail: dict) -> tuple:
+    """Total décroissant, puis départage au meilleur résultat retenu, puis au suivant…"""
+    return (-total, tuple(sorted(-sc for sc, kept in detail.values() if kept)))
+
+
+def _apply_season(season: str, pilots: dict, standings: dict, details: dict):
+    """
+    Écrit les lignes des pilotes recalculés (`pilots` ; sans score → ligne retirée),
+    puis reclasse toute la saison à partir des totaux. N'écrit que ce qui change.
+    standings / details : lignes existantes de la saison et leur détail décodé.
+    """
+    import json
+    cfg = season_config(season)
+    for uid, p in pilots.items():
+        st = standings.get(uid)
+        if not p["scores"]:
+            if st is not None:
+                db.session.delete(st)
+                standings.pop(uid)
+                details.pop(uid, None)
+            continue
+        ordered = sorted(p["scores"], key=lambda t: -t[1])
+        kept = ordered[:cfg.best_n] if cfg.best_n and cfg.best_n > 0 else ordered
+        kept_ids = {rid for rid, _ in kept}
+        detail = {str(rid): [sc, rid in kept_ids] for rid, sc in p["scores"]}
+        fields = {
+            "total": round(sum(sc for _, sc in kept), 2),
+            "rounds_played": len(p["scores"]), "rounds_counted": len(kept),
+            "detail": json.dumps(detail, separators=(",", ":")),
+            "pilot_name": p["name"], "nationality": p["nat"],
+        }
+        if st is None:
+            st = standings[uid] = SeasonStanding(season=season, user_id=uid, rank=0, **fields)
+            db.session.add(st)
+        else:
+            for k, v in fields.items():
+                if getattr(st, k) != v:
+                    setattr(st, k, v)
+        details[uid] = detail
+
+    keys = {uid: _season_sort_key(st.total, details[uid]) for uid, st in standings.items()}
+    prev_key, rank = None, 0
+    for i, uid in enumerate(sorted(keys, key=keys.get), start=1):
+        if keys[uid] != prev_key:
+            rank, prev_key = i, keys[uid]
+        if standings[uid].rank != rank:
+            standings[uid].rank = rank
+    bump_version(season_key(season), "seasons")
+
+
+def rebuild_season_standings(season: str):
+    """
+    Recalcule entièrement le classement général d'une saison à partir de round_standing
+    (M manches × P pilotes, lignes déjà classées) et n'écrit que ce qui change.
+      - best_n > 0 : seules les best_n meilleures manches de chaque pilote comptent ;
+      - égalité au total : départage au meilleur résultat, puis au suivant, etc.
+    """
+    standings = {st.user_id: st for st in SeasonStanding.query.filter_by(season=season).all()}
+    pilots = _season_pilots(season)
+    for uid in standings.keys() - pilots.keys():
+        pilots[uid] = {"scores": []}
+    _apply_season(season, pilots, standings, {})
+
+
+def update_season_standings(season: str, round_ids):
+    """
+    Mise à jour incrémentale après un changement dans les manches `round_ids` : seuls les
+    pilotes classés dans ces manches (ou qui l'étaient) sont relus depuis round_standing ;
+    les autres gardent leur total, seul le rang de la saison est recalculé.
+    """
+    import json
+    standings = {st.user_id: st for st in SeasonStanding.query.filter_by(season=season).all()}
+    details = {uid: json.loads(st.detail) for uid, st in standings.items()}
+    touched = {str(rid) for rid in round_ids}
+    affected = {
+        uid for (uid,) in
+        db.session.query(RoundStanding.user_id).filter(RoundStanding.round_id.in_(list(round_ids))).distinct()
+    }
+    affected |= {uid for uid, d in details.items() if touched & d.keys()}
+    pilots = _season_pilots(season, affected) if affected else {}
+    for uid in affected - pilots.keys():
+        pilots[uid] = {"scores": []}
+    _apply_season(season, pilots, standings, details)
+
+
+@db.event.listens_for(db.session, "before_commit")
+def _refresh_dirty_seasons(sess):
+    dirty = sess.info.pop("dirty_seasons", None)
+    for season, round_ids in sorted((dirty or {}).items()):
+        if round_ids is None:
+            rebuild_season_standings(season)
+        else:
+            update_season_standings(season, round_ids)
+
+
+# Remplissage initial du classement général
+with app.app_context():
+    try:
+        if SeasonStanding.query.first() is None and RoundStanding.query.first() is not None:
+            for (season,) in db.session.query(Round.season).filter(Round.season.isnot(None)).distinct():
+                rebuild_season_standings(season)
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Season backfill error: {e}")
+
+
+# --- Plans de manche (plan_blob) ---
+def store_plan_blob(data: bytes, mime: str) -> str:
+    """Enregistre des octets dans plan_blob (dédupliqués par sha256) et renvoie le hash."""
+    import hashlib
+    sha = hashlib.sha256(data).hexdigest()
+    if db.session.get(PlanBlob, sha) is None:
+        db.session.add(PlanBlob(sha256=sha, size=len(data), mime=mime, data=data))
+    return sha
+
+
+def release_plan_blob(sha: str, except_round_id=None):
+    """Supprime un blob s'il n'est plus référencé par aucune autre manche."""
+    if not sha:
+        return
+    q = Round.query.filter(Round.plan_hash == sha)
+    if except_round_id is not None:
+        q = q.filter(Round.id != except_round_id)
+    if q.first() is None:
+        variant_shas = [
+            b for (b,) in
+            db.session.query(PlanVariant.blob_sha).filter_by(source_sha=sha)
+        ]
+        PlanVariant.query.filter_by(source_sha=sha).delete(synchronize_session=False)
+        PlanBlob.query.filter(
+            PlanBlob.sha256.in_([sha] + variant_shas)
+        ).delete(synchronize_session=False)
+
+
+# --- Déclinaisons des plans (miniature / mobile / plein écran) ---
+# largeur max en px ; l'image n'est jamais agrandie
+PLAN_VARIANTS = (("thumb", 320), ("mobile", 800), ("full", 1600))
+PLAN_VARIANT_MIME = "image/webp"
+PLAN_VARIANT_QUALITY = 80
+
+# Génération hors requête : l'upload rend la main tout de suite
+_variant_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="plan-variants")
+_variant_jobs = {}    # sha source -> Future (évite de lancer deux fois le même travail)
+_variant_failed = {}  # sha source -> instant (time.time) avant lequel on ne réessaie pas
+_variant_lock = threading.Lock()
+PLAN_VARIANT_RETRY = int(os.getenv("PLAN_VARIANT_RETRY", "3600"))  # s après un échec
+
+
+def _generate_plan_variants(sha: str):
+    failed = True
+    with app.app_context():
+        try:
+            data = db.session.query(PlanBlob.data).filter_by(sha256=sha).scalar()
+            if data is None:
+                app.logger.error(f"Plan variants error ({sha[:12]}): blob introuvable")
+                return
+            done = {
+                v for (v,) in
+                db.session.query(PlanVariant.variant).filter_by(source_sha=sha)
+            }
+            with Image.open(io.BytesIO(data)) as src:
+                src.load()
+                img = src.convert("RGBA" if "A" in src.getbands() else "RGB")
+            for name, max_w in PLAN_VARIANTS:
+                if name in done:
+                    continue
+                out = img.copy()
+                out.thumbnail((max_w, max_w * 10), Image.LANCZOS)
+                buf = io.BytesIO()
+                out.save(buf, "WEBP", quality=PLAN_VARIANT_QUALITY, method=4)
+                blob_sha = store_plan_blob(buf.getvalue(), PLAN_VARIANT_MIME)
+                db.session.add(PlanVariant(
+                    source_sha=sha, variant=name, blob_sha=blob_sha,
+                    width=out.width, height=out.height, mime=PLAN_VARIANT_MIME,
+                ))
+            # l'aperçu <picture> apparaît sur le classement des manches concernées
+            for (rid,) in db.session.query(Round.id).filter(Round.plan_hash == sha):
+                bump_version(round_key(rid))
+            db.session.commit()
+            failed = False
+        except Exception as e:
+            # ex. image illisible (SVG/HEIC sous un mimetype image/…)
+            db.session.rollback()
+            app.logger.error(f"Plan variants error ({sha[:12]}): {e}")
+        finally:
+            with _variant_lock:
+                _variant_jobs.pop(sha, None)
+                if failed:
+                    # échec mémorisé : les pages suivantes ne relancent pas Pillow à chaque rendu
+                    _variant_failed[sha] = time.time() + PLAN_VARIANT_RETRY
+                else:
+                    _variant_failed.pop(sha, None)
+
+
+def schedule_plan_variants(sha: str):
+    """
+    Met en file la génération des déclinaisons d'un plan (sans effet sans Pillow).
+    Rien si elle est déjà en cours, ou si elle a échoué il y a moins de PLAN_VARIANT_RETRY s.
+    """
+    if Image is None or not sha:
+        return None
+    with _variant_lock:
+        if sha in _variant_jobs or _variant_failed.get(sha, 0) > time.time():
+            return None
+        fut = _variant_jobs[sha] = _variant_pool.submit(_generate_plan_variants, sha)
+    return fut
+
+
+def plan_variants(r) -> dict:
+    """Déclinaisons disponibles du plan d'une manche : {nom: PlanVariant}."""
+    if not getattr(r, "plan_hash", None):
+        return {}
+    found = {v.variant: v for v in PlanVariant.query.filter_by(source_sha=r.plan_hash)}
+    if len(found) < len(PLAN_VARIANTS):
+        # plan ancien (ou génération ratée il y a plus de PLAN_VARIANT_RETRY s) : on relance
+        schedule_plan_variants(r.plan_hash)
+    return found
+
+
+def queue_email(to_email: str, subject: str, body: str):
+    """
+    Dépose un e-mail dans la boîte d'envoi, dans la transaction courante : il n'existe
+    que si l'action qui le déclenche est validée. Le Mailer est réveillé au commit.
+    """
+    return queue_emails([(to_email, subject, body)])
+
+
+def queue_emails(messages) -> int:
+    """Comme queue_email pour une série de (destinataire, sujet, corps) : un INSERT multi-lignes."""
+    now = datetime.utcnow()
+    rows = [
+        {"to_email": to, "subject": subject[:255], "body": body, "status": "pending",
+         "attempts": 0, "next_attempt_at": now, "created_at": now}
+        for to, subject, body in messages
+        if to
+    ]
+    if rows:
+        db.session.execute(OutboxEmail.__table__.insert(), rows)
+        db.session.info["wake_mailer"] = True
+    return len(rows)
+
+
+def send_email(to_email: str, subject: str, body: str):
+    """Envoie un email texte simple (via la boîte d'envoi : ne bloque pas la requête)."""
+    queue_email(to_email, subject, body)
+    db.session.commit()
+
+
+class Mailer:
+    """
+    Livreur de la boîte d'envoi, un thread par process :
+      - réclame un lot de lignes échues (UPDATE conditionnel + jeton : sûr entre workers) ;
+      - envoie tout le lot sur UNE session SMTP authentifiée, gardée ouverte tant qu'il
+        reste du travail ;
+      - échec → nouvelle tentative avec délai exponentiel, puis "dead" après
+        MAIL_MAX_ATTEMPTS essais (visible dans /admin/outbox).
+    Sans SMTP_HOST, rien n'est envoyé : les messages restent "pending".
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._smtp = None
+
+    def wake(self):
+        if not SMTP_HOST:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="mailer", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            try:
+                with app.app_context():
+                    sent = self.deliver_batch()
+            except Exception as e:
+                app.logger.error(f"Mailer error: {e}")
+                self._close()
+                sent = 0
+            if not sent:
+                self._close()  # plus rien à envoyer : on libère la session SMTP
+                self._wake.wait(MAIL_IDLE_POLL)
+                self._wake.clear()
+
+    # --- SMTP ---
+    def _connect(self):
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._close()
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
+        if SMTP_STARTTLS:
+            server.starttls()
+        if SMTP_USER:
+            server.login(SMTP_USER, SMTP_PASSWORD)
+        self._smtp = server
+        return server
+
+    def _close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    # --- boîte d'envoi ---
+    def _claim(self) -> list:
+        import uuid
+        from sqlalchemy import or_
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        due = or_(OutboxEmail.status == "pending", OutboxEmail.status == "sending")
+        ids = [
+            i for (i,) in
+            db.session.query(OutboxEmail.id)
+            .filter(due, OutboxEmail.next_attempt_at <= now)
+            .order_by(OutboxEmail.next_attempt_at.asc(), OutboxEmail.id.asc())
+            .limit(MAIL_BATCH)
+        ]
+        if not ids:
+            return []
+        (
+            OutboxEmail.query
+            .filter(OutboxEmail.id.in_(ids), due, OutboxEmail.next_attempt_at <= now)
+            .update(
+                {OutboxEmail.status: "sending", OutboxEmail.claim: token,
+                 OutboxEmail.next_attempt_at: now + timedelta(seconds=MAIL_LEASE)},
+                synchronize_session=False,
+            )
+        )
+        db.session.commit()
+        return OutboxEmail.query.filter_by(claim=token, status="sending").order_by(OutboxEmail.id).all()
+
+    @staticmethod
+    def _failed(m, err):
+        m.attempts = (m.attempts or 0) + 1
+        m.last_error = str(err)[:1000]
+        if m.attempts >= MAIL_MAX_ATTEMPTS:
+            m.status = "dead"
+            app.logger.error(f"[MAIL] Abandon vers {m.to_email} après {m.attempts} essais : {err}")
+        else:
+            m.status = "pending"
+            delay = min(MAIL_BACKOFF_BASE * 2 ** (m.attempts - 1), MAIL_BACKOFF_MAX)
+            m.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+
+    def deliver_batch(self) -> int:
+        """Envoie un lot échu. Renvoie le nombre de lignes traitées (0 = boîte vide)."""
+        batch = self._claim()
+        if not batch:
+            return 0
+        try:
+            server = self._connect()
+        except Exception as e:
+            for m in batch:
+                self._failed(m, e)
+            db.session.commit()
+            raise
+        for k, m in enumerate(batch):
+            msg = EmailMessage()
+            msg["Subject"] = m.subject
+            msg["From"] = EMAIL_FROM
+            msg["To"] = m.to_email
+            msg.set_content(m.body)
+            try:
+                server.send_message(msg)
+            except (smtplib.SMTPServerDisconnected, OSError) as e:
+                # session perdue : ce message et le reste du lot seront retentés
+                for rest in batch[k:]:
+                    self._failed(rest, e)
+                db.session.commit()
+                raise
+            except smtplib.SMTPException as e:
+                self._failed(m, e)  # refus propre à ce destinataire
+            else:
+                m.status = "sent"
+                m.sent_at = datetime.utcnow()
+                m.last_error = None
+            m.claim = None
+            db.session.commit()
+        return len(batch)
+
+
+MAILER = Mailer()
+MAILER.wake()  # au démarrage : reprend ce qui est resté en attente (redémarrage, panne SMTP…)
+
+
+@db.event.listens_for(db.session, "after_commit")
+def _wake_mailer_after_commit(sess):
+    if sess.info.pop("wake_mailer", False):
+        MAILER.wake()
+
+
+# --- Notifications pilotes (déposées dans la boîte d'envoi, commit à l'appelant) ---
+def _status_email(e):
+    """(destinataire, sujet, corps) du mail « chrono validé / refusé »."""
+    pilot = e.user
+    if pilot is None:
+        return (None, "", "")
+    round_name = e.round.name if e.round else f"Manche #{e.round_id}"
+    verdict = "validé" if e.status == "approved" else "refusé"
+    return (
+        pilot.email,
+        f"WP Challenge – ton chrono sur {round_name} a été {verdict}",
+        f"Bonjour {display_name(pilot)},\n\n"
+        f"Ton chrono {ms_to_str(e.raw_time_ms)} sur « {round_name} » a été {verdict}.\n\n"
+        f"Détails et classement : {url_for('profile', _external=True)}\n\n"
+        "— L'équipe West Pistards",
+    )
+
+
+def notify_pilot_status(*entries):
+    """Chronos validés / refusés : un mail par chrono, déposés en une insertion."""
+    queue_emails(_status_email(e) for e in entries)
+
+
+def notify_pilot_chat(e):
+    """Nouveau message de l'admin sur un chrono (un seul mail tant que le pilote n'a pas lu)."""
+    pilot = e.user
+    if pilot is None:
+        return
+    round_name = e.round.name if e.round else f"Manche #{e.round_id}"
+    queue_email(
+        pilot.email,
+        f"WP Challenge – nouveau message sur ton chrono ({round_name})",
+        f"Bonjour {display_name(pilot)},\n\n"
+        f"L'admin t'a écrit au sujet de ton chrono sur « {round_name} ».\n\n"
+        f"Lire et répondre : {url_for('pilot_time_chat', time_id=e.id, _external=True)}\n\n"
+        "— L'équipe West Pistards",
+    )
+
+
+# --- Assets statiques : empreintes + variantes pré-compressées ---
+# Chaque fichier de static/ est servi sous /assets/<empreinte>/<chemin> avec un cache
+# "immutable" d'un an ; une modification du fichier change l'URL.
+ASSET_CACHE_DIR = os.path.join(BASE_DIR, ".asset_cache")  # variantes .gz / .br
+ASSET_MAX_AGE = 365 * 24 * 3600
+ASSET_COMPRESSIBLE = (".css", ".js", ".svg", ".json", ".txt", ".html")  # images déjà compressées
+
+# brotli (optionnel) : sans lui, seules les variantes gzip sont produites
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _write_once(path: str, make_bytes):
+    """Écrit un fichier s'il n'existe pas encore (atomique : plusieurs workers au boot)."""
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(make_bytes())
+    os.replace(tmp, path)
+
+
+def build_asset_manifest(static_dir: str) -> dict:
+    """Parcourt static/ : {chemin relatif: empreinte sha256 (12 car.)} + pré-compression."""
+    import gzip
+    import hashlib
+    manifest = {}
+    for root, _dirs, files in os.walk(static_dir):
+        for fn in files:
+            if fn.startswith("."):
+                continue
+            full = os.path.join(root, fn)
+            rel = os.path.relpath(full, static_dir).replace(os.sep, "/")
+            with open(full, "rb") as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            manifest[rel] = digest
+            if rel.lower().endswith(ASSET_COMPRESSIBLE):
+                base = os.path.join(ASSET_CACHE_DIR, digest, rel)
+                try:
+                    _write_once(base + ".gz", lambda: gzip.compress(data, 9, mtime=0))
+                    if brotli is not None:
+                        _write_once(base + ".br", lambda: brotli.compress(data))
+                except OSError as e:
+                    app.logger.error(f"Asset precompress error ({rel}): {e}")
+    return manifest
+
+
+try:
+    ASSET_MANIFEST = build_asset_manifest(app.static_folder)
+except Exception as e:
+    app.logger.error(f"Asset manifest error: {e}")
+    ASSET_MANIFEST = {}
+
+
+def asset_url(rel: str) -> str:
+    """URL empreintée d'un fichier de static/ (repli sur /static/ s'il est inconnu)."""
+    digest = ASSET_MANIFEST.get(rel)
+    return f"/assets/{digest}/{rel}" if digest else f"/static/{rel}"
+
+
+@app.get("/assets/<digest>/<path:filename>")
+def asset(digest, filename):
+    import mimetypes
+    from flask import send_file
+    from werkzeug.security import safe_join
+
+    current = ASSET_MANIFEST.get(filename)
+    path = safe_join(app.static_folder, filename)
+    if current is None or path is None or not os.path.isfile(path):
+        return PAGE("<h1>Introuvable</h1><p class='muted'>Fichier inconnu.</p>"), 404
+    if digest != current:
+        # empreinte d'un ancien déploiement → version actuelle
+        return redirect(asset_url(filename))
+
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    encoding = None
+    if filename.lower().endswith(ASSET_COMPRESSIBLE):
+        for enc, ext in (("br", ".br"), ("gzip", ".gz")):
+            candidate = os.path.join(ASSET_CACHE_DIR, digest, filename + ext)
+            if request.accept_encodings[enc] and os.path.isfile(candidate):
+                path, encoding = candidate, enc
+                break
+
+    resp = send_file(
+        path,
+        mimetype=mimetype,
+        conditional=True,
+        etag=f"{digest}-{encoding or 'id'}",
+        max_age=ASSET_MAX_AGE,
+    )
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    if filename.lower().endswith(ASSET_COMPRESSIBLE):
+        resp.vary.add("Accept-Encoding")
+    return resp
+
+
+# --- Layout inline réutilisable ---
+# --- Cache de fragments HTML (par process) ---
+# Invalidation explicite par les endpoints d'écriture ; le TTL borne l'écart entre
+# workers gunicorn (chacun a son propre cache et ne voit que ses invalidations).
+FRAGMENT_TTL = int(os.getenv("FRAGMENT_TTL", "60"))
+_fragments = {}  # clé -> (expire_at monotonic | None, html)
+
+
+def cached_fragment(key: str, build, ttl=FRAGMENT_TTL):
+    """Renvoie le fragment `key`, reconstruit par build() s'il est absent ou expiré."""
+    hit = _fragments.get(key)
+    now = time.monotonic()
+    if hit is not None and (hit[0] is None or hit[0] > now):
+        return hit[1]
+    html = build()
+    _fragments[key] = (None if ttl is None else now + ttl, html)
+    return html
+
+
+def invalidate_fragments(*keys):
+    for key in keys:
+        _fragments.pop(key, None)
 
-def send_email(to_email: str, subject: str, body: str):
-    """Envoie un email texte simple."""
-    if not (SMTP_HOST and SMTP_USER and SMTP_PASSWORD):
-        print(f"[MAIL] Config SMTP manquante, mail non envoyé à {to_email}")
-        return
 
-    msg = EmailMessage()
-    msg["Subject"] = subject
-    msg["From"] = EMAIL_FROM
-    msg["To"] = to_email
-    msg.set_content(body)
+def invalidate_rounds_fragments():
+    """À appeler après création/ouverture/clôture/suppression/édition d'une manche."""
+    invalidate_fragments("home:open_rounds")
 
-    try:
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USER, SMTP_PASSWORD)
-            server.send_message(msg)
-        print(f"[MAIL] Mail envoyé à {to_email} : {subject}")
-    except Exception as e:
-        print(f"[MAIL] Erreur d'envoi vers {to_email}: {e}")
 
+def invalidate_banner_fragment():
+    invalidate_fragments("home:banner")
+
+
+_INNER_SLOT = "\x00inner\x00"
 
 
-# --- Layout inline réutilisable ---
 def PAGE(inner_html):
-    u = current_user() if db else None
+    u = current_identity() if db else None
+    # Coquille (head, nav, footer, script du bandeau) : une version par état de connexion
+    auth = "user" if u else "anon"
+    head, tail = cached_fragment(f"layout:{auth}", lambda: _layout_shell(bool(u)), ttl=None)
+    return head + inner_html + tail
+
 
+def _layout_shell(logged_in: bool):
+    """Construit la coquille de page, coupée en (avant, après) le contenu."""
     # --- NAV DROITE (simple et claire) ---
     nav_parts = []
     # Public
-    nav_parts.append("<a href='/static/docs/Reglement_WestPistardsChallenge.pdf' target='_blank' rel='noopener'>Règlement</a>")
+    nav_parts.append(f"<a href='{asset_url('docs/Reglement_WestPistardsChallenge.pdf')}' target='_blank' rel='noopener'>Règlement</a>")
     nav_parts.append("<a href='/rounds'>Manches</a>")
+    nav_parts.append("<a href='/season'>Général</a>")
     nav_parts.append(
         "<a href='https://www.facebook.com/west.pistards' target='_blank' rel='noopener' title='Ouvrir notre page Facebook'>Facebook</a>"
     )
@@ -323,7 +2117,7 @@ def PAGE(inner_html):
 
 
     # Connexion / Profil
-    if u:
+    if logged_in:
         nav_parts.append("<a href='/profile'>Profil</a>")
         # 👇 plus de lien Admin ici (tu gères l’admin depuis le profil)
         nav_parts.append("<a href='/logout'>Déconnexion</a>")
@@ -339,9 +2133,9 @@ def PAGE(inner_html):
 <html lang="fr">
 <head>
   <meta charset="utf-8">
-  <link rel="icon" type="image/png" href="/static/img/icon-192.png">
+  <link rel="icon" type="image/png" href="{asset_url('img/icon-192.png')}">
   <title>WP Challenge</title>
-  <link rel="stylesheet" href="/static/style.css">
+  <link rel="stylesheet" href="{asset_url('style.css')}">
 </head>
 <body>
   <header class="container">
@@ -355,7 +2149,7 @@ def PAGE(inner_html):
     </div>
   </header>
   <main class="container">
-    {inner_html}
+    {_INNER_SLOT}
   </main>
   <footer class="container muted">
     <a href="/credits">Crédits photo & vidéo</a><br>
@@ -446,14 +2240,14 @@ def PAGE(inner_html):
 
 </body>
 </html>
-"""
+""".split(_INNER_SLOT, 1)
 
 
 
 
 # --- Pages ---
-@app.get("/")
-def index():
+def _home_open_rounds():
+    """(liste HTML des manches ouvertes, script des comptes à rebours) pour l'accueil."""
     open_list_html = "<p class='muted'>Aucune manche ouverte pour le moment.</p>"
     countdown_script = ""  # on l'ajoutera si au moins une manche a une deadline
 
@@ -530,27 +2324,55 @@ def index():
             </script>
             """
 
+    return open_list_html, countdown_script
+
+
+def _home_banner():
+    # Bandeau d'annonces (affiche la plus récente active)
+    banner_html = ""
+    if db:
+        ann = Announcement.query.filter_by(is_active=True).order_by(Announcement.created_at.desc()).first()
+        if ann:
+            msg = ann.content  # peut contenir <strong> etc.
+            banner_html = f"""
+            <div class="banner" aria-live="polite">
+              <div class="marquee" role="marquee" aria-label="Annonce défilante">
+              <div class="marquee-track" style="animation-duration: 30s;">
+                  {msg}
+                </div>
+              </div>
+            </div>
+
+            """
+    return banner_html
+
+
+@app.get("/")
+def index():
+    # Fragments en cache (invalidés par les endpoints admin) : pas de requête SQL en régime établi
+    open_list_html, countdown_script = cached_fragment("home:open_rounds", _home_open_rounds)
+    banner_html = cached_fragment("home:banner", _home_banner)
 
      # Liens partenaires (remplace par tes vraies pages FB)
-    partners_html = """
+    partners_html = f"""
     <section class="card" style="margin-top:24px;">
       <h2>Partenaires</h2>
       <p class="muted" style="margin-top:-4px;">Merci à nos partenaires pour leur soutien.</p>
 
       <div class="logo-grid" style="margin-top:12px;">
         <a class="partner" href="https://www.coneaddict.com" target="_blank" rel="noopener" title="Cone Addict">
-          <img src="/static/img/partners/partner1.jpg" alt="Partenaire 1">
+          <img src="{asset_url('img/partners/partner1.jpg')}" alt="Partenaire 1">
         </a>
         <a class="partner" href="https://www.instagram.com/lou_etheve/" target="_blank" rel="noopener" title="Sellerie Lou Ethève">
-          <img src="/static/img/partners/partner2ter.png" alt="Partenaire 2">
+          <img src="{asset_url('img/partners/partner2ter.png')}" alt="Partenaire 2">
         </a>
         <a class="partner" href="https://www.facebook.com/share/17Jn1CirtS" target="_blank" rel="noopener" title="ECF">
-          <img src="/static/img/partners/ecf.jpg" alt="ECF">
+          <img src="{asset_url('img/partners/ecf.jpg')}" alt="ECF">
         </a>
       </div>
     </section>
     """
-    networks_html = """
+    networks_html = f"""
     <section class="card" style="margin-top:24px;">
       <h2>Les réseaux du gymkhana français</h2>
       <p class="muted" style="margin-top:-4px;">Où pratiquer en France — associations et collectifs.</p>
@@ -558,19 +2380,19 @@ def index():
       <div class="networks-grid">
         <!-- Nouveau logo en premier -->
         <a class="netw" href="https://www.facebook.com/west.pistards" target="_blank" rel="noopener" title="WP">
-          <img src="/static/img/assos/wp.jpg" alt="WP">
+          <img src="{asset_url('img/assos/wp.jpg')}" alt="WP">
         </a>
         <a class="netw" href="https://www.instagram.com/maniacones360/" target="_blank" rel="noopener" title="Mania">
-          <img src="/static/img/assos/mania3.jpg" alt="Mania">
+          <img src="{asset_url('img/assos/mania3.jpg')}" alt="Mania">
         </a>
         <a class="netw" href="https://www.facebook.com/perfectionnement.maniabilite.gymkhana.moto" target="_blank" rel="noopener" title="Angle">
-          <img src="/static/img/assos/angle2.png" alt="Angle">
+          <img src="{asset_url('img/assos/angle2.png')}" alt="Angle">
         </a>
         <a class="netw" href="https://www.facebook.com/SpectacleMotoGymkhana" target="_blank" rel="noopener" title="Gravity">
-          <img src="/static/img/assos/gravity2.png" alt="Gravity">
+          <img src="{asset_url('img/assos/gravity2.png')}" alt="Gravity">
         </a>
         <a class="netw" href="https://www.facebook.com/groups/1947945858558429" target="_blank" title="Moto Liberté sur Facebook">
-         <img src="/static/img/assos/motoliberte2.png" alt="Moto Liberté" style="height:80px; margin:8px; border-radius:8px;">
+         <img src="{asset_url('img/assos/motoliberte2.png')}" alt="Moto Liberté" style="height:80px; margin:8px; border-radius:8px;">
         </a>
       </div>
       <p class="muted center" style="margin-top:8px;">
@@ -581,24 +2403,6 @@ def index():
 
 
 
-    # Bandeau d'annonces (affiche la plus récente active)
-    banner_html = ""
-    if db:
-        ann = Announcement.query.filter_by(is_active=True).order_by(Announcement.created_at.desc()).first()
-        if ann:
-            msg = ann.content  # peut contenir <strong> etc.
-            banner_html = f"""
-            <div class="banner" aria-live="polite">
-              <div class="marquee" role="marquee" aria-label="Annonce défilante">
-              <div class="marquee-track" style="animation-duration: 30s;">
-                  {msg}
-                </div>
-              </div>
-            </div>
-
-            """
-
-
     # --- Rendu de la page d'accueil ---
     return PAGE(f"""
     <section class="bg-hero">
@@ -619,9 +2423,9 @@ def index():
     </section>
 
       <div class="hero-row blend">
-        <img class="logo-secondary" src="/static/img/logo_motogymkhana.jpg" alt="Moto Gymkhana">
+        <img class="logo-secondary" src="{asset_url('img/logo_motogymkhana.jpg')}" alt="Moto Gymkhana">
         <h1 class="hero-title">Bienvenue sur WP Challenge</h1>
-        <img class="logo-main" src="/static/img/logo_challenge.png" alt="WP Challenge">
+        <img class="logo-main" src="{asset_url('img/logo_challenge.png')}" alt="WP Challenge">
       </div>
 
       <p>Entre tes chronos, partage ton lien YouTube et grimpe au classement !</p>
@@ -650,23 +2454,23 @@ def index():
     <section class="marquee-photos" aria-label="Photos WestPistards">
       <div class="marquee-track" style="animation-duration: 20s;">
         <!-- Rangée A -->
-        <img src="/static/img/bottom_gallery/imageun.jpg" alt="WestPistards 1" loading="lazy">
-        <img src="/static/img/bottom_gallery/imagedeux.jpg" alt="WestPistards 2" loading="lazy">
-        <img src="/static/img/bottom_gallery/imagetrois.jpg" alt="WestPistards 3" loading="lazy">
-        <img src="/static/img/bottom_gallery/imagequatre.jpg" alt="WestPistards 4" loading="lazy">
-        <img src="/static/img/bottom_gallery/imagecinq.jpg" alt="WestPistards 5" loading="lazy">
-        <img src="/static/img/bottom_gallery/imagesix.jpg" alt="WestPistards 6" loading="lazy">
-        <img src="/static/img/bottom_gallery/imagesept.jpg" alt="WestPistards 7" loading="lazy">
-        <img src="/static/img/bottom_gallery/imagehuit.jpg" alt="WestPistards 8" loading="lazy">
+        <img src="{asset_url('img/bottom_gallery/imageun.jpg')}" alt="WestPistards 1" loading="lazy">
+        <img src="{asset_url('img/bottom_gallery/imagedeux.jpg')}" alt="WestPistards 2" loading="lazy">
+        <img src="{asset_url('img/bottom_gallery/imagetrois.jpg')}" alt="WestPistards 3" loading="lazy">
+        <img src="{asset_url('img/bottom_gallery/imagequatre.jpg')}" alt="WestPistards 4" loading="lazy">
+        <img src="{asset_url('img/bottom_gallery/imagecinq.jpg')}" alt="WestPistards 5" loading="lazy">
+        <img src="{asset_url('img/bottom_gallery/imagesix.jpg')}" alt="WestPistards 6" loading="lazy">
+        <img src="{asset_url('img/bottom_gallery/imagesept.jpg')}" alt="WestPistards 7" loading="lazy">
+        <img src="{asset_url('img/bottom_gallery/imagehuit.jpg')}" alt="WestPistards 8" loading="lazy">
         <!-- Rangée B (duplication pour boucle fluide) -->
-        <img src="/static/img/bottom_gallery/imageun.jpg" alt="" aria-hidden="true" loading="lazy">
-        <img src="/static/img/bottom_gallery/imagedeux.jpg" alt="" aria-hidden="true" loading="lazy">
-        <img src="/static/img/bottom_gallery/imagetrois.jpg" alt="" aria-hidden="true" loading="lazy">
-        <img src="/static/img/bottom_gallery/imagequatre.jpg" alt="" aria-hidden="true" loading="lazy">
-        <img src="/static/img/bottom_gallery/imagecinq.jpg" alt="" aria-hidden="true" loading="lazy">
-        <img src="/static/img/bottom_gallery/imagesix.jpg" alt="" aria-hidden="true" loading="lazy">
-        <img src="/static/img/bottom_gallery/imagesept.jpg" alt="" aria-hidden="true" loading="lazy">
-        <img src="/static/img/bottom_gallery/imagehuit.jpg" alt="" aria-hidden="true" loading="lazy">
+        <img src="{asset_url('img/bottom_gallery/imageun.jpg')}" alt="" aria-hidden="true" loading="lazy">
+        <img src="{asset_url('img/bottom_gallery/imagedeux.jpg')}" alt="" aria-hidden="true" loading="lazy">
+        <img src="{asset_url('img/bottom_gallery/imagetrois.jpg')}" alt="" aria-hidden="true" loading="lazy">
+        <img src="{asset_url('img/bottom_gallery/imagequatre.jpg')}" alt="" aria-hidden="true" loading="lazy">
+        <img src="{asset_url('img/bottom_gallery/imagecinq.jpg')}" alt="" aria-hidden="true" loading="lazy">
+        <img src="{asset_url('img/bottom_gallery/imagesix.jpg')}" alt="" aria-hidden="true" loading="lazy">
+        <img src="{asset_url('img/bottom_gallery/imagesept.jpg')}" alt="" aria-hidden="true" loading="lazy">
+        <img src="{asset_url('img/bottom_gallery/imagehuit.jpg')}" alt="" aria-hidden="true" loading="lazy">
       </div>
     </section>
 
@@ -700,13 +2504,16 @@ def register():
             db.session.commit()
         else:
             # mettre à jour le pseudo/nationalité si fournis
+            before = (display_name(u), u.nationality)
             if pseudo:
                 u.pseudo = pseudo
             if nationality:
                 u.nationality = nationality
+            if (display_name(u), u.nationality) != before:
+                refresh_pilot_snapshot(u)
             db.session.commit()
 
-        session["user_id"] = u.id
+        start_session(u)
         return redirect(url_for("profile"))
 
     # GET -> formulaire
@@ -742,7 +2549,7 @@ def login():
                 # pas de compte -> renvoi vers inscription
                 return redirect(url_for("register"))
 
-            session["user_id"] = u.id
+            start_session(u)
             log_login(u)
             return redirect(url_for("profile"))
         except Exception as e:
@@ -762,13 +2569,23 @@ def login():
 
 @app.get("/logout")
 def logout():
-    session.pop("user_id", None)
+    end_session()
     return redirect(url_for("index"))
 
 @app.get("/rounds")
 def rounds_list():
     if not db:
         return PAGE("<h1>Manches</h1><p class='muted'>DB non dispo.</p>")
+    return versioned_page("rounds", _auth_variant(), _render_rounds_list)
+
+
+def _auth_variant() -> str:
+    """Variante de cache d'une page publique : anonyme / connecté / admin."""
+    ident = current_identity()
+    return "admin" if is_admin(ident) else ("user" if ident else "anon")
+
+
+def _render_rounds_list():
     rounds = Round.query.order_by(Round.created_at.desc()).all()
     if not rounds:
         html = "<h1>Manches</h1><p class='muted'>Aucune manche pour l’instant.</p>"
@@ -779,12 +2596,150 @@ def rounds_list():
             for r in rounds
         )
         html = f"<h1>Manches</h1><ul class='cards'>{items}</ul>"
-    u = current_user()
-    if is_admin(u):
+    if is_admin(current_identity()):
         html += "<p style='margin-top:12px'><a class='btn' href='/admin/rounds'>Admin : créer une manche</a></p>"
     return PAGE(html)
 
 
+@app.get("/season")
+def season_current():
+    """Classement général de la saison de la manche la plus récente."""
+    if not db:
+        return PAGE("<h1>Classement général</h1><p class='muted'>DB non dispo.</p>")
+    latest = (
+        db.session.query(Round.season)
+        .filter(Round.season.isnot(None))
+        .order_by(Round.created_at.desc())
+        .first()
+    )
+    if not latest:
+        return PAGE("<h1>Classement général</h1><p class='muted'>Aucune saison pour l’instant.</p>")
+    return redirect(url_for("season_standings", season=latest[0]))
+
+
+@app.get("/season/<season>")
+def season_standings(season):
+    if not db:
+        return PAGE("<h1>Classement général</h1><p class='muted'>DB non dispo.</p>")
+    # Page en cache tant que la version "season:<clé>" n'a pas bougé
+    return versioned_page(season_key(season), _auth_variant(), lambda: _render_season(season))
+
+
+def _render_season(season):
+    import json
+    from html import escape
+    rounds = Round.query.filter_by(season=season).order_by(Round.created_at.asc(), Round.id.asc()).all()
+    if not rounds:
+        return PAGE("<h1>Classement général</h1><p class='muted'>Saison introuvable.</p>"), 404
+    cfg = db.session.get(Season, season)
+    standings = (
+        SeasonStanding.query
+        .filter_by(season=season)
+        .order_by(SeasonStanding.rank.asc(), SeasonStanding.pilot_name.asc())
+        .all()
+    )
+
+    mode = cfg.mode if cfg else SEASON_DEFAULT_MODE
+    best_n = cfg.best_n if cfg else SEASON_DEFAULT_BEST_N
+    rule = "points au rang" if mode == "points" else "score au % du meilleur (100 = vainqueur)"
+    if best_n:
+        rule += f", {best_n} meilleures manches retenues"
+
+    head = "".join(f"<th title='{escape(r.name)}'><a href='/rounds/{r.id}'>M{i}</a></th>"
+                   for i, r in enumerate(rounds, start=1))
+
+    def fmt(x):
+        return f"{x:g}"
+
+    body = []
+    for st in standings:
+        detail = json.loads(st.detail or "{}")
+        cells = []
+        for r in rounds:
+            sc = detail.get(str(r.id))
+            if sc is None:
+                cells.append("<td class='muted'>—</td>")
+            elif sc[1]:
+                cells.append(f"<td>{fmt(sc[0])}</td>")
+            else:
+                cells.append(f"<td class='muted' title='Manche non retenue'><s>{fmt(sc[0])}</s></td>")
+        nat = (st.nationality or "").upper()
+        body.append(
+            f"<tr><td>{st.rank}</td><td>{st.pilot_name or '—'}</td><td>{nat}</td>"
+            f"{''.join(cells)}<td><strong>{fmt(st.total)}</strong></td></tr>"
+        )
+    table = (
+        f"<table class='table'><thead><tr><th>#</th><th>Pilote</th><th>Nation</th>{head}<th>Total</th></tr></thead>"
+        f"<tbody>{''.join(body) or '<tr><td colspan=99 class=muted>Aucun chrono validé pour le moment.</td></tr>'}</tbody></table>"
+    )
+    admin_link = ""
+    if is_admin(current_identity()):
+        admin_link = "<p style='margin-top:12px'><a class='btn outline' href='/admin/seasons'>Admin : règlement des saisons</a></p>"
+    return PAGE(f"""
+      <h1>Classement général — saison {escape(season)}</h1>
+      <p class="muted">{len(rounds)} manche(s) &middot; {rule}</p>
+      <section class="card" style="overflow-x:auto;">{table}</section>
+      {admin_link}
+    """)
+
+
+@app.route("/admin/seasons", methods=["GET", "POST"])
+def admin_seasons():
+    """Règlement de chaque saison (mode, barème, meilleures manches) ; recalcul au commit."""
+    if not db:
+        return PAGE("<h1>Admin</h1><p class='muted'>DB non dispo.</p>")
+    u = current_user()
+    if not is_admin(u):
+        return PAGE("<h1>Accès refusé</h1><p class='muted'>Réservé aux administrateurs.</p>"), 403
+
+    if request.method == "POST":
+        season = (request.form.get("season") or "").strip()
+        if season:
+            cfg = season_config(season)
+            cfg.mode = "pct" if request.form.get("mode") == "pct" else "points"
+            points = [x.strip() for x in (request.form.get("points") or "").split(",")]
+            cfg.points = ",".join(x for x in points if x.isascii() and x.isdigit()) or SEASON_DEFAULT_POINTS
+            cfg.best_n = max(0, request.form.get("best_n", 0, type=int) or 0)
+            mark_season_dirty(season)
+            db.session.commit()
+        return redirect(url_for("admin_seasons"))
+
+    from html import escape
+    seasons = [s for (s,) in db.session.query(Round.season).filter(Round.season.isnot(None)).distinct()]
+    forms = []
+    for season in sorted(seasons, reverse=True):
+        cfg = db.session.get(Season, season)
+        mode = cfg.mode if cfg else SEASON_DEFAULT_MODE
+        points = cfg.points if cfg else SEASON_DEFAULT_POINTS
+        best_n = cfg.best_n if cfg else SEASON_DEFAULT_BEST_N
+        label = escape(season)  # saisi librement à la création d'une manche
+        forms.append(f"""
+        <li class="card">
+          <form method="post" class="form">
+            <input type="hidden" name="season" value="{label}">
+            <h2 style="margin-top:0;"><a href="/season/{quote(season, safe='')}">Saison {label}</a></h2>
+            <label>Mode
+              <select name="mode">
+                <option value="points" {'selected' if mode == 'points' else ''}>Points au rang</option>
+                <option value="pct" {'selected' if mode == 'pct' else ''}>% du meilleur</option>
+              </select>
+            </label>
+            <label>Barème (points du 1er, 2e, …)
+              <input type="text" name="points" value="{points}">
+            </label>
+            <label>Manches retenues par pilote (0 = toutes)
+              <input type="number" name="best_n" min="0" value="{best_n}">
+            </label>
+            <button class="btn" type="submit">Enregistrer et recalculer</button>
+          </form>
+        </li>
+        """)
+    return PAGE(f"""
+      <h1>Admin &mdash; Saisons</h1>
+      <ul class="cards">{''.join(forms) or "<p class='muted'>Aucune saison.</p>"}</ul>
+    """)
+
+
 @app.route("/admin/rounds", methods=["GET", "POST"])
 def admin_rounds():
     if not db:
@@ -804,13 +2759,13 @@ def admin_rounds():
         if closes_at_val:
             # Format attendu: YYYY-MM-DDTHH:MM (ex: 2025-10-05T18:00)
             try:
-                from datetime import datetime
                 closes_at_dt = datetime.fromisoformat(closes_at_val)
             except Exception:
                 # On ignore silencieusement si invalide, ou on pourrait renvoyer une erreur
                 closes_at_dt = None
 
-        r = Round(name=name, status="open")
+        season = (request.form.get("season") or "").strip()[:40] or str(datetime.utcnow().year)
+        r = Round(name=name, status="open", season=season)
         if hasattr(Round, "closes_at"):
             r.closes_at = closes_at_dt
 
@@ -818,14 +2773,19 @@ def admin_rounds():
         if f and f.filename:
             if (f.mimetype or "").startswith("image/"):
                 data = f.read()
-                r.plan_data = data
+                r.plan_hash = store_plan_blob(data, f.mimetype)
+                r.plan_size = len(data)
                 r.plan_mime = f.mimetype
                 r.plan_name = secure_filename(f.filename)
             else:
                 return PAGE("<h1>Admin &mdash; Manches</h1><p class='muted'>Seules les images sont acceptées (PNG/JPG).</p>"), 400
 
         db.session.add(r)
+        bump_version("rounds")
+        mark_season_dirty(r.season, r.id)  # nouvelle colonne au classement général
         db.session.commit()
+        invalidate_rounds_fragments()
+        schedule_plan_variants(r.plan_hash)
         return redirect(url_for("admin_rounds"))
 
 
@@ -836,7 +2796,7 @@ def admin_rounds():
         close_info = ""
         if hasattr(r, "closes_at") and r.closes_at:
             close_info = f" &middot; <span class='muted'>clôture: {r.closes_at.strftime('%d/%m/%Y %H:%M')}</span>"
-        view_btn = f"<a class='icon-btn' href='/rounds/{r.id}/plan' target='_blank' title='Voir l’image du plan'><span class='i'>🖼️</span></a>" if getattr(r, 'plan_data', None) else ""
+        view_btn = f"<a class='icon-btn' href='{plan_url(r)}' target='_blank' title='Voir l’image du plan'><span class='i'>🖼️</span></a>" if getattr(r, 'plan_hash', None) else ""
         return f"""
         <li class="card">
           <div class="row" style="justify-content:space-between;">
@@ -846,6 +2806,9 @@ def admin_rounds():
               <a class="icon-btn green" href="/admin/rounds/{r.id}/export.csv" title="Télécharger CSV" aria-label="Télécharger CSV">
                 <span class="i">⬇️</span>
               </a>
+              <a class="btn outline" href="/admin/rounds/{r.id}/import">
+                Importer CSV
+              </a>
               <a class="btn outline" href="/admin/rounds/{r.id}/edit_close">
                 Modifier la clôture
               </a>
@@ -878,6 +2841,9 @@ def admin_rounds():
         <label>Date/heure de clôture (optionnel)
           <input type="datetime-local" name="closes_at">
         </label>
+        <label>Saison (classement général)
+          <input type="text" name="season" value="{datetime.utcnow().year}" maxlength="40">
+        </label>
         <label>Image de la manche (PNG/JPG, optionnel)
           <input type="file" name="plan" accept="image/*">
         </label>
@@ -886,6 +2852,10 @@ def admin_rounds():
 
 
       <h2 style="margin-top:16px;">Liste</h2>
+      <p class="row" style="gap:8px;">
+        <a class="btn outline" href="/admin/rounds/export.csv">⬇️ Export CSV (toutes les manches)</a>
+        <a class="btn outline" href="/admin/rounds/export.csv?gzip=1">⬇️ Export compressé (.csv.gz)</a>
+      </p>
       <ul class="cards">{items}</ul>
     """)
 
@@ -904,7 +2874,9 @@ def admin_round_close(round_id):
     if not r:
         return PAGE("<h1>Erreur</h1><p class='muted'>Manche introuvable.</p>"), 404
     r.status = "closed"
+    bump_version("rounds", round_key(r.id))
     db.session.commit()
+    invalidate_rounds_fragments()
     return redirect(url_for("admin_rounds"))
 
 @app.post("/admin/rounds/<int:round_id>/open")
@@ -918,7 +2890,9 @@ def admin_round_open(round_id):
     if not r:
         return PAGE("<h1>Erreur</h1><p class='muted'>Manche introuvable.</p>"), 404
     r.status = "open"
+    bump_version("rounds", round_key(r.id))
     db.session.commit()
+    invalidate_rounds_fragments()
     return redirect(url_for("admin_rounds"))
 
 @app.post("/admin/rounds/<int:round_id>/delete")
@@ -935,9 +2909,15 @@ def admin_round_delete(round_id):
     # Supprimer d'abord les chronos liés (évite l'erreur de contrainte)
     try:
         from sqlalchemy import delete
+        db.session.execute(delete(RoundStanding).where(RoundStanding.round_id == round_id))
+        db.session.execute(delete(StandingRemoval).where(StandingRemoval.round_id == round_id))
         db.session.execute(delete(TimeEntry).where(TimeEntry.round_id == round_id))
+        release_plan_blob(r.plan_hash, except_round_id=r.id)
+        mark_season_dirty(r.season, r.id)
         db.session.delete(r)
+        bump_version("rounds", round_key(round_id))
         db.session.commit()
+        invalidate_rounds_fragments()
         return redirect(url_for("admin_rounds"))
     except Exception as e:
         db.session.rollback()
@@ -960,20 +2940,27 @@ def admin_times():
     # Filtre "uniquement avec nouveaux messages du pilote"
     show_unread_only = request.args.get("unread") == "1"
 
+    from sqlalchemy.orm import contains_eager
     q = (
         TimeEntry.query
         .join(User, User.id == TimeEntry.user_id)
         .join(Round, Round.id == TimeEntry.round_id)
+        .options(contains_eager(TimeEntry.user), contains_eager(TimeEntry.round))
     )
     if tab in ("pending", "approved", "rejected"):
         q = q.filter(TimeEntry.status == tab)
 
+    # Filtre "nouveaux messages du pilote" poussé en SQL (sous-requête groupée)
+    if show_unread_only:
+        q = q.filter(TimeEntry.id.in_(unread_entries_select("admin")))
+
     entries = q.order_by(TimeEntry.created_at.desc()).all()
 
-    # Si on ne veut que ceux avec nouveaux messages du pilote,
-    # on garde uniquement les chronos où has_unread_pilot_messages_for_admin(e.id) est True
+    # Drapeaux "non lu" de toute la page en une seule requête
     if show_unread_only:
-        entries = [e for e in entries if has_unread_pilot_messages_for_admin(e.id)]
+        unread_ids = {e.id for e in entries}
+    else:
+        unread_ids = unread_entry_ids("admin", (e.id for e in entries))
 
     # Onglets de statut
     def tab_link(label, key):
@@ -1027,8 +3014,7 @@ def admin_times():
         actions = []
 
         # Bouton / icône de chat (tu as déjà ajouté la bulle plus haut dans ton code si tu veux)
-        unread = has_unread_pilot_messages_for_admin(e.id)
-        if unread:
+        if e.id in unread_ids:
             actions.append(
                 f"<a class='icon-btn' href='/admin/times/{e.id}/chat' "
                 f"title='Nouveaux messages avec le pilote' aria-label='Nouveaux messages avec le pilote'>"
@@ -1051,28 +3037,29 @@ def admin_times():
 
         if e.status == "pending":
             actions.append(
-                f"<form method='post' action='/admin/times/{e.id}/approve' style='display:inline; margin-left:6px;'>"
+                f"<form method='post' action='/admin/times/{e.id}/approve' class='mod-form' style='display:inline; margin-left:6px;'>"
                 f"<button class='btn' type='submit'>Valider</button></form>"
             )
             actions.append(
-                f"<form method='post' action='/admin/times/{e.id}/reject' style='display:inline; margin-left:6px;'>"
+                f"<form method='post' action='/admin/times/{e.id}/reject' class='mod-form' style='display:inline; margin-left:6px;'>"
                 f"<button class='btn danger' type='submit'>Rejeter</button></form>"
             )
         elif e.status == "approved":
             actions.append(
-                f"<form method='post' action='/admin/times/{e.id}/reject' style='display:inline; margin-left:6px;'>"
+                f"<form method='post' action='/admin/times/{e.id}/reject' class='mod-form' style='display:inline; margin-left:6px;'>"
                 f"<button class='btn danger' type='submit'>Rejeter</button></form>"
             )
         elif e.status == "rejected":
             actions.append(
-                f"<form method='post' action='/admin/times/{e.id}/approve' style='display:inline; margin-left:6px;'>"
+                f"<form method='post' action='/admin/times/{e.id}/approve' class='mod-form' style='display:inline; margin-left:6px;'>"
                 f"<button class='btn' type='submit'>Valider</button></form>"
             )
 
         actions_html = "".join(actions)
 
         return f"""
-        <tr>
+        <tr data-id="{e.id}">
+          <td><input type="checkbox" name="ids" value="{e.id}" form="bulk-form" aria-label="Sélectionner"></td>
           <td>{e.id}</td>
           <td>{display_name(e.user)}</td>
           <td>{e.round.name}</td>
@@ -1087,9 +3074,10 @@ def admin_times():
 
     rows_html = "".join(row(e) for e in entries)
     table = f"""
-      <table class="table">
+      <table class="table" data-tab="{tab}">
         <thead>
           <tr>
+            <th><input type="checkbox" id="bulk-all" aria-label="Tout sélectionner"></th>
             <th>ID</th>
             <th>Pilote</th>
             <th>Manche</th>
@@ -1107,59 +3095,486 @@ def admin_times():
       </table>
     """
 
+    # Actions groupées sur les lignes cochées
+    bulk_bar = """
+      <form method="post" action="/admin/times/bulk" id="bulk-form" class="row" style="gap:8px; margin-bottom:8px;">
+        <span class="muted">Sélection :</span>
+        <button class="btn" type="submit" name="action" value="approve">Valider</button>
+        <button class="btn danger" type="submit" name="action" value="reject">Rejeter</button>
+      </form>
+      <script>
+      (function(){
+        const all = document.getElementById('bulk-all');
+        if (all) all.addEventListener('change', () => {
+          document.querySelectorAll("input[name='ids'][form='bulk-form']").forEach(cb => { cb.checked = all.checked; });
+        });
+
+        // Modération sans rechargement : seule une ligne dont le nouveau statut ne
+        // correspond plus à l'onglet le quitte (valider depuis "approved" la laisse en place)
+        const table = document.querySelector('table.table[data-tab]');
+        const tab = table ? table.dataset.tab : '';
+        function dropRows(statuses){
+          Object.keys(statuses).forEach(id => {
+            if (statuses[id] === tab) return;
+            const tr = document.querySelector("tr[data-id='" + id + "']");
+            if (tr) tr.remove();
+          });
+          const body = table && table.tBodies[0];
+          if (body && !body.children.length) {
+            body.innerHTML = "<tr><td colspan='10' class='muted'>Plus aucun chrono dans cet onglet.</td></tr>";
+          }
+        }
+        function send(form, submitter){
+          const data = new FormData(form);
+          if (submitter && submitter.name) data.append(submitter.name, submitter.value);
+          return fetch(form.action, {
+            method: 'POST', body: data, credentials: 'same-origin',
+            headers: {'Accept': 'application/json'}
+          }).then(r => r.ok ? r.json() : Promise.reject(r));
+        }
+        if (!window.fetch) return;
+        document.querySelectorAll('form.mod-form').forEach(form => {
+          form.addEventListener('submit', ev => {
+            ev.preventDefault();
+            form.querySelectorAll('button').forEach(b => { b.disabled = true; });
+            send(form).then(d => dropRows(d.statuses)).catch(() => form.submit());
+          });
+        });
+        const bulk = document.getElementById('bulk-form');
+        if (bulk) bulk.addEventListener('submit', ev => {
+          ev.preventDefault();
+          send(bulk, ev.submitter).then(d => {
+            dropRows(d.statuses);
+            if (all) all.checked = false;
+          }).catch(() => {
+            const h = document.createElement('input');
+            h.type = 'hidden'; h.name = 'action'; h.value = ev.submitter ? ev.submitter.value : '';
+            bulk.appendChild(h);
+            bulk.submit();
+          });
+        });
+      })();
+      </script>
+    """
+
     return PAGE(f"""
       <h1>Admin &mdash; Chronos</h1>
       {tabs}
       {unread_toggle_html}
+      {bulk_bar}
       {table}
     """)
 
 
 
+def _moderation_error(status: int, html: str, msg: str):
+    if _wants_json():
+        return _json({"error": msg}, status)
+    return PAGE(html), status
+
+
+def _moderation_done(e, superseded=()):
+    """
+    Appel asynchrone (Accept: application/json) → statut du chrono et, comme pour les
+    actions groupées, `statuses` de toutes les lignes touchées ; sinon retour à la liste.
+    """
+    if _wants_json():
+        statuses = {sid: "superseded" for sid in superseded}
+        statuses[e.id] = e.status
+        return _json({"id": e.id, "status": e.status, "statuses": statuses})
+    return redirect(request.referrer or url_for("admin_times"))
+
+
 @app.post("/admin/times/<int:time_id>/approve")
 def admin_time_approve(time_id):
     if not db:
-        return PAGE("<h1>Admin</h1><p class='muted'>DB non dispo.</p>")
+        return _moderation_error(500, "<h1>Admin</h1><p class='muted'>DB non dispo.</p>", "db")
     u = current_user()
     if not is_admin(u):
-        return PAGE("<h1>Accès refusé</h1><p class='muted'>Réservé aux administrateurs.</p>"), 403
+        return _moderation_error(403, "<h1>Accès refusé</h1><p class='muted'>Réservé aux administrateurs.</p>", "forbidden")
     e = db.session.get(TimeEntry, time_id)
     if not e:
-        return PAGE("<h1>Erreur</h1><p class='muted'>Chrono introuvable.</p>"), 404
+        return _moderation_error(404, "<h1>Erreur</h1><p class='muted'>Chrono introuvable.</p>", "not found")
 
     # 1) Valider ce chrono
     e.status = "approved"
 
-    # 2) Auto-inactiver (superseded) les autres chronos validés
+    # 2) Auto-inactiver (superseded) les autres chronos validés (ids renvoyés pour la file)
+    from sqlalchemy import update
     db.session.flush()  # s'assure que e.id est connu
-    (
-        db.session.query(TimeEntry)
-        .filter(
+    superseded = db.session.execute(
+        update(TimeEntry)
+        .where(
             TimeEntry.round_id == e.round_id,
             TimeEntry.user_id == e.user_id,
             TimeEntry.status == "approved",
             TimeEntry.id != e.id,
         )
-        .update({TimeEntry.status: "superseded"}, synchronize_session=False)
-    )
+        .values(status="superseded")
+        .returning(TimeEntry.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+
+    # 3) Classement matérialisé
+    standings_after_approve(e)
+
+    # 4) Prévenir le pilote (envoyé en arrière-plan après le commit)
+    notify_pilot_status(e)
 
     db.session.commit()
-    return redirect(url_for("admin_times"))
+    return _moderation_done(e, superseded)
 
 
 @app.post("/admin/times/<int:time_id>/reject")
 def admin_time_reject(time_id):
     if not db:
-        return PAGE("<h1>Admin</h1><p class='muted'>DB non dispo.</p>")
+        return _moderation_error(500, "<h1>Admin</h1><p class='muted'>DB non dispo.</p>", "db")
     u = current_user()
     if not is_admin(u):
-        return PAGE("<h1>Accès refusé</h1><p class='muted'>Réservé aux administrateurs.</p>"), 403
+        return _moderation_error(403, "<h1>Accès refusé</h1><p class='muted'>Réservé aux administrateurs.</p>", "forbidden")
     e = db.session.get(TimeEntry, time_id)
     if not e:
-        return PAGE("<h1>Erreur</h1><p class='muted'>Chrono introuvable.</p>"), 404
+        return _moderation_error(404, "<h1>Erreur</h1><p class='muted'>Chrono introuvable.</p>", "not found")
     e.status = "rejected"
+    for rid in standings_remove([e.id]):
+        rerank_round(rid)
+    notify_pilot_status(e)
     db.session.commit()
-    return redirect(url_for("admin_times"))
+    return _moderation_done(e)
+
+
+# --- Modération en lot ---
+BULK_MAX = 500  # chronos max par requête
+
+
+def moderate_entries(ids, action: str) -> dict:
+    """
+    Valide ou rejette un ensemble de chronos dans la transaction courante, en requêtes
+    ensemblistes (le commit reste à l'appelant) :
+      - approve : par couple (pilote, manche), le plus récent des chronos sélectionnés
+        l'emporte ; un seul UPDATE passe en "superseded" tous les autres chronos validés
+        de ces couples (tuple_ IN) ;
+      - reject  : un UPDATE, retrait du classement.
+    Chaque manche touchée n'est reclassée qu'une fois. Renvoie un résumé compact, dont
+    `statuses` : nouveau statut de chaque chrono touché (sélectionné ou rétrogradé).
+    """
+    from sqlalchemy import tuple_, update
+    from sqlalchemy.orm import joinedload
+    from sqlalchemy.orm.attributes import set_committed_value
+    entries = (
+        TimeEntry.query
+        .options(joinedload(TimeEntry.user), joinedload(TimeEntry.round))
+        .filter(TimeEntry.id.in_(ids))
+        .all()
+    )
+    result = {"action": action, "ids": sorted(e.id for e in entries), "superseded": 0, "rounds": [], "statuses": {}}
+    if not entries:
+        return result
+
+    if action == "reject":
+        (
+            TimeEntry.query
+            .filter(TimeEntry.id.in_(result["ids"]))
+            .update({TimeEntry.status: "rejected"}, synchronize_session=False)
+        )
+        rounds = standings_remove(result["ids"])
+        changed = [e for e in entries if e.status != "rejected"]
+        for e in entries:
+            set_committed_value(e, "status", "rejected")  # déjà écrit par l'UPDATE
+    else:
+        winners = {}
+        for e in sorted(entries, key=lambda e: (e.created_at or datetime.min, e.id)):
+            winners[(e.user_id, e.round_id)] = e  # le plus récent du couple gagne
+        win_ids = [e.id for e in winners.values()]
+        pairs = list(winners)
+        changed = [e for e in winners.values() if e.status != "approved"]
+
+        # 1) Rétrogradation ensembliste : tout autre chrono validé (ou sélectionné) des couples
+        demoted = db.session.execute(
+            update(TimeEntry)
+            .where(
+                tuple_(TimeEntry.user_id, TimeEntry.round_id).in_(pairs),
+                TimeEntry.id.not_in(win_ids),
+                db.or_(TimeEntry.status == "approved", TimeEntry.id.in_(result["ids"])),
+            )
+            .values(status="superseded")
+            .returning(TimeEntry.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        result["superseded"] = len(demoted)
+        result["statuses"].update((sid, "superseded") for sid in demoted)
+        # 2) Validation
+        (
+            TimeEntry.query
+            .filter(TimeEntry.id.in_(win_ids))
+            .update({TimeEntry.status: "approved"}, synchronize_session=False)
+        )
+        for e in entries:
+            set_committed_value(e, "status", "approved" if e.id in win_ids else "superseded")
+
+        # 3) Classement : lignes remplacées retirées, gagnants insérés / mis à jour
+        q = RoundStanding.query.filter(
+            tuple_(RoundStanding.user_id, RoundStanding.round_id).in_(pairs),
+            RoundStanding.time_entry_id.not_in(win_ids),
+        )
+        _record_removals(q)
+        q.delete(synchronize_session=False)
+        existing = {
+            st.time_entry_id: st
+            for st in RoundStanding.query.filter(RoundStanding.time_entry_id.in_(win_ids))
+        }
+        fresh = []
+        for e in winners.values():
+            fields = _standing_fields(e)
+            st = existing.get(e.id)
+            if st is None:
+                fresh.append(dict(time_entry_id=e.id, rank=0, pct=0.0, **fields))
+            else:
+                for k, v in fields.items():
+                    setattr(st, k, v)
+                st.changed_version = None  # re-daté par rerank_round
+        if fresh:
+            db.session.execute(RoundStanding.__table__.insert(), fresh)  # une insertion multi-lignes
+        db.session.flush()
+        rounds = {rid for _, rid in pairs}
+
+    for rid in sorted(rounds):
+        rerank_round(rid)
+    notify_pilot_status(*changed)
+    result["rounds"] = sorted(rounds)
+    result["statuses"].update((e.id, e.status) for e in entries)  # + chronos sélectionnés
+    return result
+
+
+@app.post("/admin/times/bulk")
+def admin_times_bulk():
+    """
+    Validation / rejet d'une sélection de chronos en une transaction.
+    Formulaire : action=approve|reject, ids=… (répété ou "1,2,3").
+    Réponse JSON (Accept: application/json) ou retour à la liste.
+    """
+    if not db:
+        return PAGE("<h1>Admin</h1><p class='muted'>DB non dispo.</p>"), 500
+    u = current_user()
+    if not is_admin(u):
+        if _wants_json():
+            return _json({"error": "forbidden"}, 403)
+        return PAGE("<h1>Accès refusé</h1><p class='muted'>Réservé aux administrateurs.</p>"), 403
+
+    action = request.form.get("action")
+    ids = {
+        int(x)
+        for raw in request.form.getlist("ids")
+        for x in raw.split(",")
+        if x.strip().isascii() and x.strip().isdigit()
+    }
+    if action not in ("approve", "reject") or not ids or len(ids) > BULK_MAX:
+        if _wants_json():
+            return _json({"error": f"action approve|reject et 1 à {BULK_MAX} ids attendus"}, 400)
+        return PAGE("<h1>Erreur</h1><p class='muted'>Sélection ou action invalide.</p>"), 400
+
+    try:
+        result = moderate_entries(sorted(ids), action)
+        db.session.commit()
+    except Exception as ex:
+        db.session.rollback()
+        if _wants_json():
+            return _json({"error": str(ex)}, 500)
+        return PAGE(f"<h1>Erreur</h1><p class='muted'>Action groupée impossible : {ex}</p>"), 500
+
+    if _wants_json():
+        return _json(result)
+    return redirect(request.referrer or url_for("admin_times"))
+
+
+# --- Import CSV de chronos (système de chronométrage) ---
+IMPORT_MAX_ROWS = 20000
+IMPORT_MAX_ERRORS_SHOWN = 200
+
+# En-têtes reconnus (minuscules, sans accents) → champ
+IMPORT_COLUMNS = {
+    "email": "pilot", "e-mail": "pilot", "mail": "pilot",
+    "pseudo": "pilot", "pilote": "pilot", "pilot": "pilot", "nom": "pilot",
+    "temps": "time", "time": "time", "chrono": "time",
+    "penalites": "penalties", "penalties": "penalties", "pen": "penalties", "pen.": "penalties",
+    "moto": "bike", "bike": "bike",
+    "youtube": "youtube_link", "video": "youtube_link", "lien": "youtube_link",
+}
+
+
+def _import_header(name: str) -> str:
+    import unicodedata
+    n = unicodedata.normalize("NFKD", (name or "").strip().lower())
+    n = "".join(c for c in n if not unicodedata.combining(c))
+    return IMPORT_COLUMNS.get(n, "")
+
+
+def import_times_csv(stream, round_id: int, approve: bool) -> dict:
+    """
+    Importe un CSV (lu en flux) dans une manche, dans la transaction courante :
+      - pilotes retrouvés par e-mail ou pseudo (s'il est unique) via des cartes préchargées ;
+      - temps convertis par lot (parse_times_to_ms) ;
+      - insertions multi-lignes (INSERT … RETURNING par paquets), aucune requête par ligne ;
+      - approve=True : validation ensembliste (moderate_entries). Si un pilote a plusieurs
+        lignes, c'est son meilleur temps qui est validé.
+    Renvoie {"imported", "errors": [(ligne, message)], "approved"}.
+    """
+    from sqlalchemy import insert
+    sample = stream.read(4096)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(_chain_text(sample, stream), dialect)
+
+    header = next(reader, None)
+    if not header:
+        return {"imported": 0, "errors": [(1, "Fichier vide")], "approved": 0}
+    fields = [_import_header(h) for h in header]
+    if "pilot" not in fields or "time" not in fields:
+        return {"imported": 0, "approved": 0,
+                "errors": [(1, "Colonnes requises : email ou pseudo, et temps")]}
+    col = {f: i for i, f in reversed(list(enumerate(fields))) if f}
+
+    # Cartes des pilotes : une seule requête. Les pseudos ne sont pas uniques : un pseudo
+    # partagé par plusieurs comptes est refusé plutôt qu'attribué au hasard.
+    by_email, by_pseudo, ambiguous = {}, {}, set()
+    for uid, email, pseudo in db.session.query(User.id, User.email, User.pseudo):
+        if email:
+            by_email[email.strip().lower()] = uid
+        if pseudo:
+            key = pseudo.strip().lower()
+            if by_pseudo.setdefault(key, uid) != uid:
+                ambiguous.add(key)
+
+    errors, pending = [], []
+    for line_no, cells in enumerate(reader, start=2):
+        if not any(c.strip() for c in cells):
+            continue
+        if len(pending) + len(errors) >= IMPORT_MAX_ROWS:
+            errors.append((line_no, f"Import limité à {IMPORT_MAX_ROWS} lignes : suite ignorée"))
+            break
+        def get(f):
+            i = col.get(f)
+            return cells[i].strip() if i is not None and i < len(cells) else ""
+
+        who = get("pilot")
+        uid = by_email.get(who.lower())
+        if uid is None and who.lower() in ambiguous:
+            errors.append((line_no, f"Pseudo ambigu : {who} (utiliser l'e-mail)"))
+            continue
+        if uid is None:
+            uid = by_pseudo.get(who.lower())
+        if uid is None:
+            errors.append((line_no, f"Pilote inconnu : {who or '(vide)'}"))
+            continue
+        pen_raw = get("penalties") or "0"
+        if not (pen_raw.isascii() and pen_raw.isdigit()):  # isdigit() seul accepte "²"
+            errors.append((line_no, f"Pénalités invalides : {pen_raw}"))
+            continue
+        pending.append((line_no, get("time"), {
+            "user_id": uid,
+            "round_id": round_id,
+            "penalties": int(pen_raw),
+            "bike": get("bike")[:120] or None,
+            "youtube_link": get("youtube_link")[:500] or None,
+            "note": "Import CSV",
+            "status": "pending",
+        }))
+
+    rows = []
+    for (line_no, _, row), (ms, err) in zip(pending, parse_times_to_ms(t for _, t, _ in pending)):
+        if err:
+            errors.append((line_no, err))
+            continue
+        row["raw_time_ms"] = ms
+        rows.append(row)
+
+    # Plus lent d'abord : à départage égal (même pilote), le meilleur temps a l'id le plus grand
+    now = datetime.utcnow()
+    rows.sort(key=lambda r: -final_time_ms(r["raw_time_ms"], r["penalties"]))
+    ids = []
+    for k in range(0, len(rows), 1000):
+        batch = [dict(r, created_at=now) for r in rows[k:k + 1000]]
+        ids += db.session.execute(insert(TimeEntry).returning(TimeEntry.id), batch).scalars().all()
+
+    approved = 0
+    if approve and ids:
+        moderate_entries(ids, "approve")
+        approved = len({r["user_id"] for r in rows})  # un chrono validé par pilote
+    errors.sort()
+    return {"imported": len(ids), "errors": errors, "approved": approved}
+
+
+def _chain_text(first: str, stream):
+    """Relit les lignes du flux en recollant l'échantillon déjà consommé."""
+    rest = stream.readline()
+    head = first + rest
+    for line in io.StringIO(head):
+        yield line
+    for line in stream:
+        yield line
+
+
+@app.route("/admin/rounds/<int:round_id>/import", methods=["GET", "POST"])
+def admin_round_import(round_id):
+    if not db:
+        return PAGE("<h1>Admin</h1><p class='muted'>DB non dispo.</p>"), 500
+    u = current_user()
+    if not is_admin(u):
+        return PAGE("<h1>Accès refusé</h1><p class='muted'>Réservé aux administrateurs.</p>"), 403
+    r = db.session.get(Round, round_id)
+    if not r:
+        return PAGE("<h1>Erreur</h1><p class='muted'>Manche introuvable.</p>"), 404
+
+    from html import escape
+    report = ""
+    if request.method == "POST":
+        f = request.files.get("file")
+        if not f or not f.filename:
+            return PAGE("<h1>Import</h1><p class='muted'>Aucun fichier reçu.</p>"), 400
+        stream = io.TextIOWrapper(f.stream, encoding="utf-8-sig", errors="replace", newline="")
+        try:
+            res = import_times_csv(stream, r.id, approve=request.form.get("approve") == "1")
+            db.session.commit()
+        except Exception as ex:
+            db.session.rollback()
+            return PAGE(f"<h1>Import</h1><p class='muted'>Import impossible : {escape(str(ex))}</p>"), 500
+
+        # les messages reprennent des cellules du fichier : échappés
+        err_items = "".join(
+            f"<li><strong>Ligne {n}</strong> : {escape(msg)}</li>"
+            for n, msg in res["errors"][:IMPORT_MAX_ERRORS_SHOWN]
+        )
+        more = len(res["errors"]) - IMPORT_MAX_ERRORS_SHOWN
+        if more > 0:
+            err_items += f"<li class='muted'>… et {more} autre(s) erreur(s)</li>"
+        report = f"""
+        <section class="card" style="margin-bottom:12px;">
+          <p><strong>{res['imported']}</strong> chrono(s) importé(s)
+             {f"dont <strong>{res['approved']}</strong> validé(s)" if res['approved'] else "(en attente de validation)"}
+             &middot; <strong>{len(res['errors'])}</strong> ligne(s) en erreur.</p>
+          {f"<ul>{err_items}</ul>" if err_items else ""}
+        </section>
+        """
+
+    return PAGE(f"""
+      <h1>Import CSV &mdash; {r.name}</h1>
+      {report}
+      <form method="post" class="form" enctype="multipart/form-data">
+        <label>Fichier CSV (séparateur , ; ou tabulation)
+          <input type="file" name="file" accept=".csv,text/csv,text/plain" required>
+        </label>
+        <label style="display:flex; gap:8px; align-items:center;">
+          <input type="checkbox" name="approve" value="1"> Valider directement les chronos importés
+        </label>
+        <button class="btn" type="submit">Importer</button>
+      </form>
+      <p class="muted">Colonnes : <code>email</code> ou <code>pseudo</code>, <code>temps</code>
+        (1:23.456, 83.456…), et en option <code>penalites</code>, <code>moto</code>, <code>youtube</code>.</p>
+      <p><a class="btn outline" href="/admin/rounds">← Retour aux manches</a></p>
+    """)
+
 
 @app.get("/__selftest")
 def __selftest():
@@ -1332,14 +3747,19 @@ def profile():
     nationality = u.nationality or "—"
     email = u.email
 
-    # Récupère tous les chronos de l'utilisateur
+    # Récupère tous les chronos de l'utilisateur (manches chargées dans la même requête)
+    from sqlalchemy.orm import joinedload
     entries = (
         TimeEntry.query
+        .options(joinedload(TimeEntry.round))
         .filter_by(user_id=u.id)
         .order_by(TimeEntry.created_at.desc())
         .all()
     )
 
+    # Bulles "nouveaux messages de l'admin" : une seule requête pour tout l'historique
+    unread_ids = unread_entry_ids("pilot", (e.id for e in entries))
+
     # --- Section "Mes chronos" avec badges de statut ---
     # Section chronos
     if not entries:
@@ -1374,9 +3794,7 @@ def profile():
 
 
             # lien vers le chat avec l'admin pour ce chrono (bulle si nouveaux messages de l'admin)
-            unread_pilot = has_unread_admin_messages_for_pilot(e.id)
-
-            if unread_pilot:
+            if e.id in unread_ids:
                 chat_link = (
                     f"<a class='icon-btn' href='/times/{e.id}/chat' "
                     f"title=\"Nouveaux messages avec l'admin\" aria-label=\"Nouveaux messages avec l'admin\">"
@@ -1484,7 +3902,12 @@ def profile():
 def round_leaderboard(round_id):
     if not db:
         return PAGE("<h1>Classement</h1><p class='muted'>DB non dispo.</p>")
+    # Page complète en cache tant que la version "round:<id>" n'a pas bougé
+    return versioned_page(round_key(round_id), _auth_variant(),
+                          lambda: _render_round_leaderboard(round_id))
 
+
+def _render_round_leaderboard(round_id):
     r = db.session.get(Round, round_id)
     if not r:
         return PAGE("<h1>Classement</h1><p class='muted'>Manche introuvable.</p>"), 404
@@ -1538,12 +3961,34 @@ def round_leaderboard(round_id):
     # --- Bouton "Voir le plan" (si un plan existe) ---
     # --- Boutons Plan (si un plan existe) ---
     plan_btn = ""
-    if getattr(r, "plan_data", None):
+    plan_preview = ""
+    if getattr(r, "plan_hash", None):
+        variants = plan_variants(r)
+        # "Voir le plan" ouvre la déclinaison plein écran si elle existe (bien plus légère)
+        full = variants.get("full")
+        view_href = f"/plans/{full.blob_sha}/plan_{r.id}.webp" if full else plan_url(r)
+        if variants:
+            # petite image d'origine → plusieurs déclinaisons de même largeur : une seule par largeur
+            by_width = {}
+            for name, v in variants.items():
+                by_width.setdefault(v.width, (name, v))
+            srcset = ", ".join(
+                f"/plans/{v.blob_sha}/plan_{r.id}_{name}.webp {w}w"
+                for w, (name, v) in sorted(by_width.items())
+            )
+            plan_preview = (
+                f"<a href='{view_href}' target='_blank' rel='noopener' title='Ouvrir le plan'>"
+                f"<picture>"
+                f"<source type='{PLAN_VARIANT_MIME}' srcset='{srcset}' sizes='(max-width: 640px) 100vw, 640px'>"
+                f"<img src='{plan_url(r)}' alt='Plan de la manche' loading='lazy' decoding='async' "
+                f"style='max-width:100%; border-radius:8px; margin-bottom:16px;'>"
+                f"</picture></a>"
+            )
         plan_btn = (
             f"<div class='row' style='gap:8px;'>"
-            f"<a class='btn outline' href='/rounds/{r.id}/plan' target='_blank' rel='noopener' title='Ouvrir le plan dans un nouvel onglet'>"
+            f"<a class='btn outline' href='{view_href}' target='_blank' rel='noopener' title='Ouvrir le plan dans un nouvel onglet'>"
             f"<span class='i'>🖼️</span> Voir le plan</a>"
-            f"<a class='btn' href='/rounds/{r.id}/plan?dl=1' title='Télécharger le plan'>"
+            f"<a class='btn' href='{plan_url(r, dl=True)}' title='Télécharger le plan'>"
             f"<span class='i'>⬇️</span> Télécharger</a>"
             f"</div>"
         )
@@ -1554,83 +3999,300 @@ def round_leaderboard(round_id):
         <h1 style="margin:0;">{r.name}</h1>
         {plan_btn}
       </div>
+      {plan_preview}
     """
 
 
 
     try:
-        # On ne prend que les chronos VALIDÉS
-        entries = (
-            TimeEntry.query
-            .filter_by(round_id=r.id, status="approved")
-            .order_by(TimeEntry.created_at.desc())
+        # Classement matérialisé : une seule lecture indexée (round_id, rank)
+        standings = (
+            RoundStanding.query
+            .filter_by(round_id=r.id)
+            .order_by(RoundStanding.rank.asc())
             .all()
         )
 
-       
-        if not entries:
-            return PAGE(f"{heading_html}{countdown_html}<p class='muted'>Aucun chrono validé pour le moment.</p>")
+        # Mise à jour en direct : à chaque événement SSE on recharge le bloc #standings
+        # (la page est servie depuis le cache versionné, donc peu coûteuse)
+        live_script = f"""
+        <script>
+        (function(){{
+          if (!window.EventSource || !window.fetch) return;
+          const es = new EventSource('/rounds/{r.id}/stream');
+          let busy = false;
+          function refresh(){{
+            if (busy) return; busy = true;
+            fetch(location.pathname, {{credentials: 'same-origin'}})
+              .then(res => res.text())
+              .then(html => {{
+                const next = new DOMParser().parseFromString(html, 'text/html').getElementById('standings');
+                const cur = document.getElementById('standings');
+                if (next && cur) cur.replaceWith(next);
+              }})
+              .finally(() => {{ busy = false; }});
+          }}
+          es.addEventListener('standings', refresh);
+          es.addEventListener('reset', refresh);
+          es.addEventListener('gone', () => es.close());
+        }})();
+        </script>
+        """
 
+        if not standings:
+            return PAGE(f"{heading_html}{countdown_html}<div id='standings'><p class='muted'>Aucun chrono validé pour le moment.</p></div>{live_script}")
 
-        # Sécuriser le calcul du final
-        safe_entries, finals = [], []
-        for e in entries:
-            try:
-                raw_ms = int(e.raw_time_ms or 0)
-                pen = int(e.penalties or 0)
-                fm = final_time_ms(raw_ms, pen)
-                safe_entries.append((e, fm))
-                finals.append(fm)
-            except Exception:
-                continue
+        def row(st):
+            name = st.pilot_name or "—"
+            nat = (st.nationality or "—").upper()
+            yt = f"<a target=\"_blank\" rel=\"noopener\" href=\"{st.youtube_link}\">Vidéo</a>" if (st.youtube_link or "").strip() else "—"
+            return (
+                "<tr>"
+                f"<td>{st.rank}</td>"
+                f"<td>{name}</td>"
+                f"<td>{nat}</td>"
+                f"<td>{ms_to_str(st.raw_time_ms)}</td>"
+                f"<td>{st.penalties}</td>"
+                f"<td><strong>{ms_to_str(st.final_ms)}</strong></td>"
+                f"<td>{st.pct:.2f}%</td>"
+                f"<td>{st.bike or '—'}</td>"
+                f"<td>{yt}</td>"
+                "</tr>"
+            )
+
+        rows = "".join(row(st) for st in standings)
+
+        table = (
+            "<table class='table'>"
+            "<thead><tr>"
+            "<th>#</th><th>Pilote</th><th>Nation</th><th>Brut</th><th>Pén.</th><th>Final</th>"
+            "<th>% du meilleur</th><th>Moto</th><th>YouTube</th>"
+            "</tr></thead>"
+            f"<tbody>{rows}</tbody>"
+            "</table>"
+        )
+
+        return PAGE(f"""
+          {heading_html}
+          {countdown_html}
+          <div id="standings">{table}</div>
+          {live_script}
+        """)
+
+    except Exception as e:
+        return PAGE(f"<h1>{r.name}</h1><p class='muted'>Erreur: {e}</p>"), 500
+
+
+@app.get("/api/rounds/<int:round_id>/leaderboard")
+def api_round_leaderboard(round_id):
+    """
+    Classement en JSON compact, ETag = version du classement ("r<id>-v<version>").
+      - If-None-Match à jour → 304 (une seule lecture : le compteur de version)
+      - ?since=<version> → seulement les lignes modifiées depuis + les ids retirés
+    """
+    if not db:
+        return _json({"error": "db"}, 500)
+    version = get_version(round_key(round_id))
+    etag = f"r{round_id}-v{version}"
+    headers = {"Cache-Control": "no-cache", "ETag": f'"{etag}"'}
+    if version and request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    payload = leaderboard_payload(round_id, version, request.args.get("since", type=int))
+    if payload is None:
+        return _json({"error": "round not found"}, 404)
+    return _json(payload, 200, headers)
+
+
+def leaderboard_payload(round_id: int, version: int, since=None):
+    """Contenu JSON du classement (complet, ou diff depuis `since`). None si manche inconnue."""
+    r = db.session.get(Round, round_id)
+    if not r:
+        return None
+
+    diff = since is not None and 0 <= since <= version
+
+    q = RoundStanding.query.filter_by(round_id=round_id)
+    removed = []
+    if diff:
+        q = q.filter(RoundStanding.changed_version > since)
+        current_ids = db.select(RoundStanding.time_entry_id).where(RoundStanding.round_id == round_id)
+        removed = [
+            tid for (tid,) in
+            db.session.query(StandingRemoval.time_entry_id)
+            .filter(
+                StandingRemoval.round_id == round_id,
+                StandingRemoval.version > since,
+                StandingRemoval.time_entry_id.not_in(current_ids),
+            )
+            .distinct()
+        ]
+    rows = q.order_by(RoundStanding.rank.asc()).all()
+
+    payload = {
+        "round": r.id,
+        "name": r.name,
+        "status": r.status,
+        "version": version,
+        "since": since if diff else None,
+        "rows": [
+            {
+                "id": st.time_entry_id,
+                "rank": st.rank,
+                "pilot": st.pilot_name,
+                "nation": (st.nationality or "").upper() or None,
+                "final_ms": st.final_ms,
+                "pct": round(st.pct, 2),
+            }
+            for st in rows
+        ],
+        "removed": removed,
+    }
+    return payload
+
+
+def _standings_event(key: str, before: int, version: int):
+    """Événement SSE d'une manche : diff du classement depuis la version précédente."""
+    import json
+    round_id = int(key.split(":", 1)[1])
+    payload = leaderboard_payload(round_id, version, since=before)
+    if payload is None:
+        return ("gone", version, "{}")
+    return ("standings", version, json.dumps(payload, ensure_ascii=False, separators=(",", ":")))
+
+
+HUB.register("round:", _standings_event)
+
+
+@app.get("/rounds/<int:round_id>/stream")
+def round_stream(round_id):
+    """
+    Flux SSE des changements de classement d'une manche. Reprise via Last-Event-ID
+    (= version) : le client reçoit d'abord le diff de ce qu'il a manqué.
+    """
+    if not db:
+        return _json({"error": "db"}, 500)
+    key = round_key(round_id)
+    # le hub diffuse ce qui suit `version` (ou sa propre base si elle est plus récente) ;
+    # l'écart éventuel jusqu'à cette base part dans l'événement initial
+    q, version = HUB.subscribe(key, get_version(key))
+    initial = None
+    last = request.headers.get("Last-Event-ID", type=int)
+    if last is not None and last < version:
+        initial = sse_event(*_standings_event(key, last, version))
+    return Response(
+        sse_stream(key, q, initial),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _json(payload, status=200, headers=None):
+    import json
+    body = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    return Response(body, status=status, mimetype="application/json", headers=headers)
 
-        if not entries:
-            return PAGE(f"{heading_html}{countdown_html}<p class='muted'>Aucun chrono validé pour le moment.</p>")
 
+# --- Export CSV en flux ---
+EXPORT_YIELD_PER = 1000      # lignes lues par aller-retour au curseur serveur
+EXPORT_CHUNK_ROWS = 500      # lignes CSV par morceau envoyé
 
 
-        best = min(finals) if finals else 0
+def export_rows_select(round_ids):
+    """
+    SELECT des chronos validés des manches données, classés côté SQL :
+    rang (ordre du temps final, puis de dépôt) et % du meilleur, par manche.
+    Projection de colonnes seulement : aucun objet ORM n'est construit.
+    """
+    from sqlalchemy import case, func
+    final = TimeEntry.raw_time_ms + case(
+        (TimeEntry.penalties > 0, TimeEntry.penalties * 1000), else_=0
+    )
+    by_round = {"partition_by": TimeEntry.round_id}
+    return (
+        db.select(
+            Round.name,
+            func.row_number().over(
+                order_by=(final.asc(), TimeEntry.created_at.asc(), TimeEntry.id.asc()), **by_round
+            ).label("rank"),
+            func.coalesce(User.pseudo, User.email),
+            User.nationality,
+            TimeEntry.raw_time_ms,
+            TimeEntry.penalties,
+            final.label("final"),
+            (final * 100.0 / func.nullif(func.min(final).over(**by_round), 0)).label("pct"),
+            TimeEntry.bike,
+            TimeEntry.youtube_link,
+        )
+        .join(User, User.id == TimeEntry.user_id)
+        .join(Round, Round.id == TimeEntry.round_id)
+        .where(TimeEntry.round_id.in_(round_ids), TimeEntry.status == "approved")
+        .order_by(Round.created_at.asc(), Round.id.asc(), "rank")
+    )
 
-        def row(i, e, fm):
-            pct = (fm / best * 100.0) if fm > 0 and best > 0 else 0.0
-            name = display_name(getattr(e, "user", None)) if hasattr(e, "user") else "—"
-            nat = (getattr(e.user, "nationality", "") or "—").upper() if hasattr(e, "user") else "—"
-            yt = f"<a target=\"_blank\" rel=\"noopener\" href=\"{e.youtube_link}\">Vidéo</a>" if (e.youtube_link or "").strip() else "—"
-            return (
-                "<tr>"
-                f"<td>{i}</td>"
-                f"<td>{name}</td>"
-                f"<td>{nat}</td>"
-                f"<td>{ms_to_str(e.raw_time_ms)}</td>"
-                f"<td>{e.penalties}</td>"
-                f"<td><strong>{ms_to_str(fm)}</strong></td>"
-                f"<td>{pct:.2f}%</td>"
-                f"<td>{e.bike or '—'}</td>"
-                f"<td>{yt}</td>"
-                "</tr>"
-            )
 
-        safe_entries.sort(key=lambda t: t[1])
-        rows = "".join(row(i + 1, e, fm) for i, (e, fm) in enumerate(safe_entries))
+def stream_export_csv(round_ids, with_round: bool, gzipped: bool):
+    """
+    Générateur des morceaux du CSV (texte, ou gzip si demandé). Les lignes arrivent
+    du curseur serveur par paquets de EXPORT_YIELD_PER : la mémoire reste constante
+    quel que soit le nombre de chronos.
+    """
+    import zlib
+    headers = ["Rang", "Pilote", "Nation", "Brut", "Pénalités", "Final", "% du meilleur", "Moto", "YouTube"]
+    if with_round:
+        headers.insert(0, "Manche")
 
-        table = (
-            "<table class='table'>"
-            "<thead><tr>"
-            "<th>#</th><th>Pilote</th><th>Nation</th><th>Brut</th><th>Pén.</th><th>Final</th>"
-            "<th>% du meilleur</th><th>Moto</th><th>YouTube</th>"
-            "</tr></thead>"
-            f"<tbody>{rows}</tbody>"
-            "</table>"
-        )
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if gzipped else None  # 31 = en-tête gzip
 
-        return PAGE(f"""
-          {heading_html}
-          {countdown_html}
-          {table}
-        """)
+    def emit(text: str) -> bytes:
+        data = text.encode("utf-8")
+        return gz.compress(data) if gz else data
 
-    except Exception as e:
-        return PAGE(f"<h1>{r.name}</h1><p class='muted'>Erreur: {e}</p>"), 500
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(headers)
+
+    stmt = export_rows_select(round_ids).execution_options(yield_per=EXPORT_YIELD_PER)
+    n = 0
+    for round_name, rank, name, nat, raw_ms, pen, fm, pct, bike, yt in db.session.execute(stmt):
+        row = [
+            rank,
+            name or "—",
+            (nat or "—").upper(),
+            ms_to_str(raw_ms),
+            pen,
+            ms_to_str(fm),
+            f"{(pct or 0.0):.2f}%",
+            bike or "",
+            yt or "",
+        ]
+        if with_round:
+            row.insert(0, round_name)
+        writer.writerow(row)
+        n += 1
+        if n % EXPORT_CHUNK_ROWS == 0:
+            chunk = emit(buf.getvalue())
+            buf.seek(0)
+            buf.truncate()
+            if chunk:
+                yield chunk
+
+    tail = emit(buf.getvalue())
+    if gz:
+        tail += gz.flush()
+    if tail:
+        yield tail
+
+
+def _export_response(round_ids, base: str, with_round: bool):
+    from flask import stream_with_context
+    gzipped = request.args.get("gzip") == "1"
+    filename = f"{base}.csv.gz" if gzipped else f"{base}.csv"
+    return Response(
+        stream_with_context(stream_export_csv(round_ids, with_round, gzipped)),
+        mimetype="application/gzip" if gzipped else "text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
 
 
 @app.get("/admin/rounds/<int:round_id>/export.csv")
@@ -1645,81 +4307,43 @@ def admin_round_export_csv(round_id):
     if not r:
         return PAGE("<h1>Erreur</h1><p class='muted'>Manche introuvable.</p>"), 404
 
-    # Récupère les chronos VALIDÉS uniquement
-    entries = (
-        TimeEntry.query
-        .filter_by(round_id=r.id, status="approved")
-        .order_by(TimeEntry.created_at.asc())
-        .all()
-    )
-    if not entries:
-        # CSV vide avec juste l’entête
-        headers = ["Rang", "Pilote", "Nation", "Brut", "Pénalités", "Final", "% du meilleur", "Moto"]
-        out = io.StringIO()
-        writer = csv.writer(out)
-        writer.writerow(headers)
-        filename = f"resultats_round_{r.id}.csv"
-        return Response(out.getvalue(), mimetype="text/csv",
-                        headers={"Content-Disposition": f"attachment; filename={filename}"})
-
-    # Calcule les finals, tri par temps final croissant
-    safe = []
-    for e in entries:
-        try:
-            raw_ms = int(e.raw_time_ms or 0)
-            pen = int(e.penalties or 0)
-            fm = final_time_ms(raw_ms, pen)
-            safe.append((e, fm))
-        except Exception:
-            continue
-
-    if not safe:
-        headers = ["Rang", "Pilote", "Nation", "Brut", "Pénalités", "Final", "% du meilleur", "Moto", "YouTube"]
-        out = io.StringIO()
-        csv.writer(out).writerow(headers)
-        filename = f"resultats_round_{r.id}.csv"
-        return Response(out.getvalue(), mimetype="text/csv",
-                        headers={"Content-Disposition": f"attachment; filename={filename}"})
+    # Nom de fichier propre (petit slug du nom)
+    base = f"resultats_round_{r.id}"
+    slug = "".join(c if c.isalnum() else "_" for c in (r.name or ""))
+    if slug:
+        base = f"resultats_{slug}"
 
-    safe.sort(key=lambda t: t[1])
-    best = safe[0][1] if safe else 0
+    return _export_response([r.id], base, with_round=False)
 
-    # Écriture CSV
-    headers = ["Rang", "Pilote", "Nation", "Brut", "Pénalités", "Final", "% du meilleur", "Moto", "YouTube"]
-    out = io.StringIO()
-    writer = csv.writer(out)
-    writer.writerow(headers)
 
-    for i, (e, fm) in enumerate(safe, start=1):
-        name = display_name(getattr(e, "user", None)) if hasattr(e, "user") else "—"
-        nat = "—"
-        if hasattr(e, "user") and getattr(e.user, "nationality", None):
-            nat = (e.user.nationality or "—").upper()
-        pct = (fm / best * 100.0) if best > 0 else 0.0
-        writer.writerow([
-            i,
-            name,
-            nat,
-            ms_to_str(e.raw_time_ms),
-            e.penalties,
-            ms_to_str(fm),
-            f"{pct:.2f}%",
-            e.bike or "",
-        ])
+@app.get("/admin/rounds/export.csv")
+def admin_rounds_export_csv():
+    """Export multi-manches : ?rounds=1,2,3 ou ?season=<clé> (sinon toutes), ?gzip=1."""
+    if not db:
+        return PAGE("<h1>Admin</h1><p class='muted'>DB non dispo.</p>"), 500
+    u = current_user()
+    if not is_admin(u):
+        return PAGE("<h1>Accès refusé</h1><p class='muted'>Réservé aux administrateurs.</p>"), 403
 
-    # Nom de fichier propre
-    base = f"resultats_round_{r.id}"
-    try:
-        # petit slug du nom
-        slug = "".join(c if c.isalnum() else "_" for c in (r.name or ""))
-        if slug:
-            base = f"resultats_{slug}"
-    except Exception:
-        pass
+    wanted = [
+        int(x) for x in (request.args.get("rounds") or "").split(",")
+        if x.strip().isascii() and x.strip().isdigit()
+    ]
+    season = (request.args.get("season") or "").strip()
+    q = db.session.query(Round.id)
+    if wanted:
+        q = q.filter(Round.id.in_(wanted))
+    if season:
+        q = q.filter(Round.season == season)
+    round_ids = [rid for (rid,) in q]
+    if not round_ids:
+        return PAGE("<h1>Erreur</h1><p class='muted'>Aucune manche à exporter.</p>"), 404
 
-    filename = f"{base}.csv"
-    return Response(out.getvalue(), mimetype="text/csv",
-                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+    base = "resultats_manches"
+    slug = "".join(c if c.isalnum() else "_" for c in season)
+    if slug:
+        base = f"resultats_saison_{slug}"
+    return _export_response(round_ids, base, with_round=True)
 
 
 
@@ -1773,6 +4397,7 @@ def admin_banner():
         ann = Announcement(content=content, is_active=is_active)
         db.session.add(ann)
         db.session.commit()
+        invalidate_banner_fragment()
         return redirect(url_for("admin_banner"))
 
     latest = Announcement.query.order_by(Announcement.created_at.desc()).limit(10).all()
@@ -1837,7 +4462,11 @@ def my_time_delete(time_id):
         return PAGE("<h1>Accès refusé</h1><p class='muted'>Action non autorisée.</p>"), 403
 
     try:
+        affected = standings_remove([e.id])
         db.session.delete(e)
+        db.session.flush()
+        for rid in affected:
+            rerank_round(rid)
         db.session.commit()
         return redirect(url_for("profile"))
     except Exception as ex:
@@ -1852,37 +4481,92 @@ def credits():
       <p>Vidéos : <a href="https://youtu.be/5OXhfkt5BqY?si=bWjH6IVx65XOxVkQ">Merci Alaaaaaiiiiiinnnnn</a></p>
     """)
 
+PLAN_IMMUTABLE_MAX_AGE = 365 * 24 * 3600  # URL adressée par contenu → cache "à vie"
+
+
+def plan_url(r, dl: bool = False) -> str:
+    """URL adressée par contenu du plan d'une manche (change dès que le plan change)."""
+    name = secure_filename(r.plan_name or "") or f"plan_{r.id}"
+    return f"/plans/{r.plan_hash}/{name}" + ("?dl=1" if dl else "")
+
+
+def _plan_response(sha: str, filename: str, mime, max_age: int, immutable: bool):
+    """
+    Réponse du plan `sha` avec validateurs forts (ETag = sha256), 304 et Range.
+    Si le client a déjà cette version (If-None-Match), aucune lecture en base.
+    """
+    cache_control = f"public, max-age={max_age}" + (", immutable" if immutable else "")
+    disposition = "attachment" if request.args.get("dl") else "inline"
+    headers = {
+        "Cache-Control": cache_control,
+        "Content-Disposition": f"{disposition}; filename=\"{filename}\"",
+    }
+
+    if request.if_none_match.contains(sha):
+        resp = Response(status=304, headers=headers)
+        resp.set_etag(sha)
+        return resp
+
+    blob = (
+        db.session.query(PlanBlob.data, PlanBlob.mime, PlanBlob.created_at)
+        .filter_by(sha256=sha)
+        .first()
+    )
+    if blob is None:
+        return PAGE("<h1>Plan</h1><p class='muted'>Aucun plan pour cette manche.</p>"), 404
+    data, blob_mime, created_at = blob
+
+    resp = Response(data, mimetype=(mime or blob_mime or "image/png"), headers=headers)
+    resp.set_etag(sha)
+    if created_at:
+        resp.last_modified = created_at
+    # gère If-None-Match / If-Modified-Since / Range (206) / If-Range
+    return resp.make_conditional(request, accept_ranges=True, complete_length=len(data))
+
+
+@app.get("/plans/<sha>/<path:filename>")
+def plan_blob(sha, filename):
+    # Le contenu d'une URL /plans/<sha>/... ne change jamais ; tout ce qui n'est pas un
+    # sha256 hexa minuscule est refusé avant le 304 et la base (jamais d'ETag immuable)
+    if len(sha) != 64 or not set(sha) <= set("0123456789abcdef"):
+        return PAGE("<h1>Plan</h1><p class='muted'>Aucun plan pour cette manche.</p>"), 404
+    return _plan_response(sha, secure_filename(filename) or "plan", None,
+                          PLAN_IMMUTABLE_MAX_AGE, immutable=True)
+
+
 @app.get("/rounds/<int:round_id>/plan")
 def round_plan(round_id):
     if not db:
         return PAGE("<h1>Erreur</h1><p class='muted'>DB non dispo.</p>"), 500
     r = db.session.get(Round, round_id)
-    if not r or not getattr(r, "plan_data", None):
+    if not r or not getattr(r, "plan_hash", None):
         return PAGE("<h1>Plan</h1><p class='muted'>Aucun plan pour cette manche.</p>")
-    disposition = "attachment" if request.args.get("dl") else "inline"
-    return Response(
-        r.plan_data,
-        mimetype=(r.plan_mime or "image/png"),
-        headers={"Content-Disposition": f"{disposition}; filename=\"{r.plan_name or f'plan_{round_id}'}\""}
-    )
+    # URL stable (le plan peut être remplacé) : revalidation à chaque fois, 304 si inchangé
+    return _plan_response(r.plan_hash, r.plan_name or f"plan_{round_id}", r.plan_mime,
+                          0, immutable=False)
 
 
 @app.get("/trace/download")
 def trace_download():
     # Sert l'image du tracé en téléchargement (Content-Disposition: attachment)
-    import os
+    # send_file : envoi direct du fichier (sans le lire en mémoire) + ETag/Last-Modified/304
+    from flask import send_file
     path = os.path.join(app.static_folder or "static", "img", "traceWP.jpg")
-    try:
-        with open(path, "rb") as f:
-            data = f.read()
-    except FileNotFoundError:
+    if not os.path.isfile(path):
         return PAGE("<h1>Tracé</h1><p class='muted'>Image introuvable.</p>"), 404
-    return Response(
-        data,
+    return send_file(
+        path,
         mimetype="image/jpeg",
-        headers={"Content-Disposition": 'attachment; filename="traceWP.jpg"'}
+        as_attachment=True,
+        download_name="traceWP.jpg",
+        conditional=True,
+        max_age=24 * 3600,
     )
 
+
+ADMIN_USERS_PAGE_SIZE = 50
+
+
 @app.get("/admin/users")
 def admin_users():
     if not db:
@@ -1891,16 +4575,83 @@ def admin_users():
     if not is_admin(u):
         return PAGE("<h1>Accès refusé</h1><p class='muted'>Réservé aux administrateurs.</p>"), 403
 
-    users = User.query.order_by(getattr(User, "created_at", User.id).desc()).all()
+    from sqlalchemy import func, case, and_, or_
+
+    # Tri : date d'inscription (défaut), nom, activité (nb de chronos)
+    sort = (request.args.get("sort") or "recent").lower()
+    if sort not in ("recent", "name", "activity"):
+        sort = "recent"
+
+    # Compteurs de chronos par pilote : un GROUP BY (index time_entry.user_id)
+    def chrono_stats(user_ids=None):
+        q = db.session.query(
+            TimeEntry.user_id.label("user_id"),
+            func.count(TimeEntry.id).label("total"),
+            func.sum(case((TimeEntry.status == "approved", 1), else_=0)).label("ok"),
+        )
+        if user_ids is not None:
+            q = q.filter(TimeEntry.user_id.in_(user_ids))
+        return q.group_by(TimeEntry.user_id)
+
+    # Clé de tri + id (départage) → pagination par curseur (keyset), pas d'OFFSET
+    if sort == "activity":
+        # la clé de tri EST le compteur : agrégat sur tous les pilotes, joint aux inscrits
+        stats = chrono_stats().subquery()
+        key_col, descending = func.coalesce(stats.c.total, 0), True
+        parse_key = int
+        q = (
+            db.session.query(User, key_col, func.coalesce(stats.c.ok, 0))
+            .outerjoin(stats, stats.c.user_id == User.id)
+        )
+    else:
+        if sort == "name":
+            key_col, descending = func.lower(func.coalesce(User.pseudo, "")), False
+            parse_key = str
+        else:
+            key_col, descending = func.coalesce(User.created_at, datetime(1970, 1, 1)), True
+            parse_key = datetime.fromisoformat
+        q = db.session.query(User, key_col)
+
+    # Curseur "after=<clé>|<id>" : dernière ligne de la page précédente
+    after = request.args.get("after") or ""
+    if after:
+        try:
+            raw_key, raw_id = after.rsplit("|", 1)
+            k, kid = parse_key(raw_key), int(raw_id)
+            if descending:
+                q = q.filter(or_(key_col < k, and_(key_col == k, User.id < kid)))
+            else:
+                q = q.filter(or_(key_col > k, and_(key_col == k, User.id > kid)))
+        except Exception:
+            return PAGE("<h1>Inscrits</h1><p class='muted'>Curseur de pagination invalide.</p>"), 400
 
-    def row_html(x):
+    if descending:
+        q = q.order_by(key_col.desc(), User.id.desc())
+    else:
+        q = q.order_by(key_col.asc(), User.id.asc())
+
+    page = q.limit(ADMIN_USERS_PAGE_SIZE + 1).all()
+    has_next = len(page) > ADMIN_USERS_PAGE_SIZE
+    page = page[:ADMIN_USERS_PAGE_SIZE]
+
+    if sort == "activity":
+        page = [(x, total, ok, total) for x, total, ok in page]
+    elif page:
+        # compteurs des seuls pilotes de la page
+        counts = {
+            uid: (total, ok or 0)
+            for uid, total, ok in chrono_stats([x.id for x, _ in page]).all()
+        }
+        page = [(x, *counts.get(x.id, (0, 0)), key) for x, key in page]
+    users_count = db.session.query(func.count(User.id)).scalar() or 0
+
+    def row_html(item):
+        x, total, ok, _key = item
         pid = x.id
         pseudo = (getattr(x, "pseudo", None) or f"Pilote #{pid}")
         nat = (getattr(x, "nationality", None) or "—")
         dt = getattr(x, "created_at", None)
         dt_h = dt.strftime("%d/%m/%Y %H:%M") if dt else "—"
-        total = db.session.query(TimeEntry).filter_by(user_id=pid).count()
-        ok = db.session.query(TimeEntry).filter_by(user_id=pid, status="approved").count()
 
         return f"""
         <li class="card">
@@ -1925,13 +4676,42 @@ def admin_users():
         </li>
         """
 
-    rows = "\n".join(row_html(x) for x in users) if users else "<p class='muted'>Aucun inscrit pour le moment.</p>"
+    rows = "\n".join(row_html(x) for x in page) if page else "<p class='muted'>Aucun inscrit pour le moment.</p>"
+
+    # Liens de tri
+    def sort_link(label, key):
+        cls = "btn" + ("" if sort == key else " outline")
+        return f"<a class='{cls}' href='/admin/users?sort={key}'>{label}</a>"
+
+    sort_html = (
+        "<div class='row' style='gap:8px; margin-bottom:12px; flex-wrap:wrap;'>"
+        f"{sort_link('Inscription', 'recent')}"
+        f"{sort_link('Nom', 'name')}"
+        f"{sort_link('Activité', 'activity')}"
+        "</div>"
+    )
+
+    # Pagination
+    nav = []
+    if after:
+        nav.append(f"<a class='btn outline' href='/admin/users?sort={sort}'>&larr; Début</a>")
+    if has_next:
+        last_user, _t, _o, last_key = page[-1]
+        if isinstance(last_key, datetime):
+            last_key = last_key.isoformat()
+        cursor = quote(f"{last_key}|{last_user.id}", safe="")
+        nav.append(f"<a class='btn outline' href='/admin/users?sort={sort}&after={cursor}'>Page suivante &rarr;</a>")
+    nav_html = (
+        "<div class='row' style='gap:8px; margin-top:12px;'>" + "".join(nav) + "</div>"
+    ) if nav else ""
 
     return PAGE(f"""
-      <h1>Inscrits</h1>
+      <h1>Inscrits <span class="muted">({users_count})</span></h1>
+      {sort_html}
       <ul class="list">
         {rows}
       </ul>
+      {nav_html}
     """)
 
 
@@ -2003,8 +4783,12 @@ def admin_user_delete(user_id):
 
     try:
         from sqlalchemy import delete
+        affected = standings_remove_user(user_id)
         db.session.execute(delete(TimeEntry).where(TimeEntry.user_id == user_id))
         db.session.delete(pilot)
+        db.session.flush()
+        for rid in affected:
+            rerank_round(rid)
         db.session.commit()
     except Exception:
         db.session.rollback()
@@ -2020,24 +4804,55 @@ def admin_stats():
     if not is_admin(u):
         return PAGE("<h1>Accès refusé</h1><p class='muted'>Réservé aux administrateurs.</p>"), 403
 
+    # Jours clos pas encore agrégés : compactés en arrière-plan, jamais dans la requête
+    COMPACTOR.wake()
+
     # Fenêtres temporelles
     now = datetime.utcnow()
+    today = now.date()
+    midnight = datetime.combine(today, datetime.min.time())
     t5m  = now - timedelta(minutes=5)
     t1d  = now - timedelta(days=1)
-    t7d  = now - timedelta(days=7)
-    t30d = now - timedelta(days=30)
-
-    # Comptes distincts par période
-    def distinct_users_since(dt):
-        return (db.session.query(LoginEvent.user_id)
-                .filter(LoginEvent.created_at >= dt)
-                .distinct()
-                .count())
-
-    dau = distinct_users_since(t1d)
-    wau = distinct_users_since(t7d)
-    mau = distinct_users_since(t30d)
-    now_active = distinct_users_since(t5m)
+    t7d  = midnight - timedelta(days=6)   # 7 jours calendaires, aujourd'hui inclus
+    t30d = midnight - timedelta(days=29)
+
+    # Utilisateurs distincts : fusion de sketches horaires / quotidiens + partie vivante.
+    # Au-delà de HLL_EXACT_MAX utilisateurs, le compte est estimé (≈, erreur type 1,6 %).
+    def fmt(count_exact):
+        n, exact = count_exact
+        return f"{n}" if exact else f"≈{n}"
+
+    now_active = fmt(distinct_users(t5m))
+    dau = fmt(distinct_users(t1d))
+    wau = fmt(distinct_users(t7d))
+    mau = fmt(distinct_users(t30d))
+
+    # Plage libre ?from=AAAA-MM-JJ&to=AAAA-MM-JJ (bornes incluses)
+    range_html = ""
+    try:
+        r_from = date.fromisoformat(request.args.get("from", ""))
+        r_to = date.fromisoformat(request.args.get("to", "") or today.isoformat())
+    except ValueError:
+        r_from = r_to = None
+    # seules les dates reconnues sont renvoyées dans le formulaire (jamais la saisie brute)
+    from_value = r_from.isoformat() if r_from else ""
+    to_value = r_to.isoformat() if r_to and request.args.get("to") else ""
+    if r_from and r_to and r_from <= r_to:
+        n_range = fmt(distinct_users(
+            datetime.combine(r_from, datetime.min.time()),
+            datetime.combine(r_to + timedelta(days=1), datetime.min.time()),
+        ))
+        range_html = (f"<p>Actifs du <strong>{r_from.strftime('%d/%m/%Y')}</strong> au "
+                      f"<strong>{r_to.strftime('%d/%m/%Y')}</strong> : <strong>{n_range}</strong></p>")
+
+    # Actifs pendant chaque manche (ouverture → clôture, ou maintenant)
+    recent_rounds = Round.query.order_by(Round.created_at.desc()).limit(8).all()
+    round_rows = "".join(
+        f"<tr><td>{r.name}</td><td>{r.created_at.strftime('%d/%m/%Y')}</td>"
+        f"<td>{(r.closes_at or now).strftime('%d/%m/%Y')}</td>"
+        f"<td style='text-align:right;'>{fmt(distinct_users(r.created_at, min(r.closes_at or now, now)))}</td></tr>"
+        for r in recent_rounds if r.created_at
+    )
 
     # Total inscrits
     total_users = db.session.query(User.id).count()
@@ -2051,21 +4866,23 @@ def admin_stats():
         .all()
     )
 
-    # Connexions par jour (7 derniers jours) — utilisateurs DISTINCTS par jour
-    # On bucketise côté Python pour rester portable.
-    since7 = (
-        db.session.query(LoginEvent)
-        .filter(LoginEvent.created_at >= t7d)
-        .order_by(LoginEvent.created_at.asc())
-        .all()
-    )
-    buckets = {}
-    for ev in since7:
-        d = ev.created_at.date().isoformat()
-        buckets.setdefault(d, set()).add(ev.user_id)
-    # Assure toutes les dates (de J-6 à J)
-    days = [(now.date() - timedelta(days=i)).isoformat() for i in range(6, -1, -1)]
-    per_day = [(d, len(buckets.get(d, set()))) for d in days]
+    # Connexions par jour (7 derniers jours) — utilisateurs DISTINCTS par jour :
+    # jours clos depuis activity_day, jours pas encore compactés (dont aujourd'hui) en direct
+    days = [today - timedelta(days=i) for i in range(6, -1, -1)]
+    users_per_day = {
+        a.day.isoformat(): a.users
+        for a in ActivityDay.query.filter(ActivityDay.day >= days[0]).all()
+    }
+    live_day = max([days[0] - timedelta(days=1)] + [date.fromisoformat(d) for d in users_per_day])
+    live_from = datetime.combine(live_day + timedelta(days=1), datetime.min.time())
+    bucket = db.func.date(LoginEvent.created_at)
+    for d, c in (
+        db.session.query(bucket, db.func.count(db.distinct(LoginEvent.user_id)))
+        .filter(LoginEvent.created_at >= live_from)
+        .group_by(bucket)
+    ):
+        users_per_day[str(d)] = c
+    per_day = [(d.isoformat(), users_per_day.get(d.isoformat(), 0)) for d in days]
 
     # Petites cartes
     tiles = f"""
@@ -2109,10 +4926,29 @@ def admin_stats():
 
     recent = "\n".join(row(x) for x in last10) or "<p class='muted'>Aucune connexion enregistrée.</p>"
 
+    activity = f"""
+    <section class="card">
+      <h2 style="margin-top:0;">Actifs sur une période</h2>
+      <form method="get" class="row" style="gap:8px; align-items:end;">
+        <label>Du <input type="date" name="from" value="{from_value}"></label>
+        <label>Au <input type="date" name="to" value="{to_value}"></label>
+        <button class="btn outline" type="submit">Compter</button>
+      </form>
+      {range_html}
+      <h3>Actifs pendant les manches</h3>
+      <table class="table">
+        <thead><tr><th>Manche</th><th>Ouverture</th><th>Clôture</th><th style="text-align:right;">Actifs</th></tr></thead>
+        <tbody>{round_rows or "<tr><td colspan='4' class='muted'>Aucune manche.</td></tr>"}</tbody>
+      </table>
+      <p class="muted" style="font-size:12px;">≈ : estimation (HyperLogLog, erreur type ±1,6 %) au-delà de {HLL_EXACT_MAX} utilisateurs.</p>
+    </section>
+    """
+
     return PAGE(f"""
       <h1>Stats du site</h1>
       {tiles}
       {chart}
+      {activity}
       <section class="card">
         <h2 style="margin-top:0;">Dernières connexions</h2>
         <ul class="list">
@@ -2121,6 +4957,78 @@ def admin_stats():
       </section>
     """)
 
+@app.get("/admin/outbox")
+def admin_outbox():
+    """Boîte d'envoi : compteurs par statut + messages abandonnés (dead) à relancer."""
+    if not db:
+        return PAGE("<h1>Admin</h1><p class='muted'>DB non dispo.</p>")
+    u = current_user()
+    if not is_admin(u):
+        return PAGE("<h1>Accès refusé</h1><p class='muted'>Réservé aux administrateurs.</p>"), 403
+
+    counts = dict(
+        db.session.query(OutboxEmail.status, db.func.count(OutboxEmail.id))
+        .group_by(OutboxEmail.status)
+        .all()
+    )
+    dead = (
+        OutboxEmail.query
+        .filter_by(status="dead")
+        .order_by(OutboxEmail.id.desc())
+        .limit(50)
+        .all()
+    )
+    tiles = "".join(
+        f"<li class='card'><div><div class='muted'>{label}</div>"
+        f"<div style='font-size:24px;font-weight:700;'>{counts.get(st, 0)}</div></div></li>"
+        for st, label in (("pending", "En attente"), ("sending", "En cours"), ("sent", "Envoyés"), ("dead", "Abandonnés"))
+    )
+    rows = "".join(
+        f"""
+        <li class="card">
+          <div class="row" style="justify-content:space-between; align-items:center; gap:8px;">
+            <div><strong>{m.to_email}</strong> &middot; {m.subject}<br>
+              <span class="muted">{m.attempts} essais &middot; {m.last_error or '—'}</span></div>
+            <form method="post" action="/admin/outbox/{m.id}/retry">
+              <button class="btn outline" type="submit">Relancer</button>
+            </form>
+          </div>
+        </li>
+        """
+        for m in dead
+    ) or "<p class='muted'>Aucun message abandonné.</p>"
+    smtp_note = "" if SMTP_HOST else "<p class='muted'>SMTP non configuré : les messages restent en attente.</p>"
+
+    return PAGE(f"""
+      <h1>Boîte d'envoi</h1>
+      {smtp_note}
+      <ul class="list" style="display:grid; grid-template-columns: repeat(auto-fit,minmax(180px,1fr)); gap:12px;">
+        {tiles}
+      </ul>
+      <section class="card">
+        <h2 style="margin-top:0;">Messages abandonnés</h2>
+        <ul class="list">{rows}</ul>
+      </section>
+    """)
+
+
+@app.post("/admin/outbox/<int:mail_id>/retry")
+def admin_outbox_retry(mail_id):
+    if not db:
+        return PAGE("<h1>Admin</h1><p class='muted'>DB non dispo.</p>")
+    u = current_user()
+    if not is_admin(u):
+        return PAGE("<h1>Accès refusé</h1><p class='muted'>Réservé aux administrateurs.</p>"), 403
+    m = db.session.get(OutboxEmail, mail_id)
+    if m and m.status == "dead":
+        m.status = "pending"
+        m.attempts = 0
+        m.next_attempt_at = datetime.utcnow()
+        db.session.info["wake_mailer"] = True
+        db.session.commit()
+    return redirect(url_for("admin_outbox"))
+
+
 @app.get("/__migrate")
 def __migrate():
     if not db:
@@ -2168,11 +5076,12 @@ def __migrate_round_plan():
         return "DB non dispo", 500
     with db.engine.begin() as conn:
         cols = [row[1] for row in conn.exec_driver_sql('PRAGMA table_info("round")')]
-        if "plan_data" not in cols:
-            conn.exec_driver_sql('ALTER TABLE "round" ADD COLUMN plan_data BLOB')
         if "plan_mime" not in cols:
             conn.exec_driver_sql('ALTER TABLE "round" ADD COLUMN plan_mime VARCHAR(64)')
         # si tu n'as PAS de colonne plan_name dans le modèle, n'ajoute rien d'autre
+    # plan_hash/plan_size + transfert des anciens plan_data vers plan_blob
+    db.create_all()
+    migrate_plan_storage()
     return "ok", 200
 
 @app.get("/admin/rounds/<int:round_id>/edit_close")
@@ -2235,78 +5144,268 @@ def admin_round_edit_close_post(round_id):
 
     if hasattr(r, "closes_at"):
         r.closes_at = closes_at_dt
+    bump_version(round_key(r.id))
 
     try:
         db.session.commit()
     except Exception:
         db.session.rollback()
         return PAGE("<h1>Admin</h1><p class='muted'>Erreur lors de l'enregistrement.</p>"), 500
+    invalidate_rounds_fragments()  # la date de clôture apparaît sur l'accueil
 
     return redirect("/admin/rounds")
 
 
+def _chat_item_html(m, pilot_view: bool) -> str:
+    dt_h = m.created_at.strftime("%d/%m/%Y %H:%M")
+
+    if pilot_view:
+        # Vue pilote
+        who = "Admin" if m.author == "admin" else "Toi"
+        align = "flex-start" if m.author == "admin" else "flex-end"
+    else:
+        # Vue admin
+        who = "Admin" if m.author == "admin" else "Pilote"
+        align = "flex-end" if m.author == "admin" else "flex-start"
+
+    bg = "#eef" if m.author == "admin" else "#f5f5f5"
+
+    return f"""
+      <li style="margin:4px 0;" data-id="{m.id}">
+        <div style="display:flex; justify-content:{align};">
+          <div class="card" style="max-width:70%; background:{bg};">
+            <div class="muted" style="font-size:12px; margin-bottom:4px;">
+              {who} &middot; {dt_h}
+            </div>
+            <div>{m.body}</div>
+          </div>
+        </div>
+      </li>
+    """
+
+
 def _build_chat_messages_html(msgs, pilot_view: bool) -> str:
     """
     pilot_view = True  -> page côté pilote ("Admin" / "Toi")
     pilot_view = False -> page côté admin ("Admin" / "Pilote")
+    La liste existe toujours (même vide) : le script de chat y ajoute les nouveaux messages.
     """
-    if not msgs:
-        return "<p class='muted'>Aucun message pour le moment.</p>"
+    last_id = msgs[-1].id if msgs else 0
+    empty = "" if msgs else "<p class='muted' id='chat-empty'>Aucun message pour le moment.</p>"
+    items = "\n".join(_chat_item_html(m, pilot_view) for m in msgs)
+    return (
+        f"{empty}<ul class='list' id='chat-list' data-last-id='{last_id}' style='margin-top:8px;'>"
+        f"{items}</ul>"
+    )
+
+
+# --- Chat incrémental (curseur = id de message) ---
+CHAT_BATCH_MAX = 200  # messages max par réponse / événement
 
-    items = []
-    for m in msgs:
-        dt_h = m.created_at.strftime("%d/%m/%Y %H:%M")
 
-        if pilot_view:
-            # Vue pilote
-            who = "Admin" if m.author == "admin" else "Toi"
-            align = "flex-start" if m.author == "admin" else "flex-end"
+def chat_messages_after(time_entry_id: int, after_id: int = 0, upto=None):
+    """Messages d'un fil d'id > after_id (et <= upto), dans l'ordre : coût O(nouveaux)."""
+    q = ChronoMessage.query.filter(
+        ChronoMessage.time_entry_id == time_entry_id,
+        ChronoMessage.id > after_id,
+    )
+    if upto is not None:
+        q = q.filter(ChronoMessage.id <= upto)
+    return q.order_by(ChronoMessage.id.asc()).limit(CHAT_BATCH_MAX).all()
+
+
+def _chat_message_json(m) -> dict:
+    return {
+        "id": m.id,
+        "author": m.author,
+        "body": m.body,
+        "at": m.created_at.strftime("%d/%m/%Y %H:%M"),
+    }
+
+
+def post_chat_message(e, author: str, body: str):
+    """Ajoute un message et avance le compteur du fil (même transaction)."""
+    if author == "admin" and not has_unread_admin_messages_for_pilot(e.id):
+        notify_pilot_chat(e)  # premier message non lu : on prévient le pilote par mail
+    msg = ChronoMessage(time_entry=e, author=author, body=body)
+    db.session.add(msg)
+    db.session.flush()
+    advance_version(chat_key(e.id), msg.id)
+    db.session.commit()
+    return msg
+
+
+def mark_chat_read(time_entry_id: int, who: str):
+    """Le lecteur `who` a tout lu sur ce chrono (ignore les erreurs : ne doit rien casser)."""
+    try:
+        read = ChronoRead.query.filter_by(time_entry_id=time_entry_id, who=who).first()
+        now = datetime.utcnow()
+        if read is None:
+            db.session.add(ChronoRead(time_entry_id=time_entry_id, who=who, last_read_at=now))
         else:
-            # Vue admin
-            who = "Admin" if m.author == "admin" else "Pilote"
-            align = "flex-end" if m.author == "admin" else "flex-start"
-
-        bg = "#eef" if m.author == "admin" else "#f5f5f5"
-
-        items.append(f"""
-          <li style="margin:4px 0;">
-            <div style="display:flex; justify-content:{align};">
-              <div class="card" style="max-width:70%; background:{bg};">
-                <div class="muted" style="font-size:12px; margin-bottom:4px;">
-                  {who} &middot; {dt_h}
-                </div>
-                <div>{m.body}</div>
-              </div>
-            </div>
-          </li>
-        """)
+            read.last_read_at = now
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
 
-    return "<ul class='list' style='margin-top:8px;'>" + "\n".join(items) + "</ul>"
 
-def has_unread_pilot_messages_for_admin(time_entry_id: int) -> bool:
-    # Dernière lecture de l’admin pour ce chrono
-    last = ChronoRead.query.filter_by(time_entry_id=time_entry_id, who="admin").first()
+def _chat_entry(time_id: int, role: str):
+    """Chrono dont le fil est accessible à l'utilisateur courant pour ce rôle, sinon None."""
+    ident = current_identity()
+    if ident is None:
+        return None
+    # droits admin : flag en base, comme partout ailleurs (l'instantané de session peut être périmé)
+    if role == "admin" and not is_admin(current_user()):
+        return None
+    e = db.session.get(TimeEntry, time_id)
+    if e is None or (role == "pilot" and e.user_id != ident.id):
+        return None
+    return e
 
-    q = ChronoMessage.query.filter_by(time_entry_id=time_entry_id, author="pilot")
 
-    if last is None:
-        # L’admin n’a jamais ouvert le chat → s’il y a au moins un msg pilote, on considère "non lu"
-        return q.count() > 0
+def _wants_json() -> bool:
+    return request.accept_mimetypes.best_match(["text/html", "application/json"]) == "application/json"
 
-    # Sinon, on regarde s’il existe un msg pilote plus récent que la dernière lecture
-    return q.filter(ChronoMessage.created_at > last.last_read_at).count() > 0
 
-def has_unread_admin_messages_for_pilot(time_entry_id: int) -> bool:
-    # Dernière lecture du pilote pour ce chrono
-    last = ChronoRead.query.filter_by(time_entry_id=time_entry_id, who="pilot").first()
-    q = ChronoMessage.query.filter_by(time_entry_id=time_entry_id, author="admin")
+def _chat_event(key: str, before: int, version: int):
+    """Événement SSE d'un fil : les messages postés entre les deux repères."""
+    import json
+    time_entry_id = int(key.split(":", 1)[1])
+    msgs = chat_messages_after(time_entry_id, before, upto=version)
+    data = json.dumps([_chat_message_json(m) for m in msgs], ensure_ascii=False, separators=(",", ":"))
+    return ("messages", version, data)
+
+
+HUB.register("chat:", _chat_event)
+
+
+def _chat_script(base: str, pilot_view: bool) -> str:
+    """
+    Client du chat : reçoit les nouveaux messages en SSE (reprise automatique via
+    Last-Event-ID), poste sans rechargement et signale la lecture des messages reçus.
+    Sans EventSource : relève /messages?after=<id> toutes les 5 s.
+    """
+    reader = "pilot" if pilot_view else "admin"
+    return f"""
+    <script>
+    (function(){{
+      const base = '{base}';
+      const reader = '{reader}';
+      const list = document.getElementById('chat-list');
+      const form = document.getElementById('chat-form');
+      if (!list || !window.fetch) return;
+      // cursor : dernier id reçu du serveur (reprise) ; shown : ids déjà affichés (doublons)
+      let cursor = parseInt(list.dataset.lastId || '0', 10);
+      const shown = new Set(Array.from(list.querySelectorAll('li[data-id]'), li => li.dataset.id));
+      const pilotView = {'true' if pilot_view else 'false'};
+
+      function render(m){{
+        const mine = (m.author === 'admin') !== pilotView;
+        const who = m.author === 'admin' ? 'Admin' : (pilotView ? 'Toi' : 'Pilote');
+        const li = document.createElement('li');
+        li.style.margin = '4px 0';
+        li.dataset.id = m.id;
+        li.innerHTML = '<div style="display:flex;"><div class="card" style="max-width:70%;">'
+          + '<div class="muted" style="font-size:12px; margin-bottom:4px;"></div><div></div></div></div>';
+        li.firstChild.style.justifyContent = mine ? 'flex-end' : 'flex-start';
+        const card = li.firstChild.firstChild;
+        card.style.background = m.author === 'admin' ? '#eef' : '#f5f5f5';
+        card.firstChild.textContent = who + ' · ' + m.at;
+        card.lastChild.textContent = m.body;
+        return li;
+      }}
+
+      let readTimer = null;
+      function add(msgs, fromServer){{
+        let fromOther = false;
+        msgs.forEach(m => {{
+          if (fromServer) cursor = Math.max(cursor, m.id);
+          if (shown.has(String(m.id))) return;  // déjà affiché (envoi local ou doublon)
+          shown.add(String(m.id));
+          // rangé par id : un message plus ancien de l'autre partie peut arriver après le nôtre
+          const next = Array.from(list.children).find(li => parseInt(li.dataset.id, 10) > m.id);
+          list.insertBefore(render(m), next || null);
+          if (m.author !== reader) fromOther = true;
+        }});
+        const empty = document.getElementById('chat-empty');
+        if (empty && list.children.length) empty.remove();
+        if (fromOther) {{
+          clearTimeout(readTimer);
+          readTimer = setTimeout(() => fetch(base + '/read', {{method: 'POST', credentials: 'same-origin'}}), 1000);
+        }}
+      }}
+
+      if (window.EventSource) {{
+        const es = new EventSource(base + '/stream?after=' + cursor);
+        es.addEventListener('messages', ev => add(JSON.parse(ev.data), true));
+      }} else {{
+        setInterval(() => {{
+          fetch(base + '/messages?after=' + cursor, {{credentials: 'same-origin'}})
+            .then(r => r.json()).then(d => add(d.messages, true));
+        }}, 5000);
+      }}
+
+      if (form) form.addEventListener('submit', ev => {{
+        ev.preventDefault();
+        const box = form.querySelector('textarea');
+        if (!box.value.trim()) return;
+        fetch(base, {{
+          method: 'POST', credentials: 'same-origin', body: new FormData(form),
+          headers: {{'Accept': 'application/json'}}
+        }}).then(r => r.ok ? r.json() : Promise.reject(r))
+          .then(d => {{ box.value = ''; add([d.message], false); }})
+          .catch(() => form.submit());
+      }});
+    }})();
+    </script>
+    """
+
+
+# --- Messages non lus (calcul ensembliste) ---
+def unread_entries_select(reader: str):
+    """
+    SELECT des ids de chronos ayant au moins un message non lu pour `reader` :
+      - reader='admin' → messages du pilote postérieurs à la dernière lecture admin
+      - reader='pilot' → messages de l'admin postérieurs à la dernière lecture pilote
+    Jamais ouvert (pas de ChronoRead) → tout message de l'autre partie est non lu.
+    Une seule requête groupée, utilisable en sous-requête (IN) ou directement.
+    """
+    from sqlalchemy import and_, or_
+    author = "pilot" if reader == "admin" else "admin"
+    return (
+        db.select(ChronoMessage.time_entry_id)
+        .outerjoin(
+            ChronoRead,
+            and_(
+                ChronoRead.time_entry_id == ChronoMessage.time_entry_id,
+                ChronoRead.who == reader,
+            ),
+        )
+        .where(
+            ChronoMessage.author == author,
+            or_(
+                ChronoRead.id.is_(None),
+                ChronoMessage.created_at > ChronoRead.last_read_at,
+            ),
+        )
+        .group_by(ChronoMessage.time_entry_id)
+    )
 
-    if last is None:
-        # Le pilote n'a jamais ouvert le chat → si l'admin a déjà écrit, on considère comme "non lu"
-        return q.count() > 0
 
-    # Sinon, on regarde s'il existe un msg admin plus récent que la dernière lecture
-    return q.filter(ChronoMessage.created_at > last.last_read_at).count() > 0
+def unread_entry_ids(reader: str, entry_ids) -> set:
+    """Ids (parmi entry_ids) ayant des messages non lus pour `reader`, en une requête."""
+    ids = list(entry_ids)
+    if not ids:
+        return set()
+    stmt = unread_entries_select(reader).where(ChronoMessage.time_entry_id.in_(ids))
+    return set(db.session.execute(stmt).scalars())
+
+
+def has_unread_pilot_messages_for_admin(time_entry_id: int) -> bool:
+    return time_entry_id in unread_entry_ids("admin", [time_entry_id])
+
+def has_unread_admin_messages_for_pilot(time_entry_id: int) -> bool:
+    return time_entry_id in unread_entry_ids("pilot", [time_entry_id])
 
 
 @app.route("/admin/times/<int:time_id>/chat", methods=["GET", "POST"])
@@ -2322,19 +5421,22 @@ def admin_time_chat(time_id):
     if not e:
         return PAGE("<h1>Admin</h1><p class='muted'>Chrono introuvable.</p>"), 404
 
-    # POST : ajout d'un message admin
+    # POST : ajout d'un message admin (JSON si demandé : pas de redirection ni de rechargement)
     if request.method == "POST":
         body = (request.form.get("body") or "").strip()
+        msg = None
         if body:
-            msg = ChronoMessage(time_entry=e, author="admin", body=body)
-            db.session.add(msg)
             try:
-                db.session.commit()
+                msg = post_chat_message(e, "admin", body)
             except Exception as ex:
                 db.session.rollback()
+                if _wants_json():
+                    return _json({"error": str(ex)}, 500)
                 return PAGE(
                     f"<h1>Admin</h1><p class='muted'>Impossible d'enregistrer le message : {ex}</p>"
                 ), 500
+        if _wants_json():
+            return _json({"message": _chat_message_json(msg)}, 201) if msg else _json({"error": "empty"}, 400)
         return redirect(url_for("admin_time_chat", time_id=time_id))
 
     # GET : affichage du fil
@@ -2353,7 +5455,7 @@ def admin_time_chat(time_id):
         msgs = (
             ChronoMessage.query
             .filter_by(time_entry_id=e.id)
-            .order_by(ChronoMessage.created_at.asc())
+            .order_by(ChronoMessage.id.asc())
             .all()
         )
     except Exception as ex:
@@ -2364,19 +5466,7 @@ def admin_time_chat(time_id):
     messages_html = _build_chat_messages_html(msgs, pilot_view=False)
 
     # On marque que l’admin vient de tout lire pour ce chrono
-    try:
-        read = ChronoRead.query.filter_by(time_entry_id=e.id, who="admin").first()
-        now = datetime.utcnow()
-        if read is None:
-            read = ChronoRead(time_entry_id=e.id, who="admin", last_read_at=now)
-            db.session.add(read)
-        else:
-            read.last_read_at = now
-        db.session.commit()
-    except Exception:
-        db.session.rollback()
-        # On ignore l’erreur de "read", ça ne doit pas casser la page
-
+    mark_chat_read(e.id, "admin")
 
     return PAGE(f"""
       <h1>Chat sur le chrono</h1>
@@ -2388,7 +5478,7 @@ def admin_time_chat(time_id):
         </p>
         <h2 style="margin-top:0;">Messages</h2>
         {messages_html}
-        <form method="post" class="form" style="margin-top:12px;">
+        <form method="post" class="form" id="chat-form" style="margin-top:12px;">
           <label>Votre message (admin)
             <textarea name="body" rows="3" required></textarea>
           </label>
@@ -2398,6 +5488,7 @@ def admin_time_chat(time_id):
           <a class="btn outline" href="/admin/times">← Retour aux chronos</a>
         </p>
       </section>
+      {_chat_script(f"/admin/times/{e.id}/chat", pilot_view=False)}
     """)
 
 
@@ -2419,19 +5510,22 @@ def pilot_time_chat(time_id):
     if getattr(e, "user_id", None) != u.id:
         return PAGE("<h1>Accès refusé</h1><p class='muted'>Ce chrono ne t'appartient pas.</p>"), 403
 
-    # POST : ajout d'un message pilote
+    # POST : ajout d'un message pilote (JSON si demandé : pas de redirection ni de rechargement)
     if request.method == "POST":
         body = (request.form.get("body") or "").strip()
+        msg = None
         if body:
-            msg = ChronoMessage(time_entry=e, author="pilot", body=body)
-            db.session.add(msg)
             try:
-                db.session.commit()
+                msg = post_chat_message(e, "pilot", body)
             except Exception as ex:
                 db.session.rollback()
+                if _wants_json():
+                    return _json({"error": str(ex)}, 500)
                 return PAGE(
                     f"<h1>Chat</h1><p class='muted'>Impossible d'enregistrer le message : {ex}</p>"
                 ), 500
+        if _wants_json():
+            return _json({"message": _chat_message_json(msg)}, 201) if msg else _json({"error": "empty"}, 400)
         return redirect(url_for("pilot_time_chat", time_id=time_id))
 
     # GET : affichage du fil
@@ -2448,7 +5542,7 @@ def pilot_time_chat(time_id):
         msgs = (
             ChronoMessage.query
             .filter_by(time_entry_id=e.id)
-            .order_by(ChronoMessage.created_at.asc())
+            .order_by(ChronoMessage.id.asc())
             .all()
         )
     except Exception as ex:
@@ -2459,19 +5553,7 @@ def pilot_time_chat(time_id):
     messages_html = _build_chat_messages_html(msgs, pilot_view=True)
 
     # On marque que le pilote vient de tout lire pour ce chrono
-    try:
-        read = ChronoRead.query.filter_by(time_entry_id=e.id, who="pilot").first()
-        now = datetime.utcnow()
-        if read is None:
-            read = ChronoRead(time_entry_id=e.id, who="pilot", last_read_at=now)
-            db.session.add(read)
-        else:
-            read.last_read_at = now
-        db.session.commit()
-    except Exception:
-        db.session.rollback()
-        # On ne casse pas la page en cas de souci sur la table de lecture
-
+    mark_chat_read(e.id, "pilot")
 
     return PAGE(f"""
       <h1>Messages avec l'admin</h1>
@@ -2482,7 +5564,7 @@ def pilot_time_chat(time_id):
         </p>
         <h2 style="margin-top:0;">Messages</h2>
         {messages_html}
-        <form method="post" class="form" style="margin-top:12px;">
+        <form method="post" class="form" id="chat-form" style="margin-top:12px;">
           <label>Ta réponse
             <textarea name="body" rows="3" required></textarea>
           </label>
@@ -2492,9 +5574,96 @@ def pilot_time_chat(time_id):
           <a class="btn outline" href="/profile">← Retour au profil</a>
         </p>
       </section>
+      {_chat_script(f"/times/{e.id}/chat", pilot_view=True)}
     """)
 
 
+# --- Chat : routes incrémentales (admin / pilote) ---
+def _chat_messages_response(time_id: int, role: str):
+    """Messages après le curseur ?after=<id> (rattrapage / client sans EventSource)."""
+    if not db:
+        return _json({"error": "db"}, 500)
+    e = _chat_entry(time_id, role)
+    if e is None:
+        return _json({"error": "forbidden"}, 403)
+    msgs = chat_messages_after(e.id, request.args.get("after", 0, type=int))
+    other = "pilot" if role == "admin" else "admin"
+    if any(m.author == other for m in msgs):
+        mark_chat_read(e.id, role)
+    return _json({"messages": [_chat_message_json(m) for m in msgs],
+                  "last_id": msgs[-1].id if msgs else None})
+
+
+def _chat_stream_response(time_id: int, role: str):
+    """
+    Flux SSE d'un fil : id d'événement = id du dernier message transmis.
+    Reprise : Last-Event-ID (reconnexion automatique) ou ?after=<id> (ouverture de page).
+    """
+    if not db:
+        return _json({"error": "db"}, 500)
+    e = _chat_entry(time_id, role)
+    if e is None:
+        return _json({"error": "forbidden"}, 403)
+    key = chat_key(e.id)
+    # version du fil = id du dernier message : le hub diffuse les messages au-delà de `upto`,
+    # l'événement initial couvre ceux d'avant
+    q, upto = HUB.subscribe(key, get_version(key))
+    after = request.headers.get("Last-Event-ID", type=int)
+    if after is None:
+        after = request.args.get("after", 0, type=int)
+    initial = None
+    msgs = chat_messages_after(e.id, after, upto)
+    if msgs:
+        import json
+        data = json.dumps([_chat_message_json(m) for m in msgs], ensure_ascii=False, separators=(",", ":"))
+        initial = sse_event("messages", msgs[-1].id, data)
+    return Response(
+        sse_stream(key, q, initial),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _chat_read_response(time_id: int, role: str):
+    if not db:
+        return _json({"error": "db"}, 500)
+    e = _chat_entry(time_id, role)
+    if e is None:
+        return _json({"error": "forbidden"}, 403)
+    mark_chat_read(e.id, role)
+    return Response(status=204)
+
+
+@app.get("/admin/times/<int:time_id>/chat/messages")
+def admin_time_chat_messages(time_id):
+    return _chat_messages_response(time_id, "admin")
+
+
+@app.get("/admin/times/<int:time_id>/chat/stream")
+def admin_time_chat_stream(time_id):
+    return _chat_stream_response(time_id, "admin")
+
+
+@app.post("/admin/times/<int:time_id>/chat/read")
+def admin_time_chat_read(time_id):
+    return _chat_read_response(time_id, "admin")
+
+
+@app.get("/times/<int:time_id>/chat/messages")
+def pilot_time_chat_messages(time_id):
+    return _chat_messages_response(time_id, "pilot")
+
+
+@app.get("/times/<int:time_id>/chat/stream")
+def pilot_time_chat_stream(time_id):
+    return _chat_stream_response(time_id, "pilot")
+
+
+@app.post("/times/<int:time_id>/chat/read")
+def pilot_time_chat_read(time_id):
+    return _chat_read_response(time_id, "pilot")
+
+
 
 @app.get("/__migrate_chat")
 def __migrate_chat():
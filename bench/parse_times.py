@@ -0,0 +1,147 @@
+"""
+Micro-benchmark : l'ancien parseur scalaire (un appel par valeur, int()/float()) contre
+parse_times_batch (une colonne en une passe) sur des temps synthétiques.
+
+    python bench/parse_times.py [-n 200000] [--repeat 5] [--seed 1]
+
+Vérifie aussi la parité : même valeur en ms, ou erreur des deux côtés, pour chaque entrée.
+Les écarts voulus (KNOWN_DIFFERENCES, refusés par la grammaire commune) sont listés à part ;
+tout autre écart fait échouer le script.
+"""
+import argparse
+import random
+import sys
+import time
+
+from common import DEFAULT_DB, load_app
+
+wp = load_app(DEFAULT_DB)
+parse_times_batch = wp.parse_times_batch
+
+INVALID = ["", "   ", "abc", "1:75", "1:2:3", "1:", ":30", "1.2.3", "1:23.4x6", "12 34"]
+# acceptés par l'ancien parseur (int()/float() tolérants), refusés par la grammaire commune
+KNOWN_DIFFERENCES = ["-1.5", "+83", "1_000", "1: 30", ".", "-0:30", "1_0.5"]
+
+
+def legacy_parse_time_to_ms(s: str) -> int:
+    """
+    Ancienne implémentation (int()/float() sur les morceaux), gardée comme référence
+    de vitesse et de parité. Accepte :
+      - "m:s.ms"   ex: "1:23.456"
+      - "mm:ss"    ex: "01:23"
+      - "ss.ms"    ex: "83.456"
+      - "ss"       ex: "83"  (secondes entières)
+    Retourne le temps en millisecondes (int). Lève ValueError si invalide.
+    """
+    s = (s or "").strip()
+    if not s:
+        raise ValueError("Temps vide")
+    if ":" in s:
+        # formats avec minutes:secondes(.ms)
+        parts = s.split(":")
+        if len(parts) != 2:
+            raise ValueError("Format temps invalide (attendu mm:ss[.ms])")
+        m_str, rest = parts
+        if "." in rest:
+            sec_str, ms_str = rest.split(".", 1)
+            ms_str = (ms_str + "000")[:3]  # normalise milli en 3 chiffres
+            minutes = int(m_str)
+            seconds = int(sec_str)
+            millis = int(ms_str)
+        else:
+            minutes = int(m_str)
+            seconds = int(rest)
+            millis = 0
+        if seconds >= 60 or minutes < 0 or seconds < 0:
+            raise ValueError("Minutes/secondes invalides")
+        return minutes * 60000 + seconds * 1000 + millis
+    else:
+        # pas de ":" → soit "ss.ms" soit "ss"
+        if "." in s:
+            sec_str, ms_str = s.split(".", 1)
+            ms_str = (ms_str + "000")[:3]
+            seconds = float(f"{sec_str}.{ms_str}")
+            millis = int(round(float(seconds) * 1000))
+            return millis
+        # entier en secondes
+        seconds = int(s)
+        if seconds < 0:
+            raise ValueError("Temps négatif invalide")
+        return seconds * 1000
+
+
+
+def synthetic_times(n, rng):
+    """Mélange des formats acceptés (m:s.ms, mm:ss, ss.ms, ss) et ~2 % de saisies invalides."""
+    out = []
+    for _ in range(n):
+        ms = rng.randrange(20_000, 600_000)
+        m, s, milli = ms // 60000, (ms % 60000) // 1000, ms % 1000
+        kind = rng.random()
+        if kind < 0.02:
+            v = rng.choice(INVALID + KNOWN_DIFFERENCES)
+        elif kind < 0.45:
+            v = f"{m}:{s:02d}.{milli:03d}"
+        elif kind < 0.55:
+            v = f"{m}:{s:02d}.{milli // 10:02d}"
+        elif kind < 0.65:
+            v = f"{m:02d}:{s:02d}"
+        elif kind < 0.90:
+            v = f"{ms // 1000}.{milli:03d}"
+        else:
+            v = str(ms // 1000)
+        if rng.random() < 0.05:
+            v = f" {v} "
+        out.append(v)
+    return out
+
+
+def scalar(values):
+    out = []
+    for v in values:
+        try:
+            out.append(legacy_parse_time_to_ms(v))
+        except (ValueError, TypeError):
+            out.append(None)
+    return out
+
+
+def best_of(fn, values, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(values)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best, result
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("-n", type=int, default=200_000)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    values = synthetic_times(args.n, random.Random(args.seed))
+    t_scalar, ref = best_of(scalar, values, args.repeat)
+    t_batch, (ms, _codes) = best_of(parse_times_batch, values, args.repeat)
+
+    known = set(KNOWN_DIFFERENCES)
+    mismatches = [(v, a, b) for v, a, b in zip(values, ref, ms) if a != b and v.strip() not in known]
+    for v, a, b in mismatches[:10]:
+        print(f"  écart : {v!r} → ancien {a}, lot {b}")
+
+    print(f"{args.n} valeurs, meilleur de {args.repeat}")
+    print(f"  ancien scalaire    {t_scalar * 1000:8.1f} ms  ({args.n / t_scalar / 1e6:.2f} M/s)")
+    print(f"  parse_times_batch  {t_batch * 1000:8.1f} ms  ({args.n / t_batch / 1e6:.2f} M/s)")
+    print(f"  accélération ×{t_scalar / t_batch:.2f}, écarts inattendus : {len(mismatches)}")
+
+    print("Écarts voulus (ancien → grammaire commune) :")
+    _, codes = parse_times_batch(KNOWN_DIFFERENCES)
+    for v, old, code in zip(KNOWN_DIFFERENCES, scalar(KNOWN_DIFFERENCES), codes):
+        print(f"  {v!r:10} {old} ms → {code}")
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+"""
+Benchmark des routes lourdes via le client de test Flask, sur une base générée par seed.py.
+
+    python bench/routes.py [--db URL] [-n 20] [--only admin_times,profile]
+                           [--save resultats.json] [--baseline reference.json] [--tolerance 0.2]
+
+Pour chaque route : latence p50 / p95 (ms), requêtes SQL par appel, pic mémoire Python
+(tracemalloc, mesuré sur un appel à part pour ne pas fausser les temps) et taille de la
+réponse. --save écrit le rapport en JSON ; --baseline compare à un rapport précédent et
+sort en erreur (code 1) si une route régresse au-delà de la tolérance.
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+from common import add_db_argument, load_app
+
+# (nom, rôle, url, cache de page vidé avant chaque appel)
+ROUTES = [
+    ("round_leaderboard", None, "/rounds/{round_id}", True),
+    ("round_leaderboard:cache", None, "/rounds/{round_id}", False),
+    ("admin_times", "admin", "/admin/times", False),
+    ("admin_times:approved", "admin", "/admin/times?status=approved", False),
+    ("profile", "pilot", "/profile", False),
+    ("admin_users", "admin", "/admin/users", False),
+    ("admin_users:activity", "admin", "/admin/users?sort=activity", False),
+    ("admin_stats", "admin", "/admin/stats", False),
+]
+METRICS = ("p50_ms", "p95_ms", "queries", "peak_kb")
+
+
+class QueryCounter:
+    """Compte les requêtes SQL envoyées au moteur (événement before_cursor_execute)."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def pick_fixtures(wp):
+    """Manche la plus fournie, pilote le plus actif et un admin."""
+    from sqlalchemy import func
+    round_id = (
+        wp.db.session.query(wp.RoundStanding.round_id)
+        .group_by(wp.RoundStanding.round_id)
+        .order_by(func.count().desc())
+        .limit(1).scalar()
+    )
+    pilot_id = (
+        wp.db.session.query(wp.TimeEntry.user_id)
+        .group_by(wp.TimeEntry.user_id)
+        .order_by(func.count().desc())
+        .limit(1).scalar()
+    )
+    admin = wp.User.query.filter_by(is_admin=True).order_by(wp.User.id).first()
+    if round_id is None or pilot_id is None or admin is None:
+        raise SystemExit("Base vide : lancer d'abord bench/seed.py")
+    return {
+        "round_id": round_id,
+        "users": {"admin": admin, "pilot": wp.db.session.get(wp.User, pilot_id)},
+        "counts": {
+            "pilots": wp.User.query.count(),
+            "times": wp.TimeEntry.query.count(),
+            "logins": wp.LoginEvent.query.count(),
+            "rounds": wp.Round.query.count(),
+        },
+    }
+
+
+def client_for(wp, user):
+    client = wp.app.test_client()
+    if user is not None:
+        with client.session_transaction() as s:
+            s["user_id"] = user.id
+            s["ident"] = wp._snapshot(user)
+    return client
+
+
+def percentile(samples, q):
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method="inclusive")[q - 1]
+
+
+def measure(wp, counter, client, url, cold, n):
+    def call():
+        if cold:
+            with wp._page_cache_lock:
+                wp._page_cache.clear()
+        return client.get(url)
+
+    resp = call()  # chauffe : imports paresseux, compilation des requêtes
+    if resp.status_code != 200:
+        return {"status": resp.status_code}
+
+    samples, queries = [], []
+    for _ in range(n):
+        before = counter.count
+        t0 = time.perf_counter()
+        resp = call()
+        samples.append((time.perf_counter() - t0) * 1000)
+        queries.append(counter.count - before)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "status": resp.status_code,
+        "p50_ms": round(percentile(samples, 50), 2),
+        "p95_ms": round(percentile(samples, 95), 2),
+        "queries": max(queries),
+        "peak_kb": round(peak / 1024, 1),
+        "size_kb": round(len(resp.data) / 1024, 1),
+    }
+
+
+def compare(current, baseline, tolerance):
+    """Écarts relatifs par route/métrique ; une régression = au-delà de la tolérance."""
+    rows, regressions = [], []
+    for name, cur in current.items():
+        base = baseline.get(name)
+        if not base or "p50_ms" not in cur or "p50_ms" not in base:
+            continue
+        deltas = {}
+        for m in METRICS:
+            b, c = base[m], cur[m]
+            deltas[m] = (c - b) / b if b else (0.0 if c == b else float("inf"))
+            # le nombre de requêtes est déterministe : toute hausse compte
+            limit = 0 if m == "queries" else tolerance
+            if deltas[m] > limit:
+                regressions.append(f"{name} {m} {b} → {c}")
+        rows.append((name, deltas))
+    return rows, regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_db_argument(ap)
+    ap.add_argument("-n", type=int, default=20, help="appels mesurés par route")
+    ap.add_argument("--only", default="", help="routes à mesurer, séparées par des virgules")
+    ap.add_argument("--save", help="écrit le rapport JSON dans ce fichier")
+    ap.add_argument("--baseline", help="rapport JSON de référence à comparer")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="écart relatif toléré (0.2 = +20 %%)")
+    args = ap.parse_args()
+
+    only = {s.strip() for s in args.only.split(",") if s.strip()}
+    wp = load_app(args.db)
+    with wp.app.app_context():
+        fx = pick_fixtures(wp)
+        counter = QueryCounter(wp.db.engine)
+        dialect = wp.db.engine.dialect.name
+        clients = {role: client_for(wp, u) for role, u in fx["users"].items()}
+        clients[None] = client_for(wp, None)
+
+    counts = ", ".join(f"{k} {v}" for k, v in fx["counts"].items())
+    print(f"{dialect} · {counts} · {args.n} appels par route\n")
+    print(f"{'route':<26}{'p50 ms':>9}{'p95 ms':>9}{'requêtes':>10}{'pic Ko':>10}{'taille Ko':>11}")
+
+    results = {}
+    for name, role, url, cold in ROUTES:
+        if only and name not in only and name.split(":")[0] not in only:
+            continue
+        r = measure(wp, counter, clients[role], url.format(round_id=fx["round_id"]), cold, args.n)
+        results[name] = r
+        if "p50_ms" in r:
+            print(f"{name:<26}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['queries']:>10}"
+                  f"{r['peak_kb']:>10.0f}{r['size_kb']:>11.0f}")
+        else:
+            print(f"{name:<26}  HTTP {r['status']}")
+
+    report = {
+        "meta": {
+            "date": datetime.utcnow().isoformat(timespec="seconds"),
+            "dialect": dialect,
+            "python": platform.python_version(),
+            "n": args.n,
+            **fx["counts"],
+        },
+        "routes": results,
+    }
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    rows, regressions = compare(results, baseline.get("routes", {}), args.tolerance)
+    print(f"\nComparaison avec {args.baseline} ({baseline.get('meta', {}).get('date', '?')})")
+    print(f"{'route':<26}" + "".join(f"{m:>9}" for m in METRICS))
+    for name, deltas in rows:
+        cells = "".join(f"{deltas[m]:>+9.0%}" for m in METRICS)
+        print(f"{name:<26}{cells}")
+    if regressions:
+        print("\nRégressions :")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""
+Génère un jeu de données synthétique reproductible pour les benchmarks de routes.
+
+    python bench/seed.py [--db URL] [--pilots 10000] [--times 100000] [--logins 1000000]
+                         [--rounds 40] [--messages 20000] [--days 365] [--seed 42] [--reset]
+
+Même graine → mêmes données (dates relatives au jour du seed). Insertions Core par
+paquets, puis reconstruction des tables dérivées comme en production (round_standing,
+season_standing, activity_*).
+Sans --reset, refuse d'écrire dans une base qui contient déjà des pilotes.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from common import add_db_argument, load_app, sqlite_path
+
+CHUNK = 5000
+ADMIN_EMAIL = "admin@bench.local"
+NATIONALITIES = ["France", "Belgique", "Suisse", "Espagne", "Italie", "Allemagne", "Royaume-Uni", None]
+BIKES = ["Yamaha R6", "Honda CBR600RR", "Kawasaki ZX-6R", "Triumph 675", "Suzuki GSX-R 750", "KTM 890 Duke", None]
+UAS = [
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) Mobile/15E148",
+    "Mozilla/5.0 (Linux; Android 14; Pixel 8) Mobile Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/124.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 14_4) Safari/605.1.15",
+]
+
+
+def insert_chunks(wp, table, rows):
+    """INSERT multi-lignes par paquets de CHUNK ; `rows` peut être un générateur."""
+    n, batch = 0, []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= CHUNK:
+            wp.db.session.execute(table.insert(), batch)
+            n += len(batch)
+            batch = []
+    if batch:
+        wp.db.session.execute(table.insert(), batch)
+        n += len(batch)
+    wp.db.session.commit()
+    return n
+
+
+def step(label, fn, *args):
+    t0 = time.perf_counter()
+    n = fn(*args)
+    print(f"  {label:<18} {n:>9}  {time.perf_counter() - t0:6.1f} s")
+    return n
+
+
+def seed(wp, args):
+    rng = random.Random(args.seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    start = now - timedelta(days=args.days)
+    span = int((now - start).total_seconds())
+
+    def when():
+        return start + timedelta(seconds=rng.randrange(span))
+
+    # Pilotes (id 1 = admin)
+    def users():
+        yield {"id": 1, "email": ADMIN_EMAIL, "pseudo": "Admin", "is_admin": True,
+               "nationality": "France", "created_at": start}
+        for uid in range(2, args.pilots + 2):
+            yield {"id": uid, "email": f"pilote{uid}@bench.local", "pseudo": f"Pilote {uid}",
+                   "is_admin": False, "nationality": rng.choice(NATIONALITIES), "created_at": when()}
+
+    # Manches réparties sur la période ; les plus récentes sont ouvertes
+    round_dates = sorted(when() for _ in range(args.rounds))
+
+    def rounds():
+        for rid, created in enumerate(round_dates, 1):
+            yield {"id": rid, "name": f"Manche {rid}", "season": str(created.year),
+                   "status": "open" if rid > args.rounds - 3 else "closed",
+                   "created_at": created, "closes_at": created + timedelta(days=21)}
+
+    # Chronos : au plus un validé par (pilote, manche), les autres en attente / refusés / remplacés.
+    # Popularité des pilotes en loi de puissance : quelques pilotes très actifs.
+    approved = set()
+    weights = [1.0 / (i + 1) ** 0.8 for i in range(args.pilots)]
+    picks = rng.choices(range(2, args.pilots + 2), weights=weights, k=args.times)
+
+    def times():
+        for tid, uid in enumerate(picks, 1):
+            rid = rng.randrange(1, args.rounds + 1)
+            created = round_dates[rid - 1] + timedelta(seconds=rng.randrange(21 * 86400))
+            roll = rng.random()
+            if roll < 0.80 and (uid, rid) not in approved:
+                approved.add((uid, rid))
+                status = "approved"
+            elif roll < 0.80:
+                status = "superseded"
+            elif roll < 0.95:
+                status = "pending"
+            else:
+                status = "rejected"
+            yield {"id": tid, "user_id": uid, "round_id": rid, "status": status,
+                   "raw_time_ms": rng.randrange(55_000, 140_000), "penalties": rng.choice((0, 0, 0, 0, 1, 2)),
+                   "bike": rng.choice(BIKES),
+                   "youtube_link": f"https://youtu.be/bench{tid:07d}" if rng.random() < 0.3 else None,
+                   "created_at": min(created, now)}
+
+    # Fils de discussion : messages pilote / admin répartis au hasard sur les chronos
+    def messages():
+        if not args.times:
+            return
+        for mid in range(1, args.messages + 1):
+            yield {"id": mid, "time_entry_id": rng.randrange(1, args.times + 1),
+                   "author": rng.choice(("pilot", "admin")), "body": f"Message {mid}",
+                   "created_at": when()}
+
+    def logins():
+        for lid in range(1, args.logins + 1):
+            ua = rng.choice(UAS)
+            yield {"id": lid, "user_id": picks[rng.randrange(len(picks))] if picks else 1,
+                   "created_at": when(), "ua": ua, "ua_type": wp._ua_type(ua)}
+
+    print(f"Seed {args.seed} → {args.db}")
+    step("pilotes", insert_chunks, wp, wp.User.__table__, users())
+    step("manches", insert_chunks, wp, wp.Round.__table__, rounds())
+    step("chronos", insert_chunks, wp, wp.TimeEntry.__table__, times())
+    step("messages", insert_chunks, wp, wp.ChronoMessage.__table__, messages())
+    step("connexions", insert_chunks, wp, wp.LoginEvent.__table__, logins())
+
+    def standings():
+        for rid in range(1, args.rounds + 1):
+            wp.rebuild_round_standings(rid)
+        seasons = sorted({str(d.year) for d in round_dates})
+        for season in seasons:
+            wp.rebuild_season_standings(season)
+        wp.db.session.commit()
+        return wp.RoundStanding.query.count()
+
+    if wp.db.engine.dialect.name == "postgresql":
+        # ids explicites : on recale les séquences pour les insertions suivantes
+        for table in (wp.User, wp.Round, wp.TimeEntry, wp.ChronoMessage, wp.LoginEvent):
+            name = table.__tablename__
+            wp.db.session.execute(wp.text(
+                f"SELECT setval(pg_get_serial_sequence('\"{name}\"', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM \"{name}\"), 1))"
+            ))
+        wp.db.session.commit()
+
+    step("classements", standings)
+    step("jours agrégés", wp.compact_activity)
+    wp.db.session.commit()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_db_argument(ap)
+    ap.add_argument("--pilots", type=int, default=10_000)
+    ap.add_argument("--times", type=int, default=100_000)
+    ap.add_argument("--logins", type=int, default=1_000_000)
+    ap.add_argument("--rounds", type=int, default=40)
+    ap.add_argument("--messages", type=int, default=20_000)
+    ap.add_argument("--days", type=int, default=365)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--reset", action="store_true", help="vide la base avant de générer")
+    args = ap.parse_args()
+
+    path = sqlite_path(args.db)
+    if args.reset and path:
+        for suffix in ("", "-journal", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    wp = load_app(args.db)
+    with wp.app.app_context():
+        if args.reset and not path:
+            wp.db.drop_all()
+            wp.db.create_all()
+        if wp.User.query.first() is not None:
+            print("Base non vide : relancer avec --reset pour la régénérer.")
+            return 1
+        t0 = time.perf_counter()
+        seed(wp, args)
+        print(f"Terminé en {time.perf_counter() - t0:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
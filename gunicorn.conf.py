@@ -0,0 +1,24 @@
+# Configuration gunicorn (chargée automatiquement depuis le dossier courant).
+#
+# Les flux SSE (/rounds/<id>/stream) gardent des connexions ouvertes longtemps :
+# avec des workers "sync", chaque spectateur bloquerait un worker entier.
+# gthread : un flux inactif n'immobilise qu'un thread endormi sur sa file, et le
+# travail CPU en arrière-plan (variantes WebP des plans, Pillow) tourne sur de vrais
+# threads sans geler les autres requêtes — ce que des workers gevent (greenlets)
+# ne garantissent pas. Spectateurs simultanés ≈ WEB_CONCURRENCY × GUNICORN_THREADS.
+import os
+
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "64"))
+
+# Un flux SSE inactif n'envoie qu'un ": ping" toutes les 15 s
+timeout = 60
+graceful_timeout = 20
+keepalive = 5
+
+
+def worker_exit(server, worker):
+    # écrit les événements encore en mémoire (connexions…) avant l'arrêt du worker
+    from app import flush_event_recorders
+    flush_event_recorders()